@@ -6,7 +6,11 @@ import sys
 import datetime as dt
 from typing import Optional, Tuple, List
 
-from geopy.distance import geodesic
+import numpy as np
+
+import daily_aggregates
+from distance import DEFAULT_METHOD, METHODS, distances_km
+from station_distances import STATION_DISTANCES_PATH, STATIONS_CSV_PATH, load_station_distances, pair_distances
 
 
 def repo_root() -> str:
@@ -18,16 +22,9 @@ def ensure_dir(path: str) -> None:
         os.makedirs(path)
 
 
-def compute_distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> Optional[float]:
-    try:
-        a1 = (float(lat1), float(lon1))
-        a2 = (float(lat2), float(lon2))
-    except (TypeError, ValueError):
-        return None
-    try:
-        return round(geodesic(a1, a2).km, 3)
-    except Exception:
-        return None
+def compute_distance_km(lat1: float, lon1: float, lat2: float, lon2: float, method: str = DEFAULT_METHOD) -> Optional[float]:
+    d = distances_km(lat1, lon1, lat2, lon2, method=method)[0]
+    return None if np.isnan(d) else round(float(d), 3)
 
 
 def backup_db(db_path: str) -> str:
@@ -41,9 +38,9 @@ def backup_db(db_path: str) -> str:
     return dst
 
 
-def fetch_rows_to_update(conn: sqlite3.Connection, table: str) -> List[Tuple[int, float, float, float, float]]:
+def fetch_rows_to_update(conn: sqlite3.Connection, table: str) -> List[Tuple[int, str, str, float, float, float, float]]:
     sql = f"""
-        SELECT uid, lat_start, lon_start, lat_end, lon_end
+        SELECT uid, start_station, end_station, lat_start, lon_start, lat_end, lon_end
         FROM {table}
         WHERE distance IS NULL
           AND lat_start IS NOT NULL AND lon_start IS NOT NULL
@@ -53,7 +50,21 @@ def fetch_rows_to_update(conn: sqlite3.Connection, table: str) -> List[Tuple[int
     return cur.fetchall()
 
 
-def backfill_distances(db_path: str, table: str = "bike_rides", *, dry_run: bool = False, do_backup: bool = True) -> int:
+def backfill_distances(
+    db_path: str,
+    table: str = "bike_rides",
+    *,
+    dry_run: bool = False,
+    do_backup: bool = True,
+    method: str = DEFAULT_METHOD,
+    stations_csv: Optional[str] = None,
+    distances_cache: Optional[str] = None,
+) -> int:
+    """Fill NULL ``distance`` values; returns the number of rows (to be) updated.
+
+    With ``stations_csv`` distances are looked up in the station-pair table
+    (see ``station_distances``) and only unknown pairs are computed live.
+    """
     if not os.path.exists(db_path):
         raise FileNotFoundError(db_path)
 
@@ -66,10 +77,15 @@ def backfill_distances(db_path: str, table: str = "bike_rides", *, dry_run: bool
         rows = fetch_rows_to_update(conn, table)
         print(f"Rows with NULL distance and valid coords: {len(rows)}")
         updates: List[Tuple[float, int]] = []
-        for uid, lat1, lon1, lat2, lon2 in rows:
-            d = compute_distance_km(lat1, lon1, lat2, lon2)
-            if d is not None:
-                updates.append((d, uid))
+        if rows:
+            uids, start, end, lat1, lon1, lat2, lon2 = zip(*rows)
+            if stations_csv and os.path.exists(stations_csv):
+                pairs = load_station_distances(stations_csv, distances_cache, method)
+                dists = pair_distances(pairs, start, end, lat1, lon1, lat2, lon2)
+            else:
+                dists = distances_km(lat1, lon1, lat2, lon2, method=method)
+            dists = np.round(dists, 3)
+            updates = [(float(d), uid) for d, uid in zip(dists, uids) if not np.isnan(d)]
 
         print(f"Will update {len(updates)} rows")
 
@@ -77,10 +93,17 @@ def backfill_distances(db_path: str, table: str = "bike_rides", *, dry_run: bool
             return len(updates)
 
         with conn:
+            # Days whose distance sums change (a superset: all rows still missing a distance)
+            days = []
+            if table == "bike_rides" and daily_aggregates.has_tables(conn):
+                days = [r[0] for r in conn.execute(
+                    "SELECT DISTINCT ride_date FROM bike_rides WHERE distance IS NULL"
+                )]
             conn.executemany(
                 f"UPDATE {table} SET distance = ? WHERE uid = ?",
                 updates,
             )
+            daily_aggregates.refresh_days(conn, days)
         return len(updates)
     finally:
         conn.close()
@@ -92,9 +115,20 @@ def main(argv: Optional[list] = None) -> int:
     parser.add_argument("--table", default="bike_rides", help="Table name")
     parser.add_argument("--dry-run", action="store_true", help="Print how many rows would be updated, without changing the DB")
     parser.add_argument("--no-backup", action="store_true", help="Do not create a backup before updating")
+    parser.add_argument("--method", choices=METHODS, default=DEFAULT_METHOD, help="Distance formula (default: vincenty)")
+    parser.add_argument("--stations", default=STATIONS_CSV_PATH, help="Stations coordinates CSV used for the station-pair distance table")
+    parser.add_argument("--distances-cache", default=STATION_DISTANCES_PATH, help="Persisted station-pair distance table (.npz)")
     args = parser.parse_args(argv)
 
-    updated = backfill_distances(args.db, args.table, dry_run=args.dry_run, do_backup=not args.no_backup)
+    updated = backfill_distances(
+        args.db,
+        args.table,
+        dry_run=args.dry_run,
+        do_backup=not args.no_backup,
+        method=args.method,
+        stations_csv=args.stations,
+        distances_cache=args.distances_cache,
+    )
     print(f"Updated rows: {updated}")
     return 0
 
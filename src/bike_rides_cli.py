@@ -1,10 +1,10 @@
 import argparse
+import contextlib
 import os
 import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
 from urllib.parse import urlparse
 
-import pandas as pd
-
 from data_load_sqlite import (
     URL,
     repo_root,
@@ -12,16 +12,91 @@ from data_load_sqlite import (
     ensure_dir,
     get_all_csv_urls,
     pick_latest_csv,
-    download_file,
+    download_files,
     extract_dt_from_filename,
-    transform_data,
-    load_to_sqlite,
+    ingest_csv,
+    transform_csv,
+    load_cleaned_csv,
+    BulkLoader,
 )
- 
-
-
-def _process_paths(paths: list[str], transform: bool, to_sqlite: bool) -> None:
-    """Transform CSV files and optionally load them to SQLite."""
+from station_distances import STATION_DISTANCES_PATH, load_station_distances
+
+
+def _cleaned_path(interim_dir: str, raw_path: str) -> str:
+    return os.path.join(interim_dir, os.path.splitext(os.path.basename(raw_path))[0] + "_clean.csv")
+
+
+def _file_label(raw_path: str) -> str:
+    filename = os.path.basename(raw_path)
+    dtv = extract_dt_from_filename(filename)
+    dt_label = dtv.strftime("%Y-%m-%d %H:%M:%S") if dtv else "unknown date"
+    return f"{filename} ({dt_label})"
+
+
+def _transform_worker(raw_path: str, stations_csv: str, cleaned_path: str, **kwargs) -> dict:
+    """Process-pool entry point: run ``transform_csv`` and return its row stats."""
+    stats: dict = {}
+    transform_csv(raw_path, stations_csv, cleaned_path, stats=stats, **kwargs)
+    return stats
+
+
+def _transform_in_pool(
+    paths: list[str],
+    stations_csv: str,
+    interim_dir: str,
+    db_path: str,
+    loader: BulkLoader | None,
+    chunk_size: int | None,
+    workers: int,
+) -> None:
+    """Transform files in a process pool; this process is the only SQLite writer.
+
+    Workers write cleaned CSVs (skipping rides already committed to the DB);
+    the parent loads each one as soon as it is ready, strictly in file order.
+    """
+    # Build the station distance table once instead of racing to do it in workers
+    load_station_distances(stations_csv, STATION_DISTANCES_PATH)
+    filter_db = db_path if loader is not None and not loader.defer_index else None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                _transform_worker,
+                raw_path,
+                stations_csv,
+                _cleaned_path(interim_dir, raw_path),
+                filter_db=filter_db,
+                chunk_size=chunk_size,
+                distances_cache=STATION_DISTANCES_PATH,
+            )
+            for raw_path in paths
+        ]
+        for raw_path, future in zip(paths, futures):
+            stats = future.result()
+            if loader is not None:
+                inserted = load_cleaned_csv(_cleaned_path(interim_dir, raw_path), loader, chunk_size)
+                loader.record_file(raw_path, stats["rows_read"], inserted)
+            print(f"Processed file: {_file_label(raw_path)}")
+
+
+def _process_paths(
+    paths: list[str],
+    transform: bool,
+    to_sqlite: bool,
+    chunk_size: int | None = None,
+    defer_index: bool = False,
+    workers: int = 1,
+    force: bool = False,
+) -> None:
+    """Transform CSV files and optionally load them to SQLite.
+
+    All files are loaded over a single ``BulkLoader`` session. ``chunk_size``
+    streams each file in chunks of that many rows; ``defer_index`` builds the
+    uid index once at the end of a first-time load; ``workers`` > 1 runs the
+    transform stage in a process pool.
+
+    When loading to SQLite, files recorded in the ``ingested_files`` manifest
+    with the same size and content hash are skipped unless ``force`` is set.
+    """
     root = repo_root()
     # Use consolidated, up-to-date station coordinates
     stations_csv = os.path.join(root, "data", "bike_stations_coords.csv")
@@ -32,40 +107,66 @@ def _process_paths(paths: list[str], transform: bool, to_sqlite: bool) -> None:
     if to_sqlite:
         ensure_dir(os.path.dirname(db_path))
 
-    for raw_path in paths:
-        filename = os.path.basename(raw_path)
-        dtv = extract_dt_from_filename(filename)
-        dt_label = dtv.strftime("%Y-%m-%d %H:%M:%S") if dtv else "unknown date"
-
-        if transform or to_sqlite:
-            df = pd.read_csv(raw_path, encoding="utf-8")
-
-            cleaned = transform_data(df, stations_csv)
-            cleaned_name = os.path.splitext(filename)[0] + "_clean.csv"
-            cleaned_path = os.path.join(interim_dir, cleaned_name)
-            cleaned.to_csv(cleaned_path, index=False)
-
-            if to_sqlite:
-                load_to_sqlite(cleaned, db_path)
-        # When transform is False we simply keep the raw download.
-
-
-def _download_and_process(urls: list[str], transform: bool, to_sqlite: bool) -> None:
-    session = make_session()
+    session = BulkLoader(db_path, defer_index=defer_index) if to_sqlite else contextlib.nullcontext()
+    with session as loader:
+        if loader is not None and not force:
+            pending = [p for p in paths if loader.needs_ingest(p)]
+            for raw_path in paths:
+                if raw_path not in pending:
+                    print(f"Skipped unchanged file: {_file_label(raw_path)}")
+            paths = pending
+        if workers > 1 and len(paths) > 1 and (transform or to_sqlite):
+            _transform_in_pool(paths, stations_csv, interim_dir, db_path, loader, chunk_size, workers)
+        else:
+            for raw_path in paths:
+                if transform or to_sqlite:
+                    stats: dict = {}
+                    before = loader.rows_inserted if loader is not None else 0
+                    ingest_csv(
+                        raw_path,
+                        stations_csv,
+                        _cleaned_path(interim_dir, raw_path),
+                        db_path if to_sqlite else None,
+                        chunk_size=chunk_size,
+                        distances_cache=STATION_DISTANCES_PATH,
+                        loader=loader,
+                        stats=stats,
+                    )
+                    if loader is not None:
+                        loader.record_file(raw_path, stats["rows_read"], loader.rows_inserted - before)
+                # When transform is False we simply keep the raw download.
+                print(f"Processed file: {_file_label(raw_path)}")
+    if loader is not None:
+        print(loader.summary())
+
+
+def _download_and_process(urls: list[str], transform: bool, to_sqlite: bool, parallel: int = 4, **options) -> None:
+    """Download ``urls`` concurrently, then hand them to ``_process_paths`` with ``options``."""
+    session = make_session(pool_maxsize=max(10, parallel))
     root = repo_root()
     raw_base = os.path.join(root, "data", "raw")
 
-    paths: list[str] = []
+    jobs: list[tuple[str, str]] = []
     for url in urls:
         filename = os.path.basename(urlparse(url).path)
         dtv = extract_dt_from_filename(filename)
         year = dtv.year if dtv else dt.datetime.now().year
         raw_dir = os.path.join(raw_base, str(year))
         ensure_dir(raw_dir)
-        path = download_file(url, raw_dir, session)
-        paths.append(path)
+        jobs.append((url, raw_dir))
+    paths = download_files(jobs, session, workers=parallel)
+
+    _process_paths(paths, transform, to_sqlite, **options)
+
 
-    _process_paths(paths, transform, to_sqlite)
+def _load_options(args: argparse.Namespace) -> dict:
+    """Transform/load options shared by all subcommands."""
+    return {
+        "chunk_size": args.chunk_size,
+        "defer_index": args.defer_index,
+        "workers": args.workers,
+        "force": args.force,
+    }
 
 
 def cmd_latest(args: argparse.Namespace) -> None:
@@ -74,7 +175,7 @@ def cmd_latest(args: argparse.Namespace) -> None:
     url, _ = pick_latest_csv(csv_urls)
     if not url:
         raise SystemExit("No CSV links found")
-    _download_and_process([url], args.transform, args.sqlite)
+    _download_and_process([url], args.transform, args.sqlite, parallel=args.parallel, **_load_options(args))
 
 
 def cmd_date(args: argparse.Namespace) -> None:
@@ -89,13 +190,13 @@ def cmd_date(args: argparse.Namespace) -> None:
             matches.append(u)
     if not matches:
         raise SystemExit(f"No CSV found for {target}")
-    _download_and_process(matches, args.transform, args.sqlite)
+    _download_and_process(matches, args.transform, args.sqlite, parallel=args.parallel, **_load_options(args))
 
 
 def cmd_all(args: argparse.Namespace) -> None:
     session = make_session()
     urls = get_all_csv_urls(URL, session)
-    _download_and_process(urls, args.transform, args.sqlite)
+    _download_and_process(urls, args.transform, args.sqlite, parallel=args.parallel, **_load_options(args))
 
 
 def cmd_load(args: argparse.Namespace) -> None:
@@ -109,10 +210,14 @@ def cmd_load(args: argparse.Namespace) -> None:
     ]
     if not paths:
         raise SystemExit(f"No CSV files in {folder}")
-    # Process each file and print a simple progress line for load-folder mode
-    for p in paths:
-        _process_paths([p], args.transform, args.sqlite)
-        print(f"Processed file: {os.path.basename(p)}")
+    _process_paths(paths, args.transform, args.sqlite, **_load_options(args))
+
+
+def _positive_int(value: str) -> int:
+    n = int(value)
+    if n <= 0:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got {value}")
+    return n
 
 
 def build_parser() -> argparse.ArgumentParser:
@@ -132,15 +237,50 @@ def build_parser() -> argparse.ArgumentParser:
         action="store_false",
         help="Do not load data into SQLite",
     )
+    common.add_argument(
+        "--chunk-size",
+        dest="chunk_size",
+        type=_positive_int,
+        default=None,
+        help="Stream each CSV in chunks of this many rows (bounded memory for large files)",
+    )
+    common.add_argument(
+        "--defer-index",
+        dest="defer_index",
+        action="store_true",
+        help="First-time full load: build the uid index once after all rows are inserted",
+    )
+    common.add_argument(
+        "--workers",
+        dest="workers",
+        type=_positive_int,
+        default=1,
+        help="Transform files in this many processes; SQLite inserts stay serialized in file order",
+    )
+    common.add_argument(
+        "--force",
+        dest="force",
+        action="store_true",
+        help="Reprocess files even if the ingestion manifest says they are unchanged",
+    )
+
+    download = argparse.ArgumentParser(add_help=False)
+    download.add_argument(
+        "--parallel",
+        dest="parallel",
+        type=_positive_int,
+        default=4,
+        help="Number of concurrent downloads (default: 4)",
+    )
 
-    latest = sub.add_parser("latest", parents=[common], help="Download latest CSV")
+    latest = sub.add_parser("latest", parents=[common, download], help="Download latest CSV")
     latest.set_defaults(func=cmd_latest)
 
-    date = sub.add_parser("date", parents=[common], help="Download CSV for a specific date")
+    date = sub.add_parser("date", parents=[common, download], help="Download CSV for a specific date")
     date.add_argument("date", help="Date in YYYY-MM-DD format")
     date.set_defaults(func=cmd_date)
 
-    all_cmd = sub.add_parser("all", parents=[common], help="Download all available CSV files")
+    all_cmd = sub.add_parser("all", parents=[common, download], help="Download all available CSV files")
     all_cmd.set_defaults(func=cmd_all)
 
     load = sub.add_parser("load-folder", parents=[common], help="Process existing CSV files in a folder")
@@ -5,16 +5,41 @@ This script compares the two most recent JSON files downloaded from the
 Nextbike API and records any bike arrivals or departures into an SQLite
 database table called ``bike_status_changes``.
 
+The parsed bike map of the last processed snapshot is kept in the database
+(``bike_state`` plus its snapshot in ``bike_state_snapshot``), so each run
+parses only the snapshots fetched since then and diffs them in order. Events
+and the new state are committed together: no snapshot pair is skipped or
+counted twice, even across failed or missed runs.
+
+Every city in the snapshots is tracked separately (events carry their
+``city``), or only those given with ``--city``.
+
+Usage:
+    python src/bike_status_changes.py                # new snapshots since the last run
+    python src/bike_status_changes.py --city Wrocław --city "Siechnice (WRM)"
+    python src/bike_status_changes.py --replay [--reset] [--workers 4]
+
+``--replay`` is for backlogs (after an outage, or with ``--reset`` to rebuild
+the table from every snapshot): snapshots are parsed in a process pool,
+diffed in fetch order and written in large transactions.
+
 The database path defaults to ``data/processed/bike_status.db`` as defined in
 ``docs/SPECS.md``.
 """
 from __future__ import annotations
 
-import json
+import argparse
+import itertools
 import logging
 import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, Iterable, List, Tuple
+from typing import Collection, Dict, Iterable, Iterator, List, Tuple
+
+import snapshot_format
+import snapshot_index
 
 # Resolve repo root so defaults work regardless of CWD
 REPO_ROOT = Path(__file__).resolve().parents[1]
@@ -22,85 +47,113 @@ REPO_ROOT = Path(__file__).resolve().parents[1]
 DEFAULT_DATA_DIR = REPO_ROOT / "data" / "raw" / "api"
 DEFAULT_DB_PATH = REPO_ROOT / "data" / "processed" / "bike_status.db"
 
+# Snapshots per replay transaction
+REPLAY_BATCH = 500
+REPLAY_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",
+)
+
+# Events and state recorded before per-city tracking covered this city only
+LEGACY_CITY = "Wrocław"
+
+# City name -> bike_id -> station and bike metadata
+CityBikes = Dict[str, Dict[str, Dict[str, object]]]
+
 logger = logging.getLogger(__name__)
 
 
-def load_snapshot(path: Path) -> Tuple[str, Dict[str, Dict[str, object]]]:
-    """Load single snapshot returning timestamp and mapping of bikes.
+# What reading a truncated, corrupt or unexpectedly laid out snapshot raises
+UNREADABLE_SNAPSHOT = (OSError, EOFError, ValueError, KeyError, IndexError, TypeError, AttributeError)
+
+
+def load_snapshot(path: Path, cities: Collection[str] | None = None) -> Tuple[str, CityBikes]:
+    """Load single snapshot returning timestamp and mapping of bikes per city.
+
+    Any format written by ``fetch_nextbike`` is accepted (see
+    ``snapshot_format``); compact snapshots skip parsing the API response.
 
     Returns
     -------
     tuple
-        ``(timestamp_iso, bikes)`` where ``bikes`` maps ``bike_id`` to info
+        ``(timestamp_iso, bikes)`` where ``bikes`` maps each city name (of
+        ``cities``, or all of them) to a mapping of ``bike_id`` to info
         about station and bike metadata.
     """
-    with open(path, "r", encoding="utf-8") as f:
-        payload = json.load(f)
-
-    timestamp = payload.get("_fetched_at")
-    places = payload["data"][0]["cities"][0]["places"]
-    bikes: Dict[str, Dict[str, object]] = {}
-
-    for place in places:
-        bikes_list = place.get("bikes") or []
-        bike_numbers = place.get("bikeNumbers") or place.get("bike_numbers") or []
-        # If neither detailed bikes nor numbers are present, skip
-        if not bikes_list and not bike_numbers:
-            continue
-        place_type = place.get("placeType", "") or ""
-        # Treat any freestanding variant uniformly (e.g., FREESTANDING_BIKE, FREESTANDING_ELECTRIC_BIKE)
-        if isinstance(place_type, str) and place_type.upper().startswith("FREESTANDING"):
-            station_name = "freestanding"
-            station_id = "freestanding"
-        else:
-            station_name = place.get("name")
-            station_id = str(place.get("uid"))
-        lat = place["geoCoords"]["lat"]
-        lon = place["geoCoords"]["lng"]
-        if bikes_list:
-            for bike in bikes_list:
-                bike_id = str(bike.get("number"))
-                bike_type_field = str(bike.get("bikeType", "")).upper()
-                bike_type = "electric" if bike_type_field.startswith("ELECTRIC") else "standard"
-                bikes[bike_id] = {
-                    "station_name": station_name,
-                    "station_id": station_id,
-                    "lat": lat,
-                    "lon": lon,
-                    "bike_type": bike_type,
-                    "battery": bike.get("battery"),
-                }
-        else:
-            # Only numbers provided (typically stations) — add minimal entries
-            for num in bike_numbers:
-                bike_id = str(num)
-                bikes[bike_id] = {
-                    "station_name": station_name,
-                    "station_id": station_id,
-                    "lat": lat,
-                    "lon": lon,
-                    "bike_type": None,
-                    "battery": None,
-                }
-    return timestamp, bikes
+    return snapshot_format.read_bikes(path, bikes_from_payload, cities)
+
+
+def bikes_from_payload(payload: Dict[str, object], cities: Collection[str] | None = None) -> CityBikes:
+    """Map city name -> ``bike_id`` -> station and bike metadata for a raw API response.
+
+    Every city of every domain in the response is included (also those
+    without bikes), unless ``cities`` restricts them.
+    """
+    out: CityBikes = {}
+    for domain in payload.get("data") or []:
+        for city in domain.get("cities") or []:
+            name = str(city.get("name") or "")
+            if cities is not None and name not in cities:
+                continue
+            bikes = out.setdefault(name, {})
+            for place in city.get("places") or []:
+                bikes.update(_place_bikes(place))
+    return out
+
+
+def _place_bikes(place: Dict[str, object]) -> Iterator[Tuple[str, Dict[str, object]]]:
+    """``(bike_id, info)`` of the bikes at one API place."""
+    bikes_list = place.get("bikes") or []
+    bike_numbers = place.get("bikeNumbers") or place.get("bike_numbers") or []
+    # If neither detailed bikes nor numbers are present, skip
+    if not bikes_list and not bike_numbers:
+        return
+    place_type = place.get("placeType", "") or ""
+    # Treat any freestanding variant uniformly (e.g., FREESTANDING_BIKE, FREESTANDING_ELECTRIC_BIKE)
+    if isinstance(place_type, str) and place_type.upper().startswith("FREESTANDING"):
+        station_name = "freestanding"
+        station_id = "freestanding"
+    else:
+        station_name = place.get("name")
+        station_id = str(place.get("uid"))
+    lat = place["geoCoords"]["lat"]
+    lon = place["geoCoords"]["lng"]
+    if bikes_list:
+        for bike in bikes_list:
+            bike_type_field = str(bike.get("bikeType", "")).upper()
+            bike_type = "electric" if bike_type_field.startswith("ELECTRIC") else "standard"
+            yield str(bike.get("number")), {
+                "station_name": station_name,
+                "station_id": station_id,
+                "lat": lat,
+                "lon": lon,
+                "bike_type": bike_type,
+                "battery": bike.get("battery"),
+            }
+    else:
+        # Only numbers provided (typically stations) — add minimal entries
+        for num in bike_numbers:
+            yield str(num), {
+                "station_name": station_name,
+                "station_id": station_id,
+                "lat": lat,
+                "lon": lon,
+                "bike_type": None,
+                "battery": None,
+            }
 
 
 def get_latest_files(data_dir: Path, count: int = 2) -> List[Path]:
     """Return ``count`` most recent JSON files in ``data_dir``.
 
     Sorting is based on the ``_fetched_at`` timestamp stored inside each
-    snapshot instead of the filename.
+    snapshot instead of the filename. The snapshot index written by
+    ``fetch_nextbike`` is used when present, so this does not depend on the
+    number of snapshots; otherwise only the bytes holding ``_fetched_at``
+    are read from each file (see ``snapshot_index``).
     """
-    meta = []
-    for path in data_dir.glob("bike_rides_*.json"):
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                payload = json.load(f)
-            meta.append((payload.get("_fetched_at", ""), path))
-        except (OSError, json.JSONDecodeError):
-            continue
-    meta.sort(key=lambda x: x[0])
-    return [p for _, p in meta[-count:]]
+    return snapshot_index.latest(data_dir, count)
 
 
 def diff_snapshots(
@@ -157,6 +210,122 @@ def diff_snapshots(
     return events
 
 
+def diff_cities(prev: CityBikes, curr: CityBikes, timestamp: str) -> List[Dict[str, object]]:
+    """``diff_snapshots`` per city, with the ``city`` of each event.
+
+    Only cities in both snapshots are compared: a city new to the state
+    starts without events (like the first run) and one missing from
+    ``curr`` (not fetched) has none.
+    """
+    events: List[Dict[str, object]] = []
+    for city, bikes in curr.items():
+        if city in prev:
+            events.extend({**e, "city": city} for e in diff_snapshots(prev[city], bikes, timestamp))
+    return events
+
+
+BIKE_FIELDS = ["station_name", "station_id", "lat", "lon", "bike_type", "battery"]
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS bike_status_changes (
+        uid INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT,
+        bike_id TEXT,
+        event_type TEXT,
+        station_name TEXT,
+        station_id TEXT,
+        lat REAL,
+        lon REAL,
+        bike_type TEXT,
+        battery REAL,
+        city TEXT
+    )
+    """,
+    # Bikes of the last processed snapshot
+    """
+    CREATE TABLE IF NOT EXISTS bike_state (
+        city TEXT,
+        bike_id TEXT,
+        station_name TEXT,
+        station_id TEXT,
+        lat REAL,
+        lon REAL,
+        bike_type TEXT,
+        battery REAL,
+        PRIMARY KEY (city, bike_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS bike_state_snapshot (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        file TEXT,
+        fetched_at TEXT
+    )
+    """,
+]
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def connect(db_path: Path) -> sqlite3.Connection:
+    """Open the status DB, creating its tables if needed.
+
+    DBs from before per-city tracking get a ``city`` column; their events
+    and state, which only covered the first city, are assigned ``LEGACY_CITY``.
+    """
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    with conn:
+        state_columns = _columns(conn, "bike_state")
+        legacy_state = bool(state_columns) and "city" not in state_columns
+        if legacy_state:
+            conn.execute("ALTER TABLE bike_state RENAME TO bike_state_legacy")
+        for sql in SCHEMA:
+            conn.execute(sql)
+        if "city" not in _columns(conn, "bike_status_changes"):
+            conn.execute("ALTER TABLE bike_status_changes ADD COLUMN city TEXT")
+            conn.execute("UPDATE bike_status_changes SET city = ?", (LEGACY_CITY,))
+        if legacy_state:
+            fields = ", ".join(BIKE_FIELDS)
+            conn.execute(
+                f"INSERT INTO bike_state (city, bike_id, {fields}) SELECT ?, bike_id, {fields} FROM bike_state_legacy",
+                (LEGACY_CITY,),
+            )
+            conn.execute("DROP TABLE bike_state_legacy")
+    return conn
+
+
+def insert_events(conn: sqlite3.Connection, events: List[Dict[str, object]]) -> int:
+    """Insert events within the caller's transaction; returns the number of records."""
+    conn.executemany(
+        """
+        INSERT INTO bike_status_changes (
+            timestamp, bike_id, event_type, station_name, station_id,
+            lat, lon, bike_type, battery, city
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                e["timestamp"],
+                e["bike_id"],
+                e["event_type"],
+                e["station_name"],
+                e["station_id"],
+                e["lat"],
+                e["lon"],
+                e["bike_type"],
+                e["battery"],
+                e.get("city"),
+            )
+            for e in events
+        ],
+    )
+    return len(events)
+
+
 def save_events_to_db(events: Iterable[Dict[str, object]], db_path: Path) -> int:
     """Insert events into SQLite, creating table if needed.
 
@@ -166,78 +335,353 @@ def save_events_to_db(events: Iterable[Dict[str, object]], db_path: Path) -> int
     events_list = list(events)
     if not events_list:
         return 0
-    db_path.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(db_path)
+    conn = connect(db_path)
     try:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS bike_status_changes (
-                uid INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT,
-                bike_id TEXT,
-                event_type TEXT,
-                station_name TEXT,
-                station_id TEXT,
-                lat REAL,
-                lon REAL,
-                bike_type TEXT,
-                battery REAL
-            )
-            """
+        with conn:
+            insert_events(conn, events_list)
+    finally:
+        conn.close()
+    return len(events_list)
+
+
+def load_state(conn: sqlite3.Connection) -> Tuple[str, str, CityBikes] | None:
+    """``(file, fetched_at, bikes per city)`` of the last processed snapshot, or None."""
+    row = conn.execute("SELECT file, fetched_at FROM bike_state_snapshot WHERE id = 1").fetchone()
+    if row is None:
+        return None
+    bikes: CityBikes = {}
+    for city, bike_id, *values in conn.execute(f"SELECT city, bike_id, {', '.join(BIKE_FIELDS)} FROM bike_state"):
+        bikes.setdefault(city, {})[bike_id] = dict(zip(BIKE_FIELDS, values))
+    return row[0], row[1], bikes
+
+
+def save_state(
+    conn: sqlite3.Connection,
+    file: str,
+    fetched_at: str,
+    prev: CityBikes | None,
+    curr: CityBikes,
+) -> None:
+    """Make ``curr`` the stored state, within the caller's transaction.
+
+    With ``prev`` (the stored state) only removed and changed bikes are written.
+    """
+    if prev is None:
+        conn.execute("DELETE FROM bike_state")
+        prev = {}
+    conn.executemany("DELETE FROM bike_state WHERE city = ?", [(c,) for c in prev.keys() - curr.keys()])
+    for city, bikes in curr.items():
+        before = prev.get(city, {})
+        conn.executemany(
+            "DELETE FROM bike_state WHERE city = ? AND bike_id = ?", [(city, b) for b in before.keys() - bikes.keys()]
         )
         conn.executemany(
-            """
-            INSERT INTO bike_status_changes (
-                timestamp, bike_id, event_type, station_name, station_id,
-                lat, lon, bike_type, battery
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
+            f"INSERT OR REPLACE INTO bike_state (city, bike_id, {', '.join(BIKE_FIELDS)}) "
+            f"VALUES ({', '.join('?' * (len(BIKE_FIELDS) + 2))})",
             [
-                (
-                    e["timestamp"],
-                    e["bike_id"],
-                    e["event_type"],
-                    e["station_name"],
-                    e["station_id"],
-                    e["lat"],
-                    e["lon"],
-                    e["bike_type"],
-                    e["battery"],
-                )
-                for e in events_list
+                (city, bike_id, *(info[k] for k in BIKE_FIELDS))
+                for bike_id, info in bikes.items()
+                if before.get(bike_id) != info
             ],
         )
-        conn.commit()
-    finally:
-        conn.close()
-    return len(events_list)
+    conn.execute(
+        "INSERT OR REPLACE INTO bike_state_snapshot (id, file, fetched_at) VALUES (1, ?, ?)", (file, fetched_at)
+    )
+
+
+def _only(bikes: CityBikes, cities: Collection[str] | None) -> CityBikes:
+    return bikes if cities is None else {c: b for c, b in bikes.items() if c in cities}
+
+
+class StatusTracker:
+    """Bike state of the last processed snapshot, kept in memory over an open DB connection.
+
+    ``main`` uses one per run; the pipeline daemon keeps one for its whole
+    life, so each new snapshot costs only its diff and insert. Only
+    ``cities`` are tracked (all if None). A city missing from a snapshot
+    (e.g. its endpoint failed) keeps its state until it is back.
+    """
+
+    def __init__(
+        self,
+        data_dir: Path = DEFAULT_DATA_DIR,
+        db_path: Path = DEFAULT_DB_PATH,
+        cities: Collection[str] | None = None,
+    ) -> None:
+        self.data_dir = Path(data_dir)
+        self.cities = None if cities is None else frozenset(cities)
+        self.conn = connect(db_path)
+        # (file, fetched_at, bikes per city) of the last processed snapshot
+        self.state = load_state(self.conn)
+        # Bikes in bike_state (None: nothing stored yet, write all)
+        self.stored: CityBikes | None = None if self.state is None else self.state[2]
+        if self.state is not None:
+            # Cities no longer tracked are dropped from bike_state on the next save
+            self.state = (*self.state[:2], _only(self.state[2], self.cities))
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "StatusTracker":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def process(self, path: Path, fetched_at: str | None = None, bikes: CityBikes | None = None) -> int:
+        """Record the events from the state to snapshot ``path`` and make it the state.
+
+        ``bikes`` (with ``fetched_at``) skips loading the snapshot. Events
+        and the new state are committed together; returns the number of events.
+        """
+        if bikes is None:
+            fetched_at, bikes = load_snapshot(path, self.cities)
+        bikes = _only(bikes, self.cities)
+        fetched_at = fetched_at or ""
+        if self.state is not None:
+            events = diff_cities(self.state[2], bikes, fetched_at)
+            bikes = {**self.state[2], **bikes}
+        else:
+            events = []
+        with self.conn:
+            written = insert_events(self.conn, events)
+            save_state(self.conn, path.name, fetched_at, self.stored, bikes)
+        self.state = (path.name, fetched_at, bikes)
+        self.stored = bikes
+        return written
+
+    def skip(self, path: Path, fetched_at: str) -> None:
+        """Move the state past unreadable snapshot ``path``, keeping the bikes.
+
+        The next snapshot is diffed against the last readable one, and
+        ``path`` is not picked up again.
+        """
+        if self.state is None:
+            return
+        with self.conn:
+            save_state(self.conn, path.name, fetched_at, self.stored, self.state[2])
+        self.state = (path.name, fetched_at, self.state[2])
+        self.stored = self.state[2]
+
+    def catch_up(self) -> Dict[str, object]:
+        """Process the snapshots fetched after the state (see ``main``).
+
+        A snapshot that cannot be read is logged and skipped (see ``skip``).
+        """
+        if self.state is None:
+            # First run: the older of the two latest snapshots becomes the state
+            files = get_latest_files(self.data_dir, 2)
+            if len(files) < 2:
+                logger.warning("Not enough JSON files to compare in %s", self.data_dir)
+                return {"files": [], "events": 0}
+            try:
+                ts_prev, bikes = load_snapshot(files[0], self.cities)
+                self.state = (files[0].name, ts_prev or "", bikes)
+            except UNREADABLE_SNAPSHOT:
+                # The newer one becomes the state, without events
+                logger.exception("Skipping unreadable snapshot %s", files[0].name)
+            pending = [("", files[1])]
+        else:
+            pending = snapshot_index.since(self.data_dir, self.state[1], self.state[0])
+            if not pending:
+                logger.info("No new snapshots since %s", self.state[0])
+                return {"files": [], "events": 0}
+
+        start = prev_file = self.state[0] if self.state is not None else None
+        processed = [self.data_dir / start] if start else []
+        written = 0
+        for indexed_at, path in pending:
+            try:
+                fetched_at, bikes = load_snapshot(path, self.cities)
+            except UNREADABLE_SNAPSHOT:
+                logger.exception("Skipping unreadable snapshot %s", path.name)
+                self.skip(path, indexed_at)
+                continue
+            n = self.process(path, fetched_at, bikes)
+            logger.info("Processed %s -> %s; recorded %d events", prev_file, path.name, n)
+            written += n
+            prev_file = path.name
+            processed.append(path)
+        logger.info(
+            "Processed %d new snapshot(s) since %s; recorded %d events",
+            len(processed) - (1 if start else 0),
+            start,
+            written,
+        )
+        return {"files": processed, "events": written}
 
 
 def main(
-    data_dir: Path = DEFAULT_DATA_DIR, db_path: Path = DEFAULT_DB_PATH
+    data_dir: Path = DEFAULT_DATA_DIR,
+    db_path: Path = DEFAULT_DB_PATH,
+    cities: Collection[str] | None = None,
 ) -> Dict[str, object]:
-    """Process the latest snapshots and record bike status changes.
+    """Process the snapshots fetched since the last run and record bike status changes.
 
-    Returns a dictionary with ``files`` (list of processed snapshot paths)
-    and ``events`` (number of records written).
+    Only ``cities`` are tracked (all cities in the snapshots if None).
+
+    Returns a dictionary with ``files`` (the previous snapshot followed by
+    the newly processed ones) and ``events`` (number of records written).
+    """
+    with StatusTracker(data_dir, db_path, cities) as tracker:
+        return tracker.catch_up()
+
+
+def _load_or_none(path: Path, cities: Collection[str] | None = None) -> Tuple[str, CityBikes] | None:
+    """``load_snapshot``, or None (logged) if the snapshot cannot be read."""
+    try:
+        return load_snapshot(path, cities)
+    except UNREADABLE_SNAPSHOT:
+        logger.exception("Skipping unreadable snapshot %s", path.name)
+        return None
+
+
+def _parse_in_order(
+    paths: List[Path], workers: int, cities: Collection[str] | None = None
+) -> Iterator[Tuple[Path, Tuple[str, CityBikes] | None]]:
+    """Yield ``(path, load_snapshot(path, cities))`` in order of ``paths`` (None if unreadable).
+
+    With ``workers`` > 1 snapshots are parsed in a process pool, at most a
+    few per worker ahead of the consumer so memory stays bounded.
     """
+    if workers <= 1:
+        for path in paths:
+            yield path, _load_or_none(path, cities)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        todo = iter(paths)
+        ahead = deque((p, pool.submit(_load_or_none, p, cities)) for p in itertools.islice(todo, workers * 4))
+        while ahead:
+            path, future = ahead.popleft()
+            nxt = next(todo, None)
+            if nxt is not None:
+                ahead.append((nxt, pool.submit(_load_or_none, nxt, cities)))
+            yield path, future.result()
 
-    files = get_latest_files(data_dir, 2)
-    if len(files) < 2:
-        logger.warning("Not enough JSON files to compare in %s", data_dir)
-        return {"files": [], "events": 0}
-    ts_prev, prev = load_snapshot(files[0])
-    ts_curr, curr = load_snapshot(files[1])
-    events = diff_snapshots(prev, curr, ts_curr)
-    written = save_events_to_db(events, db_path)
+
+def replay(
+    data_dir: Path = DEFAULT_DATA_DIR,
+    db_path: Path = DEFAULT_DB_PATH,
+    *,
+    reset: bool = False,
+    workers: int = 1,
+    batch_size: int = REPLAY_BATCH,
+    cities: Collection[str] | None = None,
+) -> Dict[str, object]:
+    """Process every snapshot after the stored state (all of them with ``reset``).
+
+    Same events as running ``main`` after each fetch, but the directory is
+    listed once, parsing runs in ``workers`` processes and events plus state
+    are committed every ``batch_size`` snapshots over one connection. With
+    ``reset`` existing events and state are dropped (in the first
+    transaction) and the first snapshot becomes the state.
+
+    Returns ``snapshots`` (number parsed) and ``events`` (records written).
+    """
+    cities = None if cities is None else frozenset(cities)
+    conn = connect(db_path)
+    try:
+        for pragma in REPLAY_PRAGMAS:
+            conn.execute(pragma)
+        state = None if reset else load_state(conn)
+        if state is None:
+            paths = [p for _, p in snapshot_index.ordered(data_dir)]
+            prev = stored = None
+        else:
+            paths = [p for _, p in snapshot_index.since(data_dir, state[1], state[0])]
+            stored = state[2]
+            prev = _only(stored, cities)
+        if reset:
+            conn.execute("DELETE FROM bike_status_changes")
+            conn.execute("DELETE FROM bike_state_snapshot")
+        started = time.perf_counter()
+        written = parsed = 0
+        last = None
+        for path, loaded in _parse_in_order(paths, workers, cities):
+            if loaded is None:
+                continue
+            ts, curr = loaded
+            if prev is not None:
+                written += insert_events(conn, diff_cities(prev, curr, ts))
+                curr = {**prev, **curr}
+            prev, last = curr, (path.name, ts or "")
+            parsed += 1
+            if parsed % batch_size == 0:
+                save_state(conn, *last, stored, prev)
+                conn.commit()
+                stored = prev
+                logger.info("Replayed %d/%d snapshots; %d events so far", parsed, len(paths), written)
+        if last is not None:
+            save_state(conn, *last, stored, prev)
+        conn.commit()
+    finally:
+        conn.close()
     logger.info(
-        "Processed %s and %s; recorded %d events",
-        files[0].name,
-        files[1].name,
+        "Replayed %d snapshots from %s; recorded %d events in %.1fs",
+        parsed,
+        data_dir,
         written,
+        time.perf_counter() - started,
+    )
+    return {"snapshots": parsed, "events": written}
+
+
+def cli(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Record bike arrivals/departures from Nextbike API snapshots.")
+    parser.add_argument("--data-dir", dest="data_dir", type=Path, default=DEFAULT_DATA_DIR, help="Snapshot directory (default: data/raw/api)")
+    parser.add_argument("--db", dest="db_path", type=Path, default=DEFAULT_DB_PATH, help="Path to SQLite DB (default: data/processed/bike_status.db)")
+    parser.add_argument(
+        "--replay",
+        dest="replay",
+        action="store_true",
+        help="Process every snapshot not processed yet in batched transactions",
+    )
+    parser.add_argument(
+        "--reset",
+        dest="reset",
+        action="store_true",
+        help="With --replay, drop recorded events and state and replay the whole directory",
     )
-    return {"files": files, "events": written}
+    parser.add_argument("--workers", dest="workers", type=int, default=1, help="With --replay, parse snapshots in this many processes")
+    parser.add_argument(
+        "--batch",
+        dest="batch_size",
+        type=int,
+        default=REPLAY_BATCH,
+        help=f"With --replay, snapshots per transaction (default: {REPLAY_BATCH})",
+    )
+    parser.add_argument(
+        "--city",
+        dest="cities",
+        action="append",
+        metavar="NAME",
+        help="Track only this city (repeatable; default: every city in the snapshots)",
+    )
+    args = parser.parse_args(argv)
+    if args.reset and not args.replay:
+        parser.error("--reset requires --replay")
+    if args.workers < 1 or args.batch_size < 1:
+        parser.error("--workers and --batch must be at least 1")
+
+    try:
+        from logging_config import setup_logging  # type: ignore
+
+        setup_logging()
+    except Exception:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+    if args.replay:
+        replay(
+            args.data_dir,
+            args.db_path,
+            reset=args.reset,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            cities=args.cities,
+        )
+    else:
+        main(args.data_dir, args.db_path, args.cities)
 
 
 if __name__ == "__main__":
-    main()
+    cli()
@@ -1,10 +1,23 @@
 import argparse
+import bisect
+import heapq
+import itertools
 import json
+import math
+import operator
 import os
 import sqlite3
 import logging
-from datetime import datetime
-from typing import Dict, List, Tuple
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import daily_aggregates
+
+OUTSIDE_STATION = "Poza stacją"
 
 
 def repo_root() -> str:
@@ -16,21 +29,137 @@ def ensure_dir(path: str) -> None:
         os.makedirs(path)
 
 
-def _fetch_one(conn: sqlite3.Connection, sql: str, params: Tuple) -> int:
-    cur = conn.execute(sql, params)
-    row = cur.fetchone()
-    return 0 if row is None or row[0] is None else row[0]
+def _day_columns(conn: sqlite3.Connection, table: str) -> Tuple[str, str]:
+    """SQL expressions for a ride's date and start hour in ``table``.
+
+    Uses the materialized, indexed ``ride_date``/``start_hour`` columns when the
+    table has them, otherwise derives both from ``start_time``.
+    """
+    cols = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+    if "ride_date" in cols and "start_hour" in cols:
+        return "ride_date", "start_hour"
+    return "date(start_time)", "CAST(strftime('%H', start_time) AS INTEGER)"
+
+
+def day_rides_query(conn: sqlite3.Connection, table: str) -> str:
+    """SQL returning every ride of one day (bound to ``?``) that counts towards the metrics."""
+    day_col, hour_col = _day_columns(conn, table)
+    # Global filter: exclude rides with duration <= 2 minutes
+    return (
+        f"SELECT {hour_col}, distance, duration, start_station, end_station "
+        f"FROM {table} WHERE {day_col}=? AND duration > 2"
+    )
+
+
+def _top5(counts: Counter) -> List[Tuple]:
+    """The five largest counts, ties broken by key ascending (like ``ORDER BY n DESC, key``)."""
+    items = list(counts.items())
+    if len(items) > 5:
+        # Only keys reaching the fifth-largest count can place; sort just those
+        fifth = heapq.nlargest(5, counts.values())[-1]
+        items = [kv for kv in items if kv[1] >= fifth]
+    items.sort(key=lambda kv: (-kv[1], kv[0]))
+    return items[:5]
+
+
+def metrics_from_rows(day: str, rows: Iterable[Tuple]) -> Dict:
+    """Compute one day's metrics in a single pass over ``(hour, distance, duration, start, end)`` rows.
+
+    Mirrors the SQL aggregates: NULLs are skipped like ``AVG``/``SUM``/``COUNT(col)``
+    and rounding matches the published JSON.
+    """
+    # Column-wise so that each aggregate is one C-level pass (Counter, fsum, sum)
+    cols = list(zip(*rows)) or [()] * 5
+    return _metrics_from_columns(day, *cols)
+
 
+def _metrics_from_columns(day: str, hour_col, dist_col, dur_col, start_col, end_col) -> Dict:
+    total_rides = len(hour_col)
 
-def _fetch_pairs(conn: sqlite3.Connection, sql: str, params: Tuple) -> List[Tuple]:
-    cur = conn.execute(sql, params)
-    return cur.fetchall()
+    hours = Counter(hour_col)
+    hours.pop(None, None)
+    distances = [d for d in dist_col if d is not None]
+    # duration > 2 in the query already excludes NULL durations
+    total_duration = sum(dur_col)
+
+    pairs = Counter(zip(start_col, end_col))
+    round_trips = sum(n for (start, end), n in pairs.items() if start is not None and start == end)
+    routes = Counter({
+        (start, end): n
+        for (start, end), n in pairs.items()
+        if start is not None and end is not None and start != end
+        and start != OUTSIDE_STATION and end != OUTSIDE_STATION
+    })
+    departures = Counter(start_col)
+    arrivals = Counter(end_col)
+    left_outside_station = arrivals[OUTSIDE_STATION]
+    for counts in (departures, arrivals):
+        counts.pop(None, None)
+        counts.pop(OUTSIDE_STATION, None)
+
+    # Busiest stations (top 5 by total arrivals + departures)
+    totals = arrivals + departures
+    return _day_metrics(
+        day,
+        total_rides=total_rides,
+        histogram=[(h, hours[h]) for h in sorted(hours)],
+        distance_sum=math.fsum(distances),
+        distance_count=len(distances),
+        duration_sum=total_duration,
+        round_trips=round_trips,
+        left_outside_station=left_outside_station,
+        busiest=[(station, arrivals[station], departures[station], total) for station, total in _top5(totals)],
+        # Top 5 routes by count
+        top_routes=[(start, end, rides) for (start, end), rides in _top5(routes)],
+    )
+
+
+def _day_metrics(
+    day: str,
+    *,
+    total_rides: int,
+    histogram: Iterable[Tuple],
+    distance_sum: float | None,
+    distance_count: int,
+    duration_sum: int | None,
+    round_trips: int,
+    left_outside_station: int,
+    busiest: Iterable[Tuple],
+    top_routes: Iterable[Tuple],
+) -> Dict:
+    """The published per-day dict from raw aggregates (shared by the rides and aggregate-table paths)."""
+    # Round to 3 decimals for km precision; duration in DB is in minutes
+    avg_distance = round(distance_sum / distance_count, 3) if distance_count and distance_sum else 0.0
+    avg_duration = round(duration_sum / total_rides, 2) if total_rides and duration_sum else 0.0
+    return {
+        "date": day,
+        "total_rides": int(total_rides),
+        # Normalize keys to '0'..'23'
+        "bike_rentals_histogram": {str(int(h)): int(c) for h, c in histogram if h is not None},
+        "avg_distance_km": avg_distance,
+        "avg_duration_min": avg_duration,
+        "total_distance_km": round(float(distance_sum), 3) if distance_sum else 0.0,
+        "total_duration_min": int(duration_sum) if duration_sum else 0,
+        "round_trips": int(round_trips),
+        "left_outside_station": int(left_outside_station),
+        "busiest_stations_top5": [
+            {"station": station, "arrivals": int(arr), "departures": int(dep), "total": int(total)}
+            for station, arr, dep, total in busiest
+        ],
+        "top_routes_top5": [
+            {"start_station": start, "end_station": end, "rides": int(rides)}
+            for start, end, rides in top_routes
+        ],
+    }
 
 
 def compute_metrics(conn: sqlite3.Connection, table: str, day: str) -> Dict:
     """
     Compute per-day metrics from the SQLite table.
 
+    The day's rides are read with one query and aggregated in a single pass
+    (see ``metrics_from_rows``).
+
     Parameters:
     - conn: open sqlite3 connection
     - table: table name to query (e.g., 'bike_rides' or 'sample_data')
@@ -42,166 +171,473 @@ def compute_metrics(conn: sqlite3.Connection, table: str, day: str) -> Dict:
     except ValueError as e:
         raise ValueError("day must be in YYYY-MM-DD format") from e
 
-    # Global filter: exclude rides with duration <= 2 minutes
-    duration_filter = "duration > 2"
+    cur = conn.execute(day_rides_query(conn, table), (day,))
+    return metrics_from_rows(day, cur)
 
-    # Total rides
-    total_rides = _fetch_one(
-        conn,
-        f"SELECT COUNT(*) FROM {table} WHERE date(start_time)=date(?) AND {duration_filter}",
-        (day,),
-    )
 
-    # Histogram by start hour
-    hist_rows = _fetch_pairs(
-        conn,
-        f"SELECT CAST(strftime('%H', start_time) AS INTEGER) AS h, COUNT(*) "
-        f"FROM {table} WHERE date(start_time)=date(?) AND {duration_filter} GROUP BY h ORDER BY h",
-        (day,),
-    )
-    # Normalize keys to '0'..'23'
-    bike_rentals_histogram = {str(int(h)): int(c) for h, c in hist_rows if h is not None}
-
-    # Avg/total distance
-    avg_distance = _fetch_one(
-        conn,
-        f"SELECT AVG(distance) FROM {table} WHERE date(start_time)=date(?) AND {duration_filter}",
-        (day,),
+def range_rides_query(conn: sqlite3.Connection, table: str) -> str:
+    """``day_rides_query`` for every day ``BETWEEN ? AND ?``: day first, rows ordered by day."""
+    day_col, hour_col = _day_columns(conn, table)
+    return (
+        f"SELECT {day_col} AS d, {hour_col}, distance, duration, start_station, end_station "
+        f"FROM {table} WHERE {day_col} BETWEEN ? AND ? AND duration > 2 ORDER BY d"
     )
-    # Round to 3 decimals for km precision
-    avg_distance = round(float(avg_distance), 3) if avg_distance else 0.0
 
-    total_distance = _fetch_one(
-        conn,
-        f"SELECT SUM(distance) FROM {table} WHERE date(start_time)=date(?) AND {duration_filter}",
-        (day,),
-    )
-    total_distance = round(float(total_distance), 3) if total_distance else 0.0
 
-    # Avg/total duration (duration in DB is in minutes)
-    avg_duration = _fetch_one(
-        conn,
-        f"SELECT AVG(duration) FROM {table} WHERE date(start_time)=date(?) AND {duration_filter}",
-        (day,),
-    )
-    avg_duration = round(float(avg_duration), 2) if avg_duration else 0.0
+def compute_range_metrics(conn: sqlite3.Connection, table: str, start: str, end: str) -> Dict[str, Dict]:
+    """Metrics for every date in ``[start, end]`` present in the table, keyed by date (ascending).
 
-    total_duration = _fetch_one(
-        conn,
-        f"SELECT SUM(duration) FROM {table} WHERE date(start_time)=date(?) AND {duration_filter}",
-        (day,),
-    )
-    total_duration = int(total_duration) if total_duration else 0
-
-    # Round trips
-    round_trips = _fetch_one(
-        conn,
-        f"SELECT COUNT(*) FROM {table} "
-        f"WHERE date(start_time)=date(?) AND {duration_filter} AND start_station IS NOT NULL AND end_station IS NOT NULL AND start_station=end_station",
-        (day,),
-    )
+    Each entry equals ``compute_metrics`` for that day. With the indexed
+    ``ride_date`` column every day is one covering-index seek; otherwise the
+    whole range is read in a single scan (instead of one full scan per day)
+    and split by day. Dates whose rides are all filtered out get zero metrics.
+    """
+    for value in (start, end):
+        try:
+            _ = datetime.strptime(value, "%Y-%m-%d")
+        except ValueError as e:
+            raise ValueError("start and end must be in YYYY-MM-DD format") from e
 
-    # Bikes left outside a station (end_station == 'Poza stacją')
-    left_outside_station = _fetch_one(
-        conn,
-        f"SELECT COUNT(*) FROM {table} WHERE date(start_time)=date(?) AND {duration_filter} AND end_station='Poza stacją'",
-        (day,),
-    )
+    dates = list_dates_between(conn, table, start, end)
+    day_col, _ = _day_columns(conn, table)
+    if day_col == "ride_date":
+        return {d: compute_metrics(conn, table, d) for d in dates}
 
-    # Busiest stations (top 5 by total arrivals + departures)
-    # SQLite doesn't support FULL OUTER JOIN; emulate via UNION of station sets
-    busiest_rows = _fetch_pairs(
-        conn,
-        f"""
-        WITH dep AS (
-            SELECT start_station AS station, COUNT(*) AS departures
-            FROM {table}
-            WHERE date(start_time)=date(?) AND {duration_filter} AND start_station IS NOT NULL AND start_station <> 'Poza stacją'
-            GROUP BY start_station
-        ), arr AS (
-            SELECT end_station AS station, COUNT(*) AS arrivals
-            FROM {table}
-            WHERE date(start_time)=date(?) AND {duration_filter} AND end_station IS NOT NULL AND end_station <> 'Poza stacją'
-            GROUP BY end_station
-        ),
-        all_stations AS (
-            SELECT station FROM dep
-            UNION
-            SELECT station FROM arr
+    computed = {}
+    cur = conn.execute(range_rides_query(conn, table), (start, end))
+    for d, rows in itertools.groupby(cur, key=operator.itemgetter(0)):
+        _, *cols = zip(*rows)
+        computed[d] = _metrics_from_columns(d, *cols)
+    return {d: computed[d] if d in computed else metrics_from_rows(d, []) for d in dates}
+
+
+AGGREGATE_QUERIES = {
+    "totals": """
+        SELECT ride_date, rides, distance_sum, distance_count, duration_sum, round_trips, left_outside_station
+        FROM daily_totals WHERE ride_date BETWEEN ? AND ? ORDER BY ride_date
+    """,
+    "histogram": """
+        SELECT ride_date, hour, rides
+        FROM daily_hour_counts WHERE ride_date BETWEEN ? AND ? ORDER BY ride_date, hour
+    """,
+    # Per day: top-5 read in order from the daily_*_top_idx indexes
+    "busiest_stations": """
+        SELECT station, arrivals, departures, arrivals + departures
+        FROM daily_station_counts WHERE ride_date = ?
+        ORDER BY arrivals + departures DESC, station ASC LIMIT 5
+    """,
+    "top_routes": """
+        SELECT start_station, end_station, rides
+        FROM daily_route_counts WHERE ride_date = ?
+        ORDER BY rides DESC, start_station ASC, end_station ASC LIMIT 5
+    """,
+}
+
+
+def compute_range_metrics_from_aggregates(conn: sqlite3.Connection, start: str, end: str) -> Dict[str, Dict]:
+    """Like ``compute_range_metrics`` for ``bike_rides``, read only from the ``daily_aggregates`` tables.
+
+    Reads a few rows per day instead of every ride; results match the raw
+    path up to float summation order of the distance total.
+    """
+    span = (start, end)
+    histograms: Dict[str, List[Tuple]] = {}
+    for d, hour, rides in conn.execute(AGGREGATE_QUERIES["histogram"], span):
+        histograms.setdefault(d, []).append((hour, rides))
+
+    out: Dict[str, Dict] = {}
+    for d, rides, dist_sum, dist_count, dur_sum, round_trips, left_outside in conn.execute(
+        AGGREGATE_QUERIES["totals"], span
+    ).fetchall():
+        out[d] = _day_metrics(
+            d,
+            total_rides=rides,
+            histogram=histograms.get(d, []),
+            distance_sum=dist_sum,
+            distance_count=dist_count,
+            duration_sum=dur_sum,
+            round_trips=round_trips,
+            left_outside_station=left_outside,
+            busiest=conn.execute(AGGREGATE_QUERIES["busiest_stations"], (d,)).fetchall(),
+            top_routes=conn.execute(AGGREGATE_QUERIES["top_routes"], (d,)).fetchall(),
         )
-        SELECT s.station,
-               COALESCE(arr.arrivals, 0) AS arrivals,
-               COALESCE(dep.departures, 0) AS departures,
-               COALESCE(arr.arrivals, 0) + COALESCE(dep.departures, 0) AS total
-        FROM all_stations s
-        LEFT JOIN dep ON dep.station = s.station
-        LEFT JOIN arr ON arr.station = s.station
-        ORDER BY total DESC, s.station ASC
-        LIMIT 5
-        """,
-        (day, day),
-    )
-    busiest_stations_top5 = [
-        {
-            "station": r[0],
-            "arrivals": int(r[1]),
-            "departures": int(r[2]),
-            "total": int(r[3]),
-        }
-        for r in busiest_rows
-        if r and r[0] is not None
-    ]
-
-    # Top 5 routes by count
-    route_rows = _fetch_pairs(
-        conn,
-        f"""
-        SELECT start_station, end_station, COUNT(*) AS rides
-        FROM {table}
-        WHERE date(start_time)=date(?)
-          AND {duration_filter}
-          AND start_station IS NOT NULL AND end_station IS NOT NULL
-          AND start_station <> end_station
-          AND start_station <> 'Poza stacją' AND end_station <> 'Poza stacją'
-        GROUP BY start_station, end_station
-        ORDER BY rides DESC, start_station ASC, end_station ASC
-        LIMIT 5
-        """,
-        (day,),
+    return out
+
+
+def connect_readonly(db_path: str) -> sqlite3.Connection:
+    """Open ``db_path`` read-only (``mode=ro`` URI), safe to share with concurrent readers."""
+    return sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+
+
+def _range_worker(db_path: str, table: str, start: str, end: str, from_aggregates: bool) -> Dict[str, Dict]:
+    conn = connect_readonly(db_path)
+    try:
+        if from_aggregates:
+            return compute_range_metrics_from_aggregates(conn, start, end)
+        return compute_range_metrics(conn, table, start, end)
+    finally:
+        conn.close()
+
+
+# Fewer stale days per worker than this are computed serially (starting a pool costs more)
+MIN_CHUNK_DAYS = 7
+
+
+def compute_range_metrics_parallel(
+    db_path: str,
+    table: str,
+    start: str,
+    end: str,
+    workers: int,
+    *,
+    from_aggregates: bool = False,
+) -> Dict[str, Dict]:
+    """``compute_range_metrics`` with the dates split into contiguous chunks across a process pool.
+
+    Each worker opens its own read-only connection; chunks are merged back in
+    date order, so the result is identical to the serial call.
+    """
+    conn = connect_readonly(db_path)
+    try:
+        dates = list_dates_between(conn, table, start, end)
+    finally:
+        conn.close()
+    if not dates:
+        return {}
+    return _compute_chunks_parallel(db_path, table, _chunks([dates], workers), workers, from_aggregates)
+
+
+def _chunks(runs: List[List[str]], workers: int) -> List[List[str]]:
+    """The dates of ``runs`` cut into contiguous chunks, about one per worker.
+
+    A chunk never spans two runs, so no date outside them is computed.
+    """
+    total = sum(len(run) for run in runs)
+    size = -(-total // max(1, min(workers, total)))
+    return [run[i:i + size] for run in runs for i in range(0, len(run), size)]
+
+
+def _compute_chunks_parallel(
+    db_path: str, table: str, chunks: List[List[str]], workers: int, from_aggregates: bool
+) -> Dict[str, Dict]:
+    """Every chunk of dates computed on one process pool, merged in chunk order."""
+    out: Dict[str, Dict] = {}
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as pool:
+        futures = [
+            pool.submit(_range_worker, db_path, table, chunk[0], chunk[-1], from_aggregates)
+            for chunk in chunks
+        ]
+        for future in futures:
+            out.update(future.result())
+    return out
+
+
+def _station_pair_crc(start_station, end_station) -> int:
+    return zlib.crc32(f"{start_station}\x00{end_station}".encode("utf-8"))
+
+
+def day_fingerprints(conn: sqlite3.Connection, table: str, start: str, end: str) -> Dict[str, List]:
+    """Cheap per-day fingerprint of the source rows for every date in ``[start, end]``.
+
+    ``[row count, max rowid, sum of durations, total distance, station checksum]``
+    over all of the day's rows, the checksum being the sum of a CRC-32 of each
+    ride's start/end stations; any insert, delete or edit of
+    duration/distance/stations changes it. With ``ride_date`` this is read
+    from the covering day index alone.
+    """
+    day_col, _ = _day_columns(conn, table)
+    conn.create_function("station_pair_crc", 2, _station_pair_crc, deterministic=True)
+    cur = conn.execute(
+        f"SELECT {day_col} AS d, COUNT(*), MAX(rowid), SUM(duration), TOTAL(distance), "
+        f"SUM(station_pair_crc(start_station, end_station)) "
+        f"FROM {table} WHERE {day_col} BETWEEN ? AND ? GROUP BY d ORDER BY d",
+        (start, end),
     )
-    top_routes_top5 = [
-        {
-            "start_station": r[0],
-            "end_station": r[1],
-            "rides": int(r[2]),
-        }
-        for r in route_rows
-        if r and r[0] is not None and r[1] is not None
-    ]
+    return {r[0]: list(r[1:]) for r in cur.fetchall()}
+
+
+def _runs(dates: List[str], wanted: set) -> List[List[str]]:
+    """The runs of consecutive ``dates`` that are in ``wanted``, as lists of dates."""
+    runs: List[List[str]] = []
+    prev_wanted = False
+    for d in dates:
+        if d in wanted:
+            if prev_wanted:
+                runs[-1].append(d)
+            else:
+                runs.append([d])
+        prev_wanted = d in wanted
+    return runs
+
+
+def _week_key(day: str) -> str:
+    d = datetime.strptime(day, "%Y-%m-%d")
+    return (d - timedelta(days=d.weekday())).strftime("%Y-%m-%d")
+
+
+# Rollup periods: key of the period a date belongs to (weeks are keyed by their Monday)
+ROLLUP_PERIODS: Dict[str, Callable[[str], str]] = {
+    "weeks": _week_key,
+    "months": lambda day: day[:7],
+}
+
+
+def _period_bounds(name: str, lo: str, hi: str) -> Tuple[str, str]:
+    """``[lo, hi]`` widened to whole periods, without crossing the years of ``lo``/``hi``."""
+    first, last = datetime.strptime(lo, "%Y-%m-%d"), datetime.strptime(hi, "%Y-%m-%d")
+    if name == "weeks":
+        first -= timedelta(days=first.weekday())
+        last += timedelta(days=6 - last.weekday())
+    else:
+        first = first.replace(day=1)
+        last = (last.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    return max(first.strftime("%Y-%m-%d"), f"{lo[:4]}-01-01"), min(last.strftime("%Y-%m-%d"), f"{hi[:4]}-12-31")
+
+
+def compute_rollups(conn: sqlite3.Connection, lo: str, hi: str) -> Dict[int, Dict[str, Dict[str, Dict]]]:
+    """Weekly and monthly rollups of every period touching ``[lo, hi]``, per year.
+
+    Read from the ``daily_aggregates`` tables. Each period is clipped to its
+    calendar year (a week spanning New Year appears, partially, in both year
+    files); entries carry their first/last date and number of days so that
+    partial periods can be told apart. Totals and top-5 lists cover the whole
+    period; the hourly histogram is the per-day average.
+    """
+    out: Dict[int, Dict[str, Dict[str, Dict]]] = {}
+    # Dates are mapped to (year, period) in a temp table: joining on it is much
+    # cheaper than evaluating a date expression for every aggregate row
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS rollup_days (ride_date TEXT PRIMARY KEY, y TEXT, p TEXT) WITHOUT ROWID")
+    for name, period_of in ROLLUP_PERIODS.items():
+        span = _period_bounds(name, lo, hi)
+        conn.execute("DELETE FROM rollup_days")
+        conn.executemany(
+            "INSERT INTO rollup_days VALUES (?, ?, ?)",
+            (
+                (d, d[:4], period_of(d))
+                for (d,) in conn.execute("SELECT ride_date FROM daily_totals WHERE ride_date BETWEEN ? AND ?", span).fetchall()
+            ),
+        )
+        hist: Dict[Tuple, List] = {}
+        for y, p, hour, rides in conn.execute(
+            "SELECT y, p, hour, SUM(rides) FROM rollup_days CROSS JOIN daily_hour_counts USING (ride_date) "
+            "GROUP BY y, p, hour ORDER BY y, p, hour"
+        ):
+            hist.setdefault((y, p), []).append((hour, rides))
+        busiest: Dict[Tuple, List] = {}
+        for y, p, *row in conn.execute(
+            """
+            SELECT y, p, station, arrivals, departures, total FROM (
+                SELECT y, p, station, SUM(arrivals) AS arrivals, SUM(departures) AS departures,
+                       SUM(arrivals + departures) AS total,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY y, p ORDER BY SUM(arrivals + departures) DESC, station ASC
+                       ) AS rn
+                FROM rollup_days CROSS JOIN daily_station_counts USING (ride_date)
+                GROUP BY y, p, station
+            ) WHERE rn <= 5 ORDER BY y, p, rn
+            """
+        ):
+            busiest.setdefault((y, p), []).append(tuple(row))
+        top_routes: Dict[Tuple, List] = {}
+        for y, p, *row in conn.execute(
+            """
+            SELECT y, p, start_station, end_station, rides FROM (
+                SELECT y, p, start_station, end_station, SUM(rides) AS rides,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY y, p ORDER BY SUM(rides) DESC, start_station ASC, end_station ASC
+                       ) AS rn
+                FROM rollup_days CROSS JOIN daily_route_counts USING (ride_date)
+                GROUP BY y, p, start_station, end_station
+            ) WHERE rn <= 5 ORDER BY y, p, rn
+            """
+        ):
+            top_routes.setdefault((y, p), []).append(tuple(row))
+
+        for y, p, first, last, n_days, rides, dist_sum, dist_count, dur_sum, round_trips, left_outside in conn.execute(
+            """
+            SELECT y, p, MIN(ride_date), MAX(ride_date), COUNT(*), SUM(rides), SUM(distance_sum),
+                   SUM(distance_count), SUM(duration_sum), SUM(round_trips), SUM(left_outside_station)
+            FROM rollup_days CROSS JOIN daily_totals USING (ride_date)
+            GROUP BY y, p ORDER BY y, p
+            """
+        ):
+            metrics = _day_metrics(
+                p,
+                total_rides=rides,
+                histogram=hist.get((y, p), []),
+                distance_sum=dist_sum,
+                distance_count=dist_count,
+                duration_sum=dur_sum,
+                round_trips=round_trips,
+                left_outside_station=left_outside,
+                busiest=busiest.get((y, p), []),
+                top_routes=top_routes.get((y, p), []),
+            )
+            metrics.pop("date")
+            sums = metrics.pop("bike_rentals_histogram")
+            out.setdefault(int(y), {k: {} for k in ROLLUP_PERIODS})[name][p] = {
+                "start": first,
+                "end": last,
+                "days": n_days,
+                **metrics,
+                "bike_rentals_histogram_avg": {h: round(c / n_days, 2) for h, c in sums.items()},
+            }
+    conn.execute("DELETE FROM rollup_days")
+    return out
+
+
+# Cumulative per-day totals of the range index (daily_totals columns)
+PREFIX_TOTALS = ["rides", "distance_sum", "distance_count", "duration_sum", "round_trips", "left_outside_station"]
+
+
+def build_prefix_index(conn: sqlite3.Connection, start: str, end: str) -> Dict:
+    """Prefix sums over the dates in ``[start, end]``, read from the daily aggregate tables.
+
+    ``dates`` lists the dates; entry ``i`` of every cumulative array is the sum
+    over the first ``i`` dates (entry 0 is all zeros), so the total of any run
+    of dates is the difference of two entries (see ``range_totals``). Kept
+    per date: the ``daily_totals`` columns, rides per start hour and
+    arrivals/departures per station (in the order of ``stations``). Routes
+    are left out: a station x station vector per day would dwarf the rest.
+    """
+    dates: List[str] = []
+    totals: Dict[str, List] = {k: [0] for k in PREFIX_TOTALS}
+    for row in conn.execute(
+        f"SELECT ride_date, {', '.join(PREFIX_TOTALS)} FROM daily_totals WHERE ride_date BETWEEN ? AND ? ORDER BY ride_date",
+        (start, end),
+    ):
+        dates.append(row[0])
+        for k, v in zip(PREFIX_TOTALS, row[1:]):
+            totals[k].append(totals[k][-1] + (v or 0))
+    totals["distance_sum"] = [round(v, 6) for v in totals["distance_sum"]]
+    position = {d: i for i, d in enumerate(dates)}
 
+    hours = [[0] * 24 for _ in range(len(dates) + 1)]
+    for d, hour, rides in conn.execute(
+        "SELECT ride_date, hour, rides FROM daily_hour_counts WHERE ride_date BETWEEN ? AND ?", (start, end)
+    ):
+        hours[position[d] + 1][hour] = rides
+    stations = [r[0] for r in conn.execute(
+        "SELECT DISTINCT station FROM daily_station_counts WHERE ride_date BETWEEN ? AND ? ORDER BY station",
+        (start, end),
+    )]
+    slot = {s: i for i, s in enumerate(stations)}
+    arrivals = [[0] * len(stations) for _ in range(len(dates) + 1)]
+    departures = [[0] * len(stations) for _ in range(len(dates) + 1)]
+    for d, station, arr, dep in conn.execute(
+        "SELECT ride_date, station, arrivals, departures FROM daily_station_counts WHERE ride_date BETWEEN ? AND ?",
+        (start, end),
+    ):
+        arrivals[position[d] + 1][slot[station]] = arr
+        departures[position[d] + 1][slot[station]] = dep
+    # Per-day values -> running totals
+    for vectors in (hours, arrivals, departures):
+        for i in range(1, len(vectors)):
+            vectors[i] = list(map(operator.add, vectors[i - 1], vectors[i]))
     return {
-        "date": day,
-        "total_rides": int(total_rides),
-        "bike_rentals_histogram": bike_rentals_histogram,
-        "avg_distance_km": avg_distance,
-        "avg_duration_min": avg_duration,
-        "total_distance_km": total_distance,
-        "total_duration_min": total_duration,
-        "round_trips": int(round_trips),
-        "left_outside_station": int(left_outside_station),
-        "busiest_stations_top5": busiest_stations_top5,
-        "top_routes_top5": top_routes_top5,
+        "dates": dates,
+        "stations": stations,
+        "totals": totals,
+        "hours": hours,
+        "arrivals": arrivals,
+        "departures": departures,
     }
 
 
-def list_dates_for_year(conn: sqlite3.Connection, table: str, year: int) -> List[str]:
+def range_totals(index: Dict, start: str, end: str) -> Dict:
+    """Metrics of the dates in ``[start, end]`` from a prefix index (``build_prefix_index``).
+
+    Every sum is one subtraction of two cumulative entries, so the cost does
+    not depend on the length of the range. Returns the same totals and
+    averages as a rollup period (``start``/``end``/``days``, per-day average
+    histogram, busiest stations) without top routes, which the index does not
+    keep. ``start``/``end`` are the first/last covered dates (None if none).
+    """
+    dates = index["dates"]
+    i, j = bisect.bisect_left(dates, start), bisect.bisect_right(dates, end)
+    t = {k: col[j] - col[i] for k, col in index["totals"].items()}
+    hours = list(map(operator.sub, index["hours"][j], index["hours"][i]))
+    arrivals = list(map(operator.sub, index["arrivals"][j], index["arrivals"][i]))
+    departures = list(map(operator.sub, index["departures"][j], index["departures"][i]))
+    per_station = {s: k for k, s in enumerate(index["stations"])}
+    top = _top5(Counter({s: arrivals[k] + departures[k] for s, k in per_station.items() if arrivals[k] + departures[k]}))
+    metrics = _day_metrics(
+        start,
+        total_rides=t["rides"],
+        histogram=[(h, c) for h, c in enumerate(hours) if c],
+        distance_sum=t["distance_sum"],
+        distance_count=t["distance_count"],
+        duration_sum=t["duration_sum"],
+        round_trips=t["round_trips"],
+        left_outside_station=t["left_outside_station"],
+        busiest=[(s, arrivals[per_station[s]], departures[per_station[s]], n) for s, n in top],
+        top_routes=[],
+    )
+    metrics.pop("date")
+    metrics.pop("top_routes_top5")
+    sums = metrics.pop("bike_rentals_histogram")
+    n_days = j - i
+    return {
+        "start": dates[i] if n_days else None,
+        "end": dates[j - 1] if n_days else None,
+        "days": n_days,
+        **metrics,
+        "bike_rentals_histogram_avg": {h: round(c / n_days, 2) for h, c in sums.items()},
+    }
+
+
+def prefix_month_shards(index: Dict) -> Dict[str, Dict]:
+    """The web app form of a year's range index (``build_prefix_index``): one payload per month.
+
+    ``base`` holds the year's running hour and station totals before the
+    month's first date and ``days`` each date's own counts, so the running
+    totals through any date are ``base`` plus the month's days up to it and a
+    range needs only the shards of its first and last month. Stations are
+    listed sparsely, as ``[slot, arrivals, departures]`` into the month's
+    ``stations``, and only if nonzero. The totals columns are left out (the web
+    app reads them from the day shards and rollups).
+    """
+    dates, names = index["dates"], index["stations"]
+    hours, arrivals, departures = index["hours"], index["arrivals"], index["departures"]
+
+    def entry(hour_counts: List[int], arr: List[int], dep: List[int]) -> Dict:
+        return {"hours": hour_counts, "stations": [[k, a, d] for k, (a, d) in enumerate(zip(arr, dep)) if a or d]}
+
+    def diff(col: List[List[int]], i: int) -> List[int]:
+        return list(map(operator.sub, col[i + 1], col[i]))
+
+    by_month: Dict[str, List[int]] = {}
+    for i, d in enumerate(dates):
+        by_month.setdefault(d[:7], []).append(i)
+    out: Dict[str, Dict] = {}
+    for month, positions in by_month.items():
+        first = positions[0]
+        base = entry(hours[first], arrivals[first], departures[first])
+        days = {dates[i]: entry(diff(hours, i), diff(arrivals, i), diff(departures, i)) for i in positions}
+        # Renumber the slots over the stations this month mentions
+        used = sorted({row[0] for e in [base, *days.values()] for row in e["stations"]})
+        slot = {k: n for n, k in enumerate(used)}
+        for e in [base, *days.values()]:
+            e["stations"] = [[slot[k], a, d] for k, a, d in e["stations"]]
+        out[month] = {"month": month, "stations": [names[k] for k in used], "base": base, "days": days}
+    return out
+
+
+def list_dates_between(conn: sqlite3.Connection, table: str, start: str, end: str) -> List[str]:
+    """Distinct ride dates in ``[start, end]`` (inclusive ``YYYY-MM-DD`` bounds), ascending."""
+    day_col, _ = _day_columns(conn, table)
+    # For ride_date this is a range on the leading column of the day index
     cur = conn.execute(
-        f"SELECT date(start_time) AS d FROM {table} WHERE strftime('%Y', start_time)=? GROUP BY d ORDER BY d",
-        (str(year),),
+        f"SELECT {day_col} AS d FROM {table} WHERE {day_col} BETWEEN ? AND ? GROUP BY d ORDER BY d",
+        (start, end),
     )
     return [r[0] for r in cur.fetchall()]
 
 
+def list_dates_for_year(conn: sqlite3.Connection, table: str, year: int) -> List[str]:
+    return list_dates_between(conn, table, f"{year}-01-01", f"{year}-12-31")
+
+
 def read_year_file(path: str) -> Dict:
     if not os.path.exists(path):
         return {"year": None, "days": {}}
@@ -212,7 +648,10 @@ def read_year_file(path: str) -> Dict:
         if isinstance(data, dict) and "days" in data:
             year = data.get("year")
             days = data.get("days", {})
-            return {"year": year, "days": days}
+            out = {"year": year, "days": days}
+            # Weekly/monthly rollups, when the file has them
+            out.update((k, data[k]) for k in ROLLUP_PERIODS if isinstance(data.get(k), dict))
+            return out
         elif isinstance(data, dict):
             return {"year": None, "days": data}
         else:
@@ -221,11 +660,267 @@ def read_year_file(path: str) -> Dict:
         return {"year": None, "days": {}}
 
 
-def write_year_file(path: str, year: int, days: Dict[str, Dict]) -> None:
+def write_year_file(path: str, year: int, days: Dict[str, Dict], rollups: Dict[str, Dict] | None = None) -> None:
+    payload: Dict = {"year": year, "days": days}
+    for name, periods in (rollups or {}).items():
+        payload[name] = dict(sorted(periods.items()))
+    _write_json_atomic(path, payload)
+
+
+def _write_json_atomic(path: str, payload, **dump_kwargs) -> None:
     ensure_dir(os.path.dirname(os.path.abspath(path)))
-    payload = {"year": year, "days": days}
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    # Write to a sibling temp file and swap it in, so readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, **(dump_kwargs or {"indent": 2}))
+    os.replace(tmp_path, path)
+
+
+def fingerprints_path(out_path: str) -> str:
+    """Sidecar file holding the per-day source fingerprints of ``out_path``."""
+    return f"{os.path.splitext(out_path)[0]}.fingerprints.json"
+
+
+def prefix_path(out_path: str) -> str:
+    """Sidecar file holding the prefix-sum range index of ``out_path``."""
+    return f"{os.path.splitext(out_path)[0]}.prefix.json"
+
+
+def read_prefix_index(path: str) -> Dict | None:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) and "dates" in data else None
+    except Exception:
+        return None
+
+
+def read_fingerprints(path: str) -> Dict[str, List]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def write_fingerprints(path: str, fingerprints: Dict[str, List]) -> None:
+    _write_json_atomic(path, fingerprints, separators=(",", ":"))
+
+
+# Web app data: one shard per month plus a small manifest, loaded lazily
+MANIFEST_NAME = "manifest.json"
+_COMPACT = {"separators": (",", ":")}
+
+
+def _date_runs(dates: List[str]) -> List[List[str]]:
+    """Sorted dates as ``[first, last]`` runs of consecutive days."""
+    runs: List[List[str]] = []
+    prev = None
+    for d in dates:
+        cur = datetime.strptime(d, "%Y-%m-%d")
+        if runs and prev is not None and cur - prev == timedelta(days=1):
+            runs[-1][1] = d
+        else:
+            runs.append([d, d])
+        prev = cur
+    return runs
+
+
+def read_manifest(shards_dir: str) -> Dict:
+    try:
+        with open(os.path.join(shards_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def write_shards(
+    shards_dir: str,
+    year: int,
+    data: Dict,
+    months: Iterable[str] | None = None,
+    prefix: Dict | None = None,
+) -> None:
+    """Write one year's metrics as web app shards and update the manifest.
+
+    ``data`` is the year payload (``days`` plus optional ``weeks``/``months``).
+    Each month's days go to ``days-<YYYY-MM>.json`` and the year's rollups to
+    ``rollups-<year>.json``, and the range index (``prefix``) to
+    ``prefix-<YYYY-MM>.json`` per month (see ``prefix_month_shards``); only
+    ``months`` (all if None) and missing shards are rewritten, plus the range
+    index shards after them, whose running totals they change.
+    ``manifest.json`` lists, per month, its shard and available
+    dates (as runs), so it stays a few KB however much history there is. It is
+    written last, so it never points at a shard that is not there yet.
+    """
+    by_month: Dict[str, Dict[str, Dict]] = {}
+    for d, payload in sorted(data.get("days", {}).items()):
+        by_month.setdefault(d[:7], {})[d] = payload
+    wanted = None if months is None else set(months)
+    for month, days in by_month.items():
+        path = os.path.join(shards_dir, f"days-{month}.json")
+        if wanted is None or month in wanted or not os.path.exists(path):
+            _write_json_atomic(path, {"month": month, "days": days}, **_COMPACT)
+
+    manifest = read_manifest(shards_dir)
+    entries = {m: e for m, e in manifest.get("months", {}).items() if not m.startswith(f"{year}-")}
+    entries.update(
+        (m, {"file": f"days-{m}.json", "dates": _date_runs(list(days))}) for m, days in by_month.items()
+    )
+    rollup_files = {y: f for y, f in manifest.get("rollups", {}).items() if y != str(year)}
+    rollups = {k: data[k] for k in ROLLUP_PERIODS if data.get(k)}
+    if rollups:
+        rollup_files[str(year)] = f"rollups-{year}.json"
+        _write_json_atomic(os.path.join(shards_dir, rollup_files[str(year)]), {"year": year, **rollups}, **_COMPACT)
+    # Range index shards are per month (entries keyed by year are from older runs)
+    prefix_files = {
+        m: f for m, f in manifest.get("prefix", {}).items() if len(m) == 7 and not m.startswith(f"{year}-")
+    }
+    first_changed = None if wanted is None else min(wanted, default="9999")
+    for month, payload in (prefix_month_shards(prefix) if prefix else {}).items():
+        prefix_files[month] = f"prefix-{month}.json"
+        path = os.path.join(shards_dir, prefix_files[month])
+        if first_changed is None or month >= first_changed or not os.path.exists(path):
+            _write_json_atomic(path, payload, **_COMPACT)
+    _write_json_atomic(
+        os.path.join(shards_dir, MANIFEST_NAME),
+        {
+            "months": dict(sorted(entries.items())),
+            "rollups": dict(sorted(rollup_files.items())),
+            "prefix": dict(sorted(prefix_files.items())),
+        },
+        **_COMPACT,
+    )
+
+
+def default_out_path(year: int) -> str:
+    return os.path.join(repo_root(), "data", "processed", "metrics", f"{year}.json")
+
+
+def latest_date(conn: sqlite3.Connection, table: str) -> str | None:
+    """Most recent ride date in ``table`` (a single index lookup with ``ride_date``)."""
+    day_col, _ = _day_columns(conn, table)
+    if day_col == "ride_date":
+        row = conn.execute(f"SELECT MAX(ride_date) FROM {table}").fetchone()
+    else:
+        row = conn.execute(f"SELECT date(MAX(start_time)) FROM {table}").fetchone()
+    return row[0] if row else None
+
+
+def rebuild_range(
+    conn: sqlite3.Connection,
+    table: str,
+    start: str,
+    end: str,
+    range_metrics: Callable[[str, str], Dict[str, Dict]],
+    *,
+    out_path: str | None = None,
+    force: bool = False,
+    rollups: bool = False,
+    shards_dir: str | None = None,
+    db_path: str | None = None,
+    workers: int = 1,
+    from_aggregates: bool = False,
+) -> Dict[int, str]:
+    """Bring the per-year files up to date for ``[start, end]``; returns ``{year: path}`` written.
+
+    Only days whose source fingerprint changed (or that are missing from their
+    year file) are recomputed, and days with a stored fingerprint but no rows
+    left are removed (with ``rollups``, the daily aggregates of both kinds of
+    days are refreshed first). Recomputation goes via ``range_metrics(first, last)`` per run of
+    consecutive stale dates, so one call can span years. With ``workers`` > 1
+    and ``db_path``, the stale runs are instead cut into chunks computed on one
+    process pool (see ``compute_range_metrics_parallel``), unless there are too
+    few stale days for two chunks of ``MIN_CHUNK_DAYS``. Each year file and
+    its fingerprints sidecar is then written once. ``out_path`` overrides the
+    file for a single-year range. With ``rollups`` the weeks/months touched by
+    recomputed days (or every period, for a file that has none yet) are
+    refreshed from the daily aggregate tables, and the year's prefix-sum
+    range index is rebuilt next to the file. With ``shards_dir`` the web
+    app shards of the recomputed months are rewritten too.
+    """
+    started = time.perf_counter()
+    fingerprints = day_fingerprints(conn, table, start, end)
+    # Also the years whose rows are all gone, but that have fingerprints stored
+    years = sorted({int(d[:4]) for d in fingerprints} | {
+        y for y in range(int(start[:4]), int(end[:4]) + 1)
+        if os.path.exists(fingerprints_path(out_path or default_out_path(y)))
+    })
+    if start[:4] == end[:4] and not years:
+        years = [int(start[:4])]
+    paths = {y: out_path or default_out_path(y) for y in years}
+    files = {y: read_year_file(paths[y]) for y in years}
+    days = {y: dict(files[y].get("days", {})) for y in years}
+    stored = {y: read_fingerprints(fingerprints_path(paths[y])) for y in years}
+
+    # Recompute a day only if its source rows changed or its metrics are missing
+    stale = {
+        d for d, fp in fingerprints.items()
+        if force or stored[int(d[:4])].get(d) != fp or d not in days[int(d[:4])]
+    }
+    # Days processed before whose rows were all deleted since
+    removed = {y: sorted(d for d in stored[y] if start <= d <= end and d not in fingerprints) for y in years}
+    for y in years:
+        for d in removed[y]:
+            days[y].pop(d, None)
+    if rollups:
+        # Rows edited or deleted since the last run (outside the loader): bring
+        # those days' aggregates in line before anything reads them
+        edited = [d for d, fp in fingerprints.items() if stored[int(d[:4])].get(d, fp) != fp]
+        if daily_aggregates.refresh_days(conn, edited + [d for y in years for d in removed[y]]):
+            conn.commit()
+    computed: Dict[str, Dict] = {}
+    runs = _runs(list(fingerprints), stale)
+    workers = min(workers, len(stale) // MIN_CHUNK_DAYS)
+    if db_path and workers > 1:
+        computed = _compute_chunks_parallel(db_path, table, _chunks(runs, workers), workers, from_aggregates)
+    elif len(stale) == len(fingerprints):
+        computed = range_metrics(start, end)
+    else:
+        for run in runs:
+            computed.update(range_metrics(run[0], run[-1]))
+
+    for d, metrics in computed.items():
+        payload = dict(metrics)
+        payload.pop("date", None)
+        days[int(d[:4])][d] = payload
+    periods: Dict[int, Dict[str, Dict]] = {}
+    for y in years:
+        periods[y] = {k: dict(files[y].get(k, {})) for k in ROLLUP_PERIODS}
+        if not rollups:
+            continue
+        touched = sorted([d for d in computed if d.startswith(f"{y}-")] + removed[y])
+        if not all(k in files[y] for k in ROLLUP_PERIODS):
+            touched = sorted(days[y])
+        if touched:
+            fresh = compute_rollups(conn, touched[0], touched[-1]).get(y, {})
+            for name, period_of in ROLLUP_PERIODS.items():
+                periods[y][name].update(fresh.get(name, {}))
+                # Periods left without any day
+                for key in {period_of(d) for d in removed[y]} - fresh.get(name, {}).keys():
+                    periods[y][name].pop(key, None)
+    for y in years:
+        # One atomic write per year, then the fingerprints it reflects
+        write_year_file(paths[y], y, days[y], periods[y] if rollups or any(periods[y].values()) else None)
+        prefix = build_prefix_index(conn, f"{y}-01-01", f"{y}-12-31") if rollups else None
+        if prefix:
+            _write_json_atomic(prefix_path(paths[y]), prefix, **_COMPACT)
+        if shards_dir:
+            touched = {d[:7] for d in [*computed, *removed[y]] if d.startswith(f"{y}-")}
+            write_shards(shards_dir, y, {"days": days[y], **periods[y]}, touched, prefix)
+        kept = {d: fp for d, fp in stored[y].items() if not start <= d <= end}
+        kept.update((d, fp) for d, fp in fingerprints.items() if d.startswith(f"{y}-"))
+        write_fingerprints(fingerprints_path(paths[y]), dict(sorted(kept.items())))
+    logging.info(
+        "Recomputed %d days, removed %d days without rows, skipped %d unchanged days in %.2fs",
+        len(computed),
+        sum(len(r) for r in removed.values()),
+        len(fingerprints) - len(stale),
+        time.perf_counter() - started,
+    )
+    return paths
 
 
 def main(argv: List[str] | None = None) -> None:
@@ -238,6 +933,18 @@ def main(argv: List[str] | None = None) -> None:
         help="Use the most recent date present in the DB (by start_time)",
     )
     parser.add_argument("--year", dest="year", type=int, default=None, help="Compute metrics for all dates in the given year")
+    parser.add_argument(
+        "--from",
+        dest="from_day",
+        default=None,
+        help="Compute metrics for every date from this day (YYYY-MM-DD), across years, into the per-year files",
+    )
+    parser.add_argument(
+        "--to",
+        dest="to_day",
+        default=None,
+        help="Last day of the --from range (YYYY-MM-DD, inclusive; default: latest date in the DB)",
+    )
     parser.add_argument(
         "--db",
         dest="db_path",
@@ -251,7 +958,46 @@ def main(argv: List[str] | None = None) -> None:
         default=None,
         help="Output JSON file path. For yearly mode defaults to data/processed/metrics/<year>.json; for single day defaults to data/processed/metrics/<year>.json (appending).",
     )
+    parser.add_argument(
+        "--shards-dir",
+        dest="shards_dir",
+        default=None,
+        help="Also write the web app's per-month shards and manifest.json to this directory (e.g. web/data)",
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        default=1,
+        help="Worker processes for --year/--from (default: 1, serial); each reads the DB over its own read-only connection",
+    )
+    parser.add_argument(
+        "--force",
+        dest="force",
+        action="store_true",
+        help="With --year/--from, recompute every day even if its source fingerprint is unchanged",
+    )
+    parser.add_argument(
+        "--from-aggregates",
+        dest="from_aggregates",
+        action="store_true",
+        help="Build metrics from the daily aggregate tables instead of scanning bike_rides",
+    )
     args = parser.parse_args(argv)
+    for value in (args.from_day, args.to_day):
+        if value is not None:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                parser.error(f"dates must be in YYYY-MM-DD format, got {value!r}")
+    if args.to_day is not None and args.from_day is None:
+        parser.error("--to requires --from")
+    if args.year is not None and args.from_day is not None:
+        parser.error("--year and --from are mutually exclusive")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.from_aggregates and args.table != "bike_rides":
+        parser.error("--from-aggregates is only available for the bike_rides table")
 
     # Setup basic logging to show progress
     try:
@@ -262,47 +1008,52 @@ def main(argv: List[str] | None = None) -> None:
         logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
 
     conn = sqlite3.connect(args.db_path)
+    # Weekly/monthly rollups are read from the daily aggregate tables
+    with_rollups = args.table == "bike_rides" and daily_aggregates.has_tables(conn)
+
+    def range_metrics(start: str, end: str) -> Dict[str, Dict]:
+        if args.from_aggregates:
+            return compute_range_metrics_from_aggregates(conn, start, end)
+        return compute_range_metrics(conn, args.table, start, end)
+
     try:
-        # Yearly rebuild mode
-        if args.year is not None:
-            dates = list_dates_for_year(conn, args.table, args.year)
-            logging.info("Starting yearly rebuild for %s (%d days)", args.year, len(dates))
-
-            # Determine out path early and ensure directory exists
-            if args.out_path is None:
-                out_dir = os.path.join(repo_root(), "data", "processed", "metrics")
-                ensure_dir(out_dir)
-                args.out_path = os.path.join(out_dir, f"{args.year}.json")
+        # Range rebuild mode (--year is the range Jan 1 - Dec 31)
+        if args.year is not None or args.from_day is not None:
+            if args.year is not None:
+                start, end = f"{args.year}-01-01", f"{args.year}-12-31"
             else:
-                ensure_dir(os.path.dirname(os.path.abspath(args.out_path)))
-
-            # Load existing (if any) to support incremental writes/appends
-            existing = read_year_file(args.out_path)
-            days: Dict[str, Dict] = dict(existing.get("days", {}))
-
-            total = len(dates)
-            for i, d in enumerate(dates, start=1):
-                metrics = compute_metrics(conn, args.table, d)
-                payload = dict(metrics)
-                payload.pop("date", None)
-                days[d] = payload
-                # Write after each day to avoid long-running single write
-                write_year_file(args.out_path, args.year, days)
-                logging.info("[%d/%d] Processed %s", i, total, d)
-
-            print(f"Wrote yearly metrics for {args.year} to: {args.out_path}")
+                start, end = args.from_day, args.to_day or latest_date(conn, args.table)
+                if end is None:
+                    raise SystemExit("No rows found in table; cannot determine latest date.")
+                if end < start:
+                    parser.error("--to must not be before --from")
+                if args.out_path is not None and start[:4] != end[:4]:
+                    parser.error("--out can only be used when the range is within one year")
+            logging.info("Starting rebuild for %s..%s", start, end)
+            written = rebuild_range(
+                conn,
+                args.table,
+                start,
+                end,
+                range_metrics,
+                out_path=args.out_path,
+                force=args.force,
+                rollups=with_rollups,
+                shards_dir=args.shards_dir,
+                db_path=args.db_path,
+                workers=args.workers,
+                from_aggregates=args.from_aggregates,
+            )
+            for year, path in written.items():
+                print(f"Wrote yearly metrics for {year} to: {path}")
             return
 
         # Resolve day for single-day append/update
         day = args.day
         if day is None and args.latest:
             # Determine latest available date from DB
-            cur = conn.execute(
-                f"SELECT date(start_time) AS d FROM {args.table} WHERE start_time IS NOT NULL ORDER BY start_time DESC LIMIT 1"
-            )
-            row = cur.fetchone()
-            if row and row[0]:
-                day = row[0]
+            day = latest_date(conn, args.table)
+            if day:
                 logging.info("Using latest date from DB: %s", day)
             else:
                 raise SystemExit("No rows found in table; cannot determine latest date.")
@@ -310,14 +1061,14 @@ def main(argv: List[str] | None = None) -> None:
         if day is None:
             day = datetime.utcnow().strftime("%Y-%m-%d")
         year = int(day[:4])
-        metrics = compute_metrics(conn, args.table, day)
+        if args.from_aggregates:
+            metrics = compute_range_metrics_from_aggregates(conn, day, day).get(day) or metrics_from_rows(day, [])
+        else:
+            metrics = compute_metrics(conn, args.table, day)
         # default yearly file path
         if args.out_path is None:
-            out_dir = os.path.join(repo_root(), "data", "processed", "metrics")
-            ensure_dir(out_dir)
-            args.out_path = os.path.join(out_dir, f"{year}.json")
-        else:
-            ensure_dir(os.path.dirname(os.path.abspath(args.out_path)))
+            args.out_path = default_out_path(year)
+        ensure_dir(os.path.dirname(os.path.abspath(args.out_path)))
 
         existing = read_year_file(args.out_path)
         days = existing.get("days", {})
@@ -325,7 +1076,18 @@ def main(argv: List[str] | None = None) -> None:
         payload = dict(metrics)
         payload.pop("date", None)
         days[day] = payload
-        write_year_file(args.out_path, year, days)
+        periods = {k: dict(existing.get(k, {})) for k in ROLLUP_PERIODS}
+        if with_rollups:
+            # Refresh the day's week and month (every period if the file has none yet)
+            lo, hi = (day, day) if all(k in existing for k in ROLLUP_PERIODS) else (min(days), max(days))
+            for name, entries in compute_rollups(conn, lo, hi).get(year, {}).items():
+                periods[name].update(entries)
+        write_year_file(args.out_path, year, days, periods if with_rollups or any(periods.values()) else None)
+        prefix = build_prefix_index(conn, f"{year}-01-01", f"{year}-12-31") if with_rollups else None
+        if prefix:
+            _write_json_atomic(prefix_path(args.out_path), prefix, **_COMPACT)
+        if args.shards_dir:
+            write_shards(args.shards_dir, year, {"days": days, **periods}, [day[:7]], prefix)
         print(f"Updated {day} in: {args.out_path}")
     finally:
         conn.close()
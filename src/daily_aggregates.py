@@ -0,0 +1,197 @@
+"""Per-day aggregate tables maintained alongside ``bike_rides``.
+
+The daily metrics only ever need a handful of counts and sums per day, so the
+loader keeps them in small tables instead of rescanning raw rides:
+
+- ``daily_totals``: one row per date with rides (qualifying counts and sums)
+- ``daily_hour_counts``: rides per date and start hour
+- ``daily_station_counts``: arrivals/departures per date and station
+- ``daily_route_counts``: rides per date and (start, end) route
+
+All aggregates apply the metrics' global filter (``duration > 2``) and
+station exclusions (``Poza stacją``, round trips for routes). ``daily_totals``
+still has a row for dates whose rides are all filtered out, so the set of
+dates matches ``bike_rides``.
+
+Days are refreshed by recomputing them from ``bike_rides`` (delete + grouped
+insert), which keeps the tables exact under ``INSERT OR IGNORE`` re-loads.
+
+Usage (rebuild every day from bike_rides):
+    python src/daily_aggregates.py [--db data/processed/bike_data.db]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+from typing import Iterable, List
+
+OUTSIDE_STATION = "Poza stacją"
+
+AGGREGATE_TABLES = {
+    "daily_totals": """
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            ride_date TEXT PRIMARY KEY,
+            rides INTEGER,
+            distance_sum REAL,
+            distance_count INTEGER,
+            duration_sum INTEGER,
+            round_trips INTEGER,
+            left_outside_station INTEGER
+        )
+    """,
+    "daily_hour_counts": """
+        CREATE TABLE IF NOT EXISTS daily_hour_counts (
+            ride_date TEXT,
+            hour INTEGER,
+            rides INTEGER,
+            PRIMARY KEY (ride_date, hour)
+        )
+    """,
+    "daily_station_counts": """
+        CREATE TABLE IF NOT EXISTS daily_station_counts (
+            ride_date TEXT,
+            station TEXT,
+            arrivals INTEGER,
+            departures INTEGER,
+            PRIMARY KEY (ride_date, station)
+        )
+    """,
+    "daily_route_counts": """
+        CREATE TABLE IF NOT EXISTS daily_route_counts (
+            ride_date TEXT,
+            start_station TEXT,
+            end_station TEXT,
+            rides INTEGER,
+            PRIMARY KEY (ride_date, start_station, end_station)
+        )
+    """,
+}
+
+# Per-day top-N lookups read these in order and stop after N rows
+AGGREGATE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS daily_station_counts_top_idx "
+    "ON daily_station_counts(ride_date, arrivals + departures DESC, station)",
+    "CREATE INDEX IF NOT EXISTS daily_route_counts_top_idx "
+    "ON daily_route_counts(ride_date, rides DESC, start_station, end_station)",
+]
+
+# Each statement reads the days listed in temp table refresh_days
+_REFRESH_SQL = {
+    "daily_totals": f"""
+        INSERT INTO daily_totals
+        SELECT ride_date,
+               COUNT(CASE WHEN duration > 2 THEN 1 END),
+               SUM(CASE WHEN duration > 2 THEN distance END),
+               COUNT(CASE WHEN duration > 2 THEN distance END),
+               SUM(CASE WHEN duration > 2 THEN duration END),
+               COUNT(CASE WHEN duration > 2 AND start_station IS NOT NULL
+                           AND start_station = end_station THEN 1 END),
+               COUNT(CASE WHEN duration > 2 AND end_station = '{OUTSIDE_STATION}' THEN 1 END)
+        FROM bike_rides
+        WHERE ride_date IN (SELECT ride_date FROM refresh_days)
+        GROUP BY ride_date
+    """,
+    "daily_hour_counts": """
+        INSERT INTO daily_hour_counts
+        SELECT ride_date, start_hour, COUNT(*)
+        FROM bike_rides
+        WHERE ride_date IN (SELECT ride_date FROM refresh_days)
+          AND duration > 2 AND start_hour IS NOT NULL
+        GROUP BY ride_date, start_hour
+    """,
+    "daily_station_counts": f"""
+        INSERT INTO daily_station_counts
+        SELECT ride_date, station, SUM(arrival), COUNT(*) - SUM(arrival)
+        FROM (
+            SELECT ride_date, start_station AS station, 0 AS arrival
+            FROM bike_rides
+            WHERE ride_date IN (SELECT ride_date FROM refresh_days) AND duration > 2
+              AND start_station IS NOT NULL AND start_station <> '{OUTSIDE_STATION}'
+            UNION ALL
+            SELECT ride_date, end_station AS station, 1 AS arrival
+            FROM bike_rides
+            WHERE ride_date IN (SELECT ride_date FROM refresh_days) AND duration > 2
+              AND end_station IS NOT NULL AND end_station <> '{OUTSIDE_STATION}'
+        )
+        GROUP BY ride_date, station
+    """,
+    "daily_route_counts": f"""
+        INSERT INTO daily_route_counts
+        SELECT ride_date, start_station, end_station, COUNT(*)
+        FROM bike_rides
+        WHERE ride_date IN (SELECT ride_date FROM refresh_days) AND duration > 2
+          AND start_station IS NOT NULL AND end_station IS NOT NULL
+          AND start_station <> end_station
+          AND start_station <> '{OUTSIDE_STATION}' AND end_station <> '{OUTSIDE_STATION}'
+        GROUP BY ride_date, start_station, end_station
+    """,
+}
+
+
+def has_tables(conn: sqlite3.Connection) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='daily_totals'"
+    ).fetchone() is not None
+
+
+def create_tables(conn: sqlite3.Connection) -> None:
+    """Create the aggregate tables; backfill them if ``bike_rides`` predates them."""
+    existed = has_tables(conn)
+    for sql in [*AGGREGATE_TABLES.values(), *AGGREGATE_INDEXES]:
+        conn.execute(sql)
+    if not existed:
+        refresh_all(conn)
+
+
+def refresh_days(conn: sqlite3.Connection, days: Iterable[str]) -> int:
+    """Recompute the aggregates of ``days`` from ``bike_rides``; returns the number of days.
+
+    Runs inside the caller's transaction (if any).
+    """
+    days = sorted({d for d in days if d})
+    if not days:
+        return 0
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS refresh_days (ride_date TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM refresh_days")
+    conn.executemany("INSERT INTO refresh_days VALUES (?)", ((d,) for d in days))
+    for table, sql in _REFRESH_SQL.items():
+        conn.execute(f"DELETE FROM {table} WHERE ride_date IN (SELECT ride_date FROM refresh_days)")
+        conn.execute(sql)
+    conn.execute("DELETE FROM refresh_days")
+    return len(days)
+
+
+def refresh_all(conn: sqlite3.Connection) -> int:
+    """Recompute the aggregates of every date in ``bike_rides``."""
+    return refresh_days(conn, all_ride_dates(conn))
+
+
+def all_ride_dates(conn: sqlite3.Connection) -> List[str]:
+    cur = conn.execute("SELECT DISTINCT ride_date FROM bike_rides WHERE ride_date IS NOT NULL")
+    return [r[0] for r in cur.fetchall()]
+
+
+def main(argv: List[str] | None = None) -> None:
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Rebuild the daily aggregate tables from bike_rides.")
+    parser.add_argument(
+        "--db",
+        dest="db_path",
+        default=os.path.join(repo_root, "data", "processed", "bike_data.db"),
+        help="Path to SQLite DB (default: data/processed/bike_data.db)",
+    )
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db_path)
+    try:
+        with conn:
+            create_tables(conn)
+            n = refresh_all(conn)
+    finally:
+        conn.close()
+    print(f"Refreshed daily aggregates for {n} days in: {args.db_path}")
+
+
+if __name__ == "__main__":
+    main()
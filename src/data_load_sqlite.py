@@ -1,17 +1,24 @@
+import argparse
+import hashlib
 import os
 import re
 import sqlite3
+import time
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin, urlparse
 
 import numpy as np
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
-from geopy.distance import geodesic
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+import daily_aggregates
+from distance import DEFAULT_METHOD, distances_km
+from station_distances import STATION_DISTANCES_PATH, load_station_distances, pair_distances, read_stations
+
 
 URL = 'https://opendata.cui.wroclaw.pl/dataset/wrmprzejazdy_data/resource_history/c737af89-bcf7-4f7d-8bbc-4a0946d7006e'
 
@@ -20,7 +27,7 @@ def repo_root():
     return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
-def make_session():
+def make_session(pool_maxsize: int = 10):
     s = requests.Session()
     retry = Retry(
         total=5,
@@ -30,7 +37,7 @@ def make_session():
         status_forcelist=[429, 500, 502, 503, 504],
         allowed_methods=["GET"],
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize)
     s.mount('http://', adapter)
     s.mount('https://', adapter)
     s.headers.update({
@@ -83,45 +90,74 @@ def pick_latest_csv(csv_urls):
 
 
 def download_file(url: str, out_dir: str, session: requests.Session):
+    """Download ``url`` into ``out_dir`` unless a complete copy is already there.
+
+    Data is streamed to ``<name>.part`` and atomically renamed on completion,
+    so a file at the final path is always complete. An existing ``.part`` from
+    an interrupted run is resumed with an HTTP Range request when the server
+    supports it (206), otherwise it is downloaded again from scratch.
+    """
     ensure_dir(out_dir)
     filename = os.path.basename(urlparse(url).path)
     path = os.path.join(out_dir, filename)
     if os.path.exists(path) and os.path.getsize(path) > 0:
         return path
-    with session.get(url, stream=True, timeout=60) as r:
+    part = path + '.part'
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    # Byte ranges and Content-Length only line up with what we write without
+    # transfer compression
+    headers = {'Accept-Encoding': 'identity'}
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+    with session.get(url, stream=True, timeout=60, headers=headers) as r:
+        if offset and r.status_code == 416:
+            # Stale partial file the server cannot resume from; start over
+            os.remove(part)
+            return download_file(url, out_dir, session)
         r.raise_for_status()
-        with open(path, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192):
+        resumed = offset > 0 and r.status_code == 206
+        expected = r.headers.get('Content-Length')
+        written = 0
+        with open(part, 'ab' if resumed else 'wb') as f:
+            for chunk in r.iter_content(chunk_size=65536):
                 if chunk:
                     f.write(chunk)
+                    written += len(chunk)
+    if expected is not None and written != int(expected):
+        raise IOError(f'Incomplete download of {url}: got {written} of {expected} bytes; will resume next run')
+    os.replace(part, path)
     return path
 
 
-def distance_km(row):
-    a1 = (row['lat_start'], row['lon_start'])
-    a2 = (row['lat_end'], row['lon_end'])
-    try:
-        if np.isnan(a1[0]) or np.isnan(a1[1]) or np.isnan(a2[0]) or np.isnan(a2[1]):
-            return np.nan
-    except TypeError:
-        return np.nan
-    try:
-        return round(geodesic(a1, a2).km, 3)
-    except Exception:
-        return np.nan
-
-
-def transform_data(df: pd.DataFrame, stations_csv_path: str) -> pd.DataFrame:
-    stations = pd.read_csv(stations_csv_path)
-    # Some station coord dumps may accidentally contain a duplicated header row
-    # in the middle of the file ("station_name,lat,lon"), which forces lat/lon
-    # columns to become object dtype (strings) and breaks distance computation.
-    if "station_name" in stations.columns:
-        stations = stations[stations["station_name"].astype(str).str.lower() != "station_name"]
-    # Ensure coordinates are numeric
-    for c in ["lat", "lon"]:
-        if c in stations.columns:
-            stations[c] = pd.to_numeric(stations[c], errors="coerce")
+def download_files(jobs: list[tuple[str, str]], session: requests.Session, workers: int = 4) -> list[str]:
+    """Download ``(url, out_dir)`` jobs concurrently over the shared ``session``.
+
+    Returns local paths in the order of ``jobs``.
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        return [download_file(url, out_dir, session) for url, out_dir in jobs]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda job: download_file(job[0], job[1], session), jobs))
+
+
+def distance_km(row, method: str = DEFAULT_METHOD):
+    """Distance in km for a single ride row (scalar counterpart of ``distances_km``)."""
+    d = distances_km(row['lat_start'], row['lon_start'], row['lat_end'], row['lon_end'], method=method)[0]
+    return np.nan if np.isnan(d) else round(float(d), 3)
+
+
+def transform_data(
+    df: pd.DataFrame,
+    stations_csv_path: str,
+    distance_method: str = DEFAULT_METHOD,
+    distances_cache: str | None = None,
+) -> pd.DataFrame:
+    """Clean a raw rides frame, merge station coordinates and add ``distance``.
+
+    Distances come from the station-pair table built from ``stations_csv_path``
+    (persisted at ``distances_cache`` when given); unknown pairs are computed live.
+    """
+    stations = read_stations(stations_csv_path)
     for col in ['Stacja wynajmu', 'Stacja zwrotu']:
         if col in df.columns:
             s = df[col].astype(str).str.replace('\xa0', '', regex=False).str.rstrip()
@@ -175,7 +211,16 @@ def transform_data(df: pd.DataFrame, stations_csv_path: str) -> pd.DataFrame:
         else:
             # Coerce merged coordinates to numeric in case they came in as strings
             df[c] = pd.to_numeric(df[c], errors='coerce')
-    df['distance'] = df.apply(distance_km, axis=1)
+    table = load_station_distances(stations_csv_path, distances_cache, distance_method)
+    df['distance'] = np.round(
+        pair_distances(
+            table,
+            df.get('start_station', pd.Series(np.nan, index=df.index)),
+            df.get('end_station', pd.Series(np.nan, index=df.index)),
+            df['lat_start'], df['lon_start'], df['lat_end'], df['lon_end'],
+        ),
+        3,
+    )
 
     # Final column order
     cols = [
@@ -187,6 +232,39 @@ def transform_data(df: pd.DataFrame, stations_csv_path: str) -> pd.DataFrame:
     return df[present]
 
 
+# Secondary indexes on bike_rides. The day indexes lead with ride_date and
+# cover every column the daily metric queries read.
+RIDE_INDEXES = {
+    'bike_rides_uid_idx': 'CREATE UNIQUE INDEX IF NOT EXISTS bike_rides_uid_idx ON bike_rides(uid)',
+    # Covers every column the daily metrics read, so a day is one index range scan
+    'bike_rides_day_rides_idx': (
+        'CREATE INDEX IF NOT EXISTS bike_rides_day_rides_idx '
+        'ON bike_rides(ride_date, duration, start_hour, distance, start_station, end_station)'
+    ),
+}
+# Superseded by bike_rides_day_rides_idx; dropped by create_database
+OBSOLETE_RIDE_INDEXES = ('bike_rides_day_idx', 'bike_rides_day_stations_idx')
+
+
+def migrate_bike_rides(conn: sqlite3.Connection) -> None:
+    """Add and backfill ``ride_date``/``start_hour`` on databases created before them."""
+    cols = {r[1] for r in conn.execute('PRAGMA table_info(bike_rides)')}
+    if 'ride_date' in cols and 'start_hour' in cols:
+        return
+    if 'ride_date' not in cols:
+        conn.execute('ALTER TABLE bike_rides ADD COLUMN ride_date TEXT')
+    if 'start_hour' not in cols:
+        conn.execute('ALTER TABLE bike_rides ADD COLUMN start_hour INTEGER')
+    conn.execute(
+        """
+        UPDATE bike_rides
+        SET ride_date = date(start_time),
+            start_hour = CAST(strftime('%H', start_time) AS INTEGER)
+        WHERE start_time IS NOT NULL
+        """
+    )
+
+
 def create_database(db_path: str):
     ensure_dir(os.path.dirname(db_path))
     conn = sqlite3.connect(db_path)
@@ -205,37 +283,333 @@ def create_database(db_path: str):
             lon_start REAL,
             lat_end REAL,
             lon_end REAL,
-            distance REAL
+            distance REAL,
+            ride_date TEXT,
+            start_hour INTEGER
+        )
+        """
+    )
+    migrate_bike_rides(conn)
+    for name in OBSOLETE_RIDE_INDEXES:
+        cur.execute(f'DROP INDEX IF EXISTS {name}')
+    # Idempotency via unique uid; day index for metric queries
+    for sql in RIDE_INDEXES.values():
+        cur.execute(sql)
+    # Ingestion manifest: one row per source CSV that has been loaded
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ingested_files (
+            filename TEXT PRIMARY KEY,
+            size INTEGER,
+            sha256 TEXT,
+            rows_read INTEGER,
+            rows_inserted INTEGER,
+            loaded_at TEXT
         )
         """
     )
-    # Idempotency via unique uid
-    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS bike_rides_uid_idx ON bike_rides(uid)")
+    # Per-day aggregates for the daily metrics (backfilled on first creation)
+    daily_aggregates.create_tables(conn)
     conn.commit()
     conn.close()
 
 
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
 def load_to_sqlite(df: pd.DataFrame, db_path: str):
-    create_database(db_path)
-    conn = sqlite3.connect(db_path)
+    """Insert cleaned rides into ``bike_rides``; rides with a known uid are ignored."""
+    if df.empty:
+        create_database(db_path)
+        return
+    with BulkLoader(db_path) as loader:
+        loader.load(df)
+
+
+def filter_new_rides(df: pd.DataFrame, conn: sqlite3.Connection) -> pd.DataFrame:
+    """Drop raw rows whose ``UID wynajmu`` is already stored in ``bike_rides``.
+
+    Only uids within the incoming frame's min/max range are fetched, which is a
+    range scan on the unique uid index, so memory is bounded by the overlap
+    with previous files rather than by the size of the table. Rows without a
+    parsable uid are kept.
+    """
+    if df.empty or 'UID wynajmu' not in df.columns:
+        return df
+    uids = pd.to_numeric(df['UID wynajmu'], errors='coerce')
+    if uids.isna().all():
+        return df
+    cur = conn.execute(
+        "SELECT uid FROM bike_rides WHERE uid BETWEEN ? AND ?",
+        (int(uids.min()), int(uids.max())),
+    )
+    stored = np.fromiter((r[0] for r in cur), dtype=np.int64)
+    return df.loc[~uids.isin(stored)]
+
+
+RIDE_COLUMNS = [
+    'uid', 'bike_number', 'start_time', 'end_time',
+    'start_station', 'end_station', 'duration',
+    'lat_start', 'lon_start', 'lat_end', 'lon_end', 'distance',
+    'ride_date', 'start_hour',
+]
+
+# Session settings for bulk loads: WAL with relaxed fsync, 64 MiB page cache,
+# temp B-trees (index builds, GROUP BY) in memory.
+BULK_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA temp_store=MEMORY',
+)
+
+
+def _sql_values(s: pd.Series) -> list:
+    """Column values as SQLite-ready Python objects (NaN/NaT/NA -> None)."""
+    if pd.api.types.is_datetime64_any_dtype(s.dtype):
+        s = s.dt.strftime('%Y-%m-%d %H:%M:%S')
+    values = s.astype(object)
+    return values.where(s.notna(), None).tolist()
+
+
+class BulkLoader:
+    """Insert rides into ``bike_rides`` over one tuned connection and transaction.
+
+    Use as a context manager around a whole ingest run: every ``load`` call is
+    a prepared ``executemany`` into the same transaction, committed on exit.
+    ``ride_date`` and ``start_hour`` are derived from ``start_time`` here.
+
+    With ``defer_index`` and an empty table (first-time full load) the
+    indexes in ``RIDE_INDEXES`` are dropped for the duration of the load; on
+    exit duplicate uids are removed (first loaded wins, as with
+    ``INSERT OR IGNORE``) and the indexes are built once.
+
+    Every ``ride_date`` touched by a ``load`` call has its ``daily_aggregates``
+    rows recomputed on exit, in the same transaction.
+    """
+
+    def __init__(self, db_path: str, *, defer_index: bool = False):
+        self.db_path = db_path
+        self.defer_index = defer_index
+        self.conn: sqlite3.Connection | None = None
+        self.rows_inserted = 0
+        self.seconds = 0.0
+        self._hashes: dict[str, str] = {}
+        self._touched_days: set[str] = set()
+
+    def __enter__(self) -> 'BulkLoader':
+        create_database(self.db_path)
+        self.conn = sqlite3.connect(self.db_path, isolation_level=None)
+        for pragma in BULK_PRAGMAS:
+            self.conn.execute(pragma)
+        if self.defer_index and self.conn.execute('SELECT 1 FROM bike_rides LIMIT 1').fetchone():
+            print('bike_rides is not empty; loading with the uid index in place')
+            self.defer_index = False
+        self.conn.execute('BEGIN')
+        if self.defer_index:
+            for name in RIDE_INDEXES:
+                self.conn.execute(f'DROP INDEX IF EXISTS {name}')
+        return self
+
+    def filter_new(self, df: pd.DataFrame) -> pd.DataFrame:
+        """``filter_new_rides`` against this session (sees its own uncommitted rows)."""
+        if self.defer_index:
+            # No index to range-scan; duplicates are removed when the index is built
+            return df
+        return filter_new_rides(df, self.conn)
+
+    def needs_ingest(self, path: str) -> bool:
+        """False if ``path`` is in the ingestion manifest with the same size and hash."""
+        row = self.conn.execute(
+            'SELECT size, sha256 FROM ingested_files WHERE filename = ?', (os.path.basename(path),)
+        ).fetchone()
+        if row is None or row[0] != os.path.getsize(path):
+            return True
+        self._hashes[path] = file_sha256(path)
+        return row[1] != self._hashes[path]
+
+    def record_file(self, path: str, rows_read: int, rows_inserted: int) -> None:
+        """Add or update ``path`` in the manifest, in the same transaction as its rows."""
+        sha = self._hashes.pop(path, None) or file_sha256(path)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO ingested_files '
+            '(filename, size, sha256, rows_read, rows_inserted, loaded_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (
+                os.path.basename(path),
+                os.path.getsize(path),
+                sha,
+                rows_read,
+                rows_inserted,
+                dt.datetime.now().isoformat(timespec='seconds'),
+            ),
+        )
+
+    def load(self, df: pd.DataFrame) -> int:
+        """Insert ``df`` (columns from ``RIDE_COLUMNS``); returns rows inserted."""
+        if df.empty:
+            return 0
+        started = time.perf_counter()
+        if 'start_time' in df.columns:
+            start = pd.to_datetime(df['start_time'], errors='coerce')
+            df = df.assign(ride_date=start.dt.strftime('%Y-%m-%d'), start_hour=start.dt.hour.astype('Int64'))
+            self._touched_days.update(df['ride_date'].dropna().unique())
+        cols = [c for c in RIDE_COLUMNS if c in df.columns]
+        sql = (
+            f"INSERT OR IGNORE INTO bike_rides ({','.join(cols)}) "
+            f"VALUES ({','.join('?' * len(cols))})"
+        )
+        before = self.conn.total_changes
+        self.conn.executemany(sql, zip(*(_sql_values(df[c]) for c in cols)))
+        inserted = self.conn.total_changes - before
+        self.rows_inserted += inserted
+        self.seconds += time.perf_counter() - started
+        return inserted
+
+    def _build_deferred_index(self) -> None:
+        started = time.perf_counter()
+        cur = self.conn.execute(
+            """
+            DELETE FROM bike_rides
+            WHERE uid IS NOT NULL
+              AND rowid NOT IN (SELECT MIN(rowid) FROM bike_rides WHERE uid IS NOT NULL GROUP BY uid)
+            """
+        )
+        self.rows_inserted -= max(cur.rowcount, 0)
+        for sql in RIDE_INDEXES.values():
+            self.conn.execute(sql)
+        self.seconds += time.perf_counter() - started
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None:
+                if self.defer_index:
+                    self._build_deferred_index()
+                started = time.perf_counter()
+                daily_aggregates.refresh_days(self.conn, self._touched_days)
+                self.seconds += time.perf_counter() - started
+                self.conn.execute('COMMIT')
+            else:
+                self.conn.execute('ROLLBACK')
+        finally:
+            self.conn.close()
+            self.conn = None
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows_inserted / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f'Inserted {self.rows_inserted} rows in {self.seconds:.2f}s '
+            f'({self.rows_per_sec:,.0f} rows/s)'
+        )
+
+
+def _read_chunks(path: str, chunk_size: int | None, **kwargs):
+    """Whole file as a single frame, or a chunked reader when ``chunk_size`` is set."""
+    if not chunk_size:
+        return [pd.read_csv(path, encoding='utf-8', **kwargs)]
+    return pd.read_csv(path, encoding='utf-8', chunksize=chunk_size, **kwargs)
+
+
+def ingest_csv(
+    raw_path: str,
+    stations_csv: str,
+    cleaned_path: str,
+    db_path: str | None = None,
+    *,
+    chunk_size: int | None = None,
+    distances_cache: str | None = None,
+    loader: BulkLoader | None = None,
+    stats: dict | None = None,
+) -> int:
+    """Transform a raw rides CSV into ``cleaned_path`` and optionally load it to SQLite.
+
+    With ``chunk_size`` the file is streamed: each chunk of that many rows is
+    read, transformed, appended to the cleaned CSV and loaded before the next
+    one is read, so peak memory does not grow with the file size.
+    When loading to SQLite, rides whose uid is already stored are dropped
+    before the transform (see ``filter_new_rides``), so the cleaned CSV then
+    holds only the new rides. The whole file is loaded over one bulk session
+    and transaction: ``loader`` if given (shared with other files), else one
+    opened for ``db_path``. Returns the number of cleaned rows; ``stats``, if
+    given, receives ``rows_read`` and ``rows_cleaned``.
+    """
+    if db_path and loader is None:
+        with BulkLoader(db_path) as own:
+            return ingest_csv(
+                raw_path,
+                stations_csv,
+                cleaned_path,
+                chunk_size=chunk_size,
+                distances_cache=distances_cache,
+                loader=own,
+                stats=stats,
+            )
+    total = read = 0
+    for i, chunk in enumerate(_read_chunks(raw_path, chunk_size)):
+        read += len(chunk)
+        if loader is not None:
+            chunk = loader.filter_new(chunk)
+        cleaned = transform_data(chunk, stations_csv, distances_cache=distances_cache)
+        cleaned.to_csv(cleaned_path, index=False, mode='w' if i == 0 else 'a', header=i == 0)
+        if loader is not None:
+            loader.load(cleaned)
+        total += len(cleaned)
+    if stats is not None:
+        stats.update(rows_read=read, rows_cleaned=total)
+    return total
+
+
+def transform_csv(
+    raw_path: str,
+    stations_csv: str,
+    cleaned_path: str,
+    *,
+    filter_db: str | None = None,
+    chunk_size: int | None = None,
+    distances_cache: str | None = None,
+    stats: dict | None = None,
+) -> int:
+    """Transform stage only: write the cleaned CSV without touching SQLite.
+
+    Rides already stored in ``filter_db`` are skipped; the DB is opened
+    read-only so this is safe to run in worker processes while another
+    process writes. Returns the number of cleaned rows; ``stats`` as in
+    ``ingest_csv``.
+    """
+    conn = None
+    if filter_db and os.path.exists(filter_db):
+        conn = sqlite3.connect(f'file:{filter_db}?mode=ro', uri=True)
     try:
-        # Stage the data
-        df.to_sql('staging_bike_rides', conn, if_exists='replace', index=False)
-        present = list(df.columns)
-        placeholders = ','.join(present)
-        sql = f"INSERT OR IGNORE INTO bike_rides ({placeholders}) SELECT {placeholders} FROM staging_bike_rides"
-        conn.execute(sql)
-        conn.commit()
+        total = read = 0
+        for i, chunk in enumerate(_read_chunks(raw_path, chunk_size)):
+            read += len(chunk)
+            if conn is not None:
+                chunk = filter_new_rides(chunk, conn)
+            cleaned = transform_data(chunk, stations_csv, distances_cache=distances_cache)
+            cleaned.to_csv(cleaned_path, index=False, mode='w' if i == 0 else 'a', header=i == 0)
+            total += len(cleaned)
+        if stats is not None:
+            stats.update(rows_read=read, rows_cleaned=total)
+        return total
     finally:
-        try:
-            conn.execute('DROP TABLE IF EXISTS staging_bike_rides')
-            conn.commit()
-        except Exception:
-            pass
-        conn.close()
+        if conn is not None:
+            conn.close()
+
+
+def load_cleaned_csv(cleaned_path: str, loader: BulkLoader, chunk_size: int | None = None) -> int:
+    """Load a cleaned CSV written by ``transform_csv``; returns rows inserted."""
+    text_cols = {'bike_number': str, 'start_station': str, 'end_station': str}
+    return sum(loader.load(chunk) for chunk in _read_chunks(cleaned_path, chunk_size, dtype=text_cols))
 
 
-def main():
+def main(chunk_size: int | None = None):
     root = repo_root()
     # Per docs/SPECS.md: SQLite db location: data/processed/bike_data.db
     db_path = os.path.join(root, 'data', 'processed', 'bike_data.db')
@@ -262,23 +636,25 @@ def main():
     print(f'Downloading raw file: {latest_filename}')
     raw_path = download_file(latest_url, raw_dir, session)
 
-    print('Reading raw CSV...')
-    df = pd.read_csv(raw_path, encoding='utf-8')
-
-    print('Transforming...')
-    cleaned = transform_data(df, stations_csv)
-
     # Save cleaned CSV (optional, helpful for debugging and ad-hoc use)
     cleaned_name = os.path.splitext(latest_filename)[0] + '_clean.csv'
     # Save cleaned CSV to data/interim per contract
     cleaned_path = os.path.join(interim_dir, cleaned_name)
-    cleaned.to_csv(cleaned_path, index=False)
-    print(f'Wrote cleaned CSV: {cleaned_path}')
 
-    print('Loading into SQLite...')
-    load_to_sqlite(cleaned, db_path)
-    print(f'Loaded {len(cleaned)} rows (duplicates skipped by uid). DB: {db_path}')
+    print('Transforming and loading into SQLite...')
+    rows = ingest_csv(
+        raw_path,
+        stations_csv,
+        cleaned_path,
+        db_path,
+        chunk_size=chunk_size,
+        distances_cache=STATION_DISTANCES_PATH,
+    )
+    print(f'Wrote cleaned CSV: {cleaned_path}')
+    print(f'Loaded {rows} new rows (rides already in the DB skipped by uid). DB: {db_path}')
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Download the latest rides CSV and load it into SQLite')
+    parser.add_argument('--chunk-size', type=int, default=None, help='Stream the CSV in chunks of this many rows')
+    main(chunk_size=parser.parse_args().chunk_size)
@@ -1,20 +1,43 @@
 #!/usr/bin/env python3
-"""Fetch raw bike status data from the Nextbike API."""
+"""Fetch raw bike status data from the Nextbike API.
+
+Snapshots are saved in the ``compact`` format by default (gzipped, with the
+per-bike fields the status-change detector needs up front); see
+``snapshot_format`` for the formats and ``--format`` to pick another.
+
+Several endpoints (``--url``, repeatable) are fetched concurrently and saved
+as one snapshot holding the cities of all of them.
+
+Usage:
+    python src/fetch_nextbike.py [--format {json,gzip,compact}] [--url URL ...]
+"""
 
 from __future__ import annotations
 
+import argparse
+import asyncio
+import gzip
+import http.client
 import json
 import logging
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import Dict, List, Mapping, NamedTuple, Sequence, Tuple
 from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
 from urllib.request import Request, urlopen
 
+import snapshot_format
+import snapshot_index
+from bike_status_changes import bikes_from_payload
+
 # === CONFIG ===
 # Resolve repo root and default data directory (pathlib-based)
 REPO_ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = REPO_ROOT / "data" / "raw" / "api"
 URL = "https://api-gateway.nextbike.pl/api/maps/service/pl/locations"
+# Endpoints polled together into one snapshot (e.g. more countries)
+URLS = [URL]
 TIMEZONE = "Europe/Warsaw"  # for local timestamp in filename
 
 logger = logging.getLogger(__name__)
@@ -32,56 +55,204 @@ def now_local_iso():
 def now_local_for_filename():
     return datetime.now(tz=ZONE).strftime("%Y-%m-%d_%H_%M_%S")
 
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
+    " AppleWebKit/537.36 (KHTML, like Gecko)"
+    " Chrome/91.0.4472.124 Safari/537.36"
+)
+
+
 def fetch_json(url: str):
-    req = Request(
-        url,
-        headers={
-            "User-Agent": (
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
-                " AppleWebKit/537.36 (KHTML, like Gecko)"
-                " Chrome/91.0.4472.124 Safari/537.36"
-            )
-        },
-    )
+    req = Request(url, headers={"User-Agent": USER_AGENT})
     with urlopen(req, timeout=30) as resp:
         charset = resp.headers.get_content_charset() or "utf-8"
         raw = resp.read().decode(charset, errors="replace")
         return json.loads(raw)
 
-def main() -> Path | None:
-    """Fetch the latest snapshot and save it under ``data/raw/api``.
 
-    Returns the path to the saved file on success, otherwise ``None``.
+class Session:
+    """Keep-alive HTTP(S) connection for repeated fetches (the pipeline daemon).
+
+    ``fetch_json`` behaves like the module-level function (same errors), but
+    reuses one connection, so polls skip the TCP and TLS handshakes, and
+    asks for a gzipped response. A connection the server dropped while idle
+    is reopened once.
+    """
+
+    def __init__(self, timeout: float = 30) -> None:
+        self.timeout = timeout
+        self._conn: http.client.HTTPConnection | None = None
+        self._origin: Tuple[str, str] | None = None
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        if self._conn is None or self._origin != (scheme, netloc):
+            self.close()
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            self._conn, self._origin = cls(netloc, timeout=self.timeout), (scheme, netloc)
+        return self._conn
+
+    def fetch_json(self, url: str):
+        parts = urlsplit(url)
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "gzip"}
+        for retry in (False, True):
+            reused = self._conn is not None
+            conn = self._connection(parts.scheme, parts.netloc)
+            try:
+                conn.request("GET", target, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+                break
+            except ConnectionError as e:
+                self.close()
+                if retry or not reused:
+                    raise URLError(e) from e
+            except (http.client.HTTPException, OSError) as e:
+                self.close()
+                raise URLError(e) from e
+        if resp.status >= 400:
+            raise HTTPError(url, resp.status, resp.reason, resp.headers, None)
+        if resp.getheader("Content-Encoding", "").lower() == "gzip":
+            body = gzip.decompress(body)
+        charset = resp.headers.get_content_charset() or "utf-8"
+        return json.loads(body.decode(charset, errors="replace"))
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self) -> "Session":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+async def fetch_all(urls: Sequence[str], sessions: Mapping[str, Session] | None = None) -> List[object]:
+    """Responses of ``urls`` (or the exception each raised), fetched concurrently.
+
+    Each request runs in a worker thread, over ``sessions[url]`` if given.
     """
 
+    def get(url: str):
+        session = sessions.get(url) if sessions else None
+        return session.fetch_json(url) if session is not None else fetch_json(url)
+
+    return await asyncio.gather(*(asyncio.to_thread(get, url) for url in urls), return_exceptions=True)
+
+
+def _domains(response) -> List[object]:
+    return (response.get("data") or []) if isinstance(response, dict) else list(response or [])
+
+
+class Snapshot(NamedTuple):
+    path: Path
+    fetched_at: str
+    # Parsed bikes per city (None if the response did not have the expected layout)
+    bikes: Dict[str, Dict[str, Dict[str, object]]] | None
+    # True if the response equals the snapshot at ``path`` (only a marker was added)
+    unchanged: bool
+
+
+def fetch_snapshot(
+    fmt: str = snapshot_format.DEFAULT_FORMAT,
+    sessions: Mapping[str, Session] | None = None,
+    urls: Sequence[str] | None = None,
+) -> Snapshot | None:
+    """Fetch the latest snapshot and save it under ``data/raw/api`` in format ``fmt``.
+
+    ``urls`` (default ``URLS``) are fetched concurrently (see ``fetch_all``)
+    and their ``data`` domains saved as one snapshot; if some fail, the
+    others are still saved. A response identical to the last saved one (see
+    ``snapshot_format.content_hash``) is not saved again; an "unchanged"
+    marker is added to the snapshot index instead.
+
+    A response the bike parser fails on is still saved (as ``gzip``), but
+    indexed as unparsed (see ``snapshot_index``) and returned without bikes.
+
+    Returns the saved ``Snapshot`` on success, otherwise ``None``.
+    """
+
+    urls = list(urls or URLS)
     DATA_DIR.mkdir(parents=True, exist_ok=True)
-    logger.info("Fetching bike status snapshot from %s", URL)
-    try:
-        payload = fetch_json(URL)
-    except HTTPError as e:
-        logger.error("HTTP %s: %s", e.code, e.reason)
-        return None
-    except URLError as e:
-        logger.error("URL error: %s", e.reason)
-        return None
-    except Exception as e:  # pragma: no cover - unexpected failures
-        logger.error("Unexpected error: %s", e)
+    logger.info("Fetching bike status snapshot from %s", ", ".join(urls))
+    responses = []
+    for url, response in zip(urls, asyncio.run(fetch_all(urls, sessions))):
+        if isinstance(response, HTTPError):
+            logger.error("HTTP %s: %s (%s)", response.code, response.reason, url)
+        elif isinstance(response, URLError):
+            logger.error("URL error: %s (%s)", response.reason, url)
+        elif isinstance(response, Exception):  # pragma: no cover - unexpected failures
+            logger.error("Unexpected error: %s (%s)", response, url)
+        else:
+            responses.append(response)
+    if not responses:
         return None
+    # A single endpoint's response is kept as is
+    payload = responses[0] if len(urls) == 1 else {"data": [d for r in responses for d in _domains(r)]}
 
     timestamp_iso = now_local_iso()
 
+    # _fetched_at goes first so readers can get it from the file header
     if isinstance(payload, dict):
-        payload["_fetched_at"] = timestamp_iso
+        payload = {"_fetched_at": timestamp_iso, **{k: v for k, v in payload.items() if k != "_fetched_at"}}
     else:
         payload = {"_fetched_at": timestamp_iso, "data": payload}
 
-    fname = f"bike_rides_{now_local_for_filename()}.json"
-    fpath = DATA_DIR / fname
-    with open(fpath, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    if not snapshot_index.index_path(DATA_DIR).exists():
+        # First run with an index: cover the snapshots saved before it existed
+        logger.info("Indexed %d existing snapshots", snapshot_index.rebuild(DATA_DIR))
+
+    # Quiet hours repeat the same response: record a marker instead of a copy
+    content_hash = snapshot_format.content_hash(payload)
+    last = snapshot_index.last_fetch(DATA_DIR)
+    if last is not None and last[1] == content_hash and (DATA_DIR / last[0]).exists():
+        snapshot_index.append_unchanged(DATA_DIR, timestamp_iso, last[0], content_hash)
+        logger.info("Snapshot unchanged since %s; recorded marker only", last[0])
+        return Snapshot(DATA_DIR / last[0], timestamp_iso, None, True)
+
+    try:
+        bikes = bikes_from_payload(payload)
+    except (KeyError, IndexError, TypeError, AttributeError) as e:
+        bikes = None
+        if fmt == "compact":
+            # Keep the response even if its layout is unexpected
+            logger.warning("Unexpected payload layout (%s); saving it as gzip", e)
+            fmt = "gzip"
+    fpath = DATA_DIR / f"bike_rides_{now_local_for_filename()}{snapshot_format.suffix_for(fmt)}"
+    snapshot_format.write_snapshot(fpath, payload, fmt, bikes)
+    # Kept for inspection, but marked so the status-change detector skips it
+    snapshot_index.append(DATA_DIR, timestamp_iso, fpath, content_hash, unparsed=bikes is None)
     logger.info("Saved snapshot to %s", fpath)
-    return fpath
+    return Snapshot(fpath, timestamp_iso, bikes, False)
+
+
+def main(fmt: str = snapshot_format.DEFAULT_FORMAT, urls: Sequence[str] | None = None) -> Path | None:
+    """Fetch the latest snapshot and save it under ``data/raw/api`` (see ``fetch_snapshot``).
+
+    Returns the path to the saved file (for an unchanged response, the
+    earlier identical snapshot) on success, otherwise ``None``.
+    """
+    snapshot = fetch_snapshot(fmt, urls=urls)
+    return snapshot.path if snapshot is not None else None
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Fetch a Nextbike API snapshot into data/raw/api.")
+    parser.add_argument(
+        "--format",
+        dest="fmt",
+        choices=snapshot_format.FORMATS,
+        default=snapshot_format.DEFAULT_FORMAT,
+        help=f"Snapshot file format (default: {snapshot_format.DEFAULT_FORMAT})",
+    )
+    parser.add_argument(
+        "--url",
+        dest="urls",
+        action="append",
+        metavar="URL",
+        help=f"API endpoint to fetch (repeatable; default: {URL})",
+    )
+    args = parser.parse_args()
+    main(args.fmt, args.urls)
@@ -1,28 +1,55 @@
-"""Run the full ETL pipeline for bike status data."""
+"""Run the full ETL pipeline for bike status data.
+
+Usage:
+    python src/pipeline.py                           # one fetch + status changes (cron)
+    python src/pipeline.py --daemon --interval 60    # poll every 60 seconds until stopped
+
+``--url`` (repeatable) polls several API endpoints concurrently and
+``--city`` (repeatable) limits the tracked cities (default: all).
+
+The daemon keeps a keep-alive connection per API endpoint, the last snapshot's
+bikes in memory and the status DB open, so a cycle is just fetch, parse,
+diff and insert. Cycles start on a fixed schedule (``interval`` seconds
+after the previous start, not after its end; slots missed by a slow cycle
+are skipped). SIGINT/SIGTERM stop it after the current cycle.
+"""
 
 from __future__ import annotations
 
+import argparse
+import contextlib
 import logging
+import signal
+import threading
+import time
 from datetime import datetime
+from pathlib import Path
+from typing import Collection, List, Sequence
 
 import bike_status_changes  # noqa: E402
 import fetch_nextbike  # noqa: E402
+import snapshot_format  # noqa: E402
 from logging_config import setup_logging  # noqa: E402
 
+DEFAULT_INTERVAL = 60
 
-def main() -> None:
-    setup_logging()
+
+def run_once(
+    fmt: str = snapshot_format.DEFAULT_FORMAT,
+    urls: Sequence[str] | None = None,
+    cities: Collection[str] | None = None,
+) -> None:
     logger = logging.getLogger("pipeline")
     start = datetime.utcnow().isoformat()
     logger.info("ETL pipeline started", extra={"start": start})
 
-    snapshot_path = fetch_nextbike.main()
+    snapshot_path = fetch_nextbike.main(fmt, urls)
     if snapshot_path is None:
         logger.error("Snapshot fetch failed; aborting")
         return
     logger.info("Fetched snapshot %s", snapshot_path)
 
-    result = bike_status_changes.main()
+    result = bike_status_changes.main(cities=cities)
     files = ", ".join(p.name for p in result.get("files", []))
     logger.info(
         "Processed snapshots: %s; added %d records",
@@ -33,5 +60,122 @@ def main() -> None:
     logger.info("ETL pipeline finished", extra={"end": end})
 
 
+def run_daemon(
+    interval: float = DEFAULT_INTERVAL,
+    fmt: str = snapshot_format.DEFAULT_FORMAT,
+    stop: threading.Event | None = None,
+    max_cycles: int | None = None,
+    db_path: Path = bike_status_changes.DEFAULT_DB_PATH,
+    urls: Sequence[str] | None = None,
+    cities: Collection[str] | None = None,
+) -> int:
+    """Poll every ``interval`` seconds until ``stop`` is set (or SIGINT/SIGTERM).
+
+    Returns the number of cycles run. ``max_cycles`` bounds the loop (tests).
+    """
+    stop = stop or threading.Event()
+    handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            handlers[sig] = signal.signal(sig, lambda signum, frame: stop.set())
+    try:
+        return _poll(interval, fmt, stop, max_cycles, db_path, list(urls or fetch_nextbike.URLS), cities)
+    finally:
+        for sig, handler in handlers.items():
+            signal.signal(sig, handler)
+
+
+def _poll(
+    interval: float,
+    fmt: str,
+    stop: threading.Event,
+    max_cycles: int | None,
+    db_path: Path,
+    urls: List[str],
+    cities: Collection[str] | None,
+) -> int:
+    logger = logging.getLogger("pipeline")
+    cycles = 0
+    with contextlib.ExitStack() as stack:
+        sessions = {url: stack.enter_context(fetch_nextbike.Session()) for url in urls}
+        tracker = stack.enter_context(bike_status_changes.StatusTracker(fetch_nextbike.DATA_DIR, db_path, cities))
+        # The first cycle catches up on snapshots saved while the daemon was not
+        # running; if that fails, it is logged and retried like a failed poll
+        in_sync = False
+        next_start = time.monotonic()
+        logger.info("Polling %s every %ss", ", ".join(urls), interval)
+        while not stop.is_set():
+            started = time.monotonic()
+            try:
+                if not in_sync:
+                    tracker.catch_up()
+                    in_sync = True
+                snapshot = fetch_nextbike.fetch_snapshot(fmt, sessions, urls)
+                # Without bikes the response could not be parsed (saved, but indexed as unparsed)
+                if snapshot is not None and not snapshot.unchanged and snapshot.bikes is not None:
+                    events = tracker.process(snapshot.path, snapshot.fetched_at, snapshot.bikes)
+                    logger.info("Recorded %d events from %s", events, snapshot.path.name)
+            except Exception:
+                # The tracker's state is only advanced on commit: re-sync from the index next cycle
+                logger.exception("Poll failed")
+                in_sync = False
+            cycles += 1
+            logger.info("Cycle finished in %.3fs", time.monotonic() - started)
+            if max_cycles is not None and cycles >= max_cycles:
+                break
+
+            next_start += interval
+            now = time.monotonic()
+            if next_start < now:
+                missed = int((now - next_start) // interval) + 1
+                logger.warning("Cycle overran the interval; skipping %d poll(s)", missed)
+                next_start += missed * interval
+            stop.wait(next_start - now)
+    logger.info("Daemon stopped after %d cycle(s)", cycles)
+    return cycles
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Fetch a Nextbike snapshot and record bike status changes.")
+    parser.add_argument("--daemon", action="store_true", help="Keep running and poll every --interval seconds")
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DEFAULT_INTERVAL,
+        help=f"With --daemon, seconds between polls (default: {DEFAULT_INTERVAL})",
+    )
+    parser.add_argument(
+        "--format",
+        dest="fmt",
+        choices=snapshot_format.FORMATS,
+        default=snapshot_format.DEFAULT_FORMAT,
+        help=f"Snapshot file format (default: {snapshot_format.DEFAULT_FORMAT})",
+    )
+    parser.add_argument(
+        "--url",
+        dest="urls",
+        action="append",
+        metavar="URL",
+        help=f"API endpoint to poll (repeatable; default: {fetch_nextbike.URL})",
+    )
+    parser.add_argument(
+        "--city",
+        dest="cities",
+        action="append",
+        metavar="NAME",
+        help="Track only this city (repeatable; default: every city in the responses)",
+    )
+    args = parser.parse_args(argv)
+    if args.interval < 1:
+        # Snapshot file names have a resolution of one second
+        parser.error("--interval must be at least 1 second")
+
+    setup_logging()
+    if args.daemon:
+        run_daemon(args.interval, args.fmt, urls=args.urls, cities=args.cities)
+    else:
+        run_once(args.fmt, args.urls, args.cities)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,174 @@
+"""On-disk formats of the Nextbike API snapshots.
+
+Three formats are written by ``fetch_nextbike`` and read transparently:
+
+- ``json``: the raw API response as a ``.json`` file (the original format).
+- ``gzip``: the raw response as compact JSON in a ``.json.gz`` file.
+- ``compact`` (default): a gzipped ``.json.gz`` file of two lines. The first
+  holds ``_fetched_at`` and just the per-bike fields ``load_snapshot`` needs
+  for every city, as tables of cities, places and bikes::
+
+      {"_fetched_at": "...", "format": "bikes-v2",
+       "cities": [city_name, ...],
+       "places": [[city_index, station_name, station_id, lat, lon], ...],
+       "bikes": [[bike_id, place_index, bike_type, battery], ...]}
+
+  The second line is the raw response, so nothing is lost, but readers of
+  bikes stop after the first line and never decode it. (``bikes-v1``
+  headers held the first city only; those files are read from the raw line.)
+
+``_fetched_at`` comes first in every new file, so it can be read from the
+first bytes (see ``snapshot_index.read_fetched_at``).
+
+``content_hash`` identifies a response regardless of when it was fetched;
+``fetch_nextbike`` uses it to skip saving responses identical to the last one.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Callable, Collection, Dict, List, Tuple
+
+FORMATS = ("json", "gzip", "compact")
+DEFAULT_FORMAT = "compact"
+COMPACT_VERSION = "bikes-v2"
+_COMPACT_V1 = "bikes-v1"
+SUFFIXES = (".json", ".json.gz")
+
+# Set per fetch rather than by the API, so left out of content_hash
+VOLATILE_FIELDS = ("_fetched_at",)
+
+_COMPACT = {"separators": (",", ":"), "ensure_ascii": False}
+
+Bikes = Dict[str, Dict[str, object]]
+# City name -> bikes
+CityBikes = Dict[str, Bikes]
+
+
+def suffix_for(fmt: str) -> str:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown snapshot format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    return ".json" if fmt == "json" else ".json.gz"
+
+
+def is_snapshot(path: Path) -> bool:
+    return Path(path).name.endswith(SUFFIXES)
+
+
+def content_hash(payload: Dict[str, object]) -> str:
+    """SHA-256 of ``payload`` without ``VOLATILE_FIELDS`` (key order ignored)."""
+    stable = {k: v for k, v in payload.items() if k not in VOLATILE_FIELDS}
+    return hashlib.sha256(json.dumps(stable, sort_keys=True, **_COMPACT).encode("utf-8")).hexdigest()
+
+
+def open_binary(path: Path):
+    """The snapshot's (decompressed) bytes as a binary file object."""
+    return gzip.open(path, "rb") if str(path).endswith(".gz") else open(path, "rb")
+
+
+def _compact_header(fetched_at: str, city_bikes: CityBikes) -> Dict[str, object]:
+    places: Dict[Tuple, int] = {}
+    rows: List[List[object]] = []
+    for city_index, bikes in enumerate(city_bikes.values()):
+        for bike_id, info in bikes.items():
+            place = (city_index, info["station_name"], info["station_id"], info["lat"], info["lon"])
+            rows.append([bike_id, places.setdefault(place, len(places)), info["bike_type"], info["battery"]])
+    return {
+        "_fetched_at": fetched_at,
+        "format": COMPACT_VERSION,
+        "cities": list(city_bikes),
+        "places": [list(p) for p in places],
+        "bikes": rows,
+    }
+
+
+def write_snapshot(path: Path, payload: Dict[str, object], fmt: str, bikes: CityBikes | None = None) -> Path:
+    """Write ``payload`` (with ``_fetched_at`` as its first key) to ``path`` in ``fmt``.
+
+    ``compact`` also needs the parsed bikes of every city. The file appears
+    atomically.
+    """
+    suffix_for(fmt)
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    if fmt == "json":
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+    else:
+        with gzip.open(tmp, "wb", compresslevel=6) as f:
+            if fmt == "compact":
+                if bikes is None:
+                    raise ValueError("the compact snapshot format needs the parsed bikes")
+                header = _compact_header(str(payload.get("_fetched_at", "")), bikes)
+                f.write(json.dumps(header, **_COMPACT).encode("utf-8") + b"\n")
+            f.write(json.dumps(payload, **_COMPACT).encode("utf-8") + b"\n")
+    os.replace(tmp, path)
+    return path
+
+
+def _bikes_from_header(header: Dict[str, object], cities: Collection[str] | None) -> CityBikes:
+    out: CityBikes = {}
+    for name in header["cities"]:
+        if cities is None or name in cities:
+            out.setdefault(name, {})
+    by_city = [out.get(name) for name in header["cities"]]
+    places = header["places"]
+    # Bikes of each place go to its city's map (None: city not wanted)
+    targets = [by_city[p[0]] for p in places]
+    for bike_id, p, bike_type, battery in header["bikes"]:
+        target = targets[p]
+        if target is not None:
+            place = places[p]
+            target[bike_id] = {
+                "station_name": place[1],
+                "station_id": place[2],
+                "lat": place[3],
+                "lon": place[4],
+                "bike_type": bike_type,
+                "battery": battery,
+            }
+    return out
+
+
+def _read_first(f) -> Dict[str, object]:
+    """The compact header, or the whole document if the file is a single JSON value."""
+    first = f.readline()
+    try:
+        return json.loads(first)
+    except ValueError:
+        # Pretty-printed JSON spans many lines
+        return json.loads(first + f.read())
+
+
+def _is_compact(doc: object) -> bool:
+    return isinstance(doc, dict) and doc.get("format") in (COMPACT_VERSION, _COMPACT_V1)
+
+
+def read_bikes(
+    path: Path,
+    from_payload: Callable[[Dict[str, object], Collection[str] | None], CityBikes],
+    cities: Collection[str] | None = None,
+) -> Tuple[str | None, CityBikes]:
+    """``(fetched_at, bikes per city)`` of a snapshot in any format.
+
+    Only ``cities`` are kept (all if None). Compact snapshots are decoded
+    from their first line only; the others are parsed in full and handed
+    to ``from_payload``.
+    """
+    with open_binary(path) as f:
+        doc = _read_first(f)
+        if _is_compact(doc) and doc["format"] == _COMPACT_V1:
+            doc = json.loads(f.readline())
+    if _is_compact(doc):
+        return doc.get("_fetched_at"), _bikes_from_header(doc, cities)
+    return doc.get("_fetched_at"), from_payload(doc, cities)
+
+
+def read_payload(path: Path) -> Dict[str, object]:
+    """The raw API response (with ``_fetched_at``) of a snapshot in any format."""
+    with open_binary(path) as f:
+        doc = _read_first(f)
+        return json.loads(f.readline()) if _is_compact(doc) else doc
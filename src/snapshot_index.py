@@ -0,0 +1,221 @@
+"""Append-only index of the Nextbike API snapshots in ``data/raw/api``.
+
+``fetch_nextbike`` appends one JSON line per saved snapshot to
+``snapshots.jsonl`` in the snapshot directory::
+
+    {"fetched_at": "2025-04-07T13:00:05+02:00", "file": "bike_rides_2025-04-07_13_00_05.json.gz", "hash": "..."}
+
+A response identical to the previous one (same ``hash``) is not saved; only
+an "unchanged" marker line is appended instead::
+
+    {"fetched_at": "2025-04-07T13:01:05+02:00", "same_as": "bike_rides_2025-04-07_13_00_05.json.gz", "hash": "..."}
+
+Markers are not snapshots: every reader below skips them, so unchanged
+fetches cost the status-change detector nothing. Readers also skip
+snapshots saved with ``"unparsed": true``: responses whose layout the bike
+parser did not understand, kept only for inspection.
+
+Lines are appended in fetch order, so the latest snapshots are found by
+reading the end of the index only, however many snapshots have piled up
+(and in that order, which unlike the local timestamps holds across DST).
+Directories without an index (or with one that lists fewer snapshots than
+asked for) fall back to scanning the snapshot files, reading only the few
+bytes that hold ``_fetched_at`` instead of parsing whole files. Snapshots
+may be plain ``.json`` or gzipped ``.json.gz`` (see ``snapshot_format``).
+"""
+from __future__ import annotations
+
+import json
+import os
+import itertools
+import re
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import snapshot_format
+
+INDEX_NAME = "snapshots.jsonl"
+SNAPSHOT_GLOB = "bike_rides_*.json*"
+
+# ``_fetched_at`` is the first key of new snapshots and the last key of older ones
+_PEEK_BYTES = 512
+_BLOCK_BYTES = 4096
+_FETCHED_AT_RE = re.compile(rb'"_fetched_at"\s*:\s*"([^"]*)"')
+
+
+def index_path(data_dir: Path) -> Path:
+    return Path(data_dir) / INDEX_NAME
+
+
+def _append_line(data_dir: Path, entry: Dict[str, str]) -> None:
+    with open(index_path(data_dir), "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def append(
+    data_dir: Path, fetched_at: str, snapshot: Path, content_hash: str | None = None, unparsed: bool = False
+) -> None:
+    """Record ``snapshot`` (a file in ``data_dir``) as fetched at ``fetched_at``.
+
+    ``unparsed`` marks a response the bike parser failed on, so readers skip it.
+    """
+    entry = {"fetched_at": fetched_at, "file": Path(snapshot).name}
+    if content_hash:
+        entry["hash"] = content_hash
+    if unparsed:
+        entry["unparsed"] = True
+    _append_line(data_dir, entry)
+
+
+def append_unchanged(data_dir: Path, fetched_at: str, same_as: str, content_hash: str) -> None:
+    """Record a fetch at ``fetched_at`` whose response equals snapshot ``same_as``."""
+    _append_line(data_dir, {"fetched_at": fetched_at, "same_as": same_as, "hash": content_hash})
+
+
+def last_fetch(data_dir: Path) -> Tuple[str, str] | None:
+    """``(file, hash)`` of the last indexed fetch (for a marker, the snapshot it repeats).
+
+    None without an index or if the last entry has no hash.
+    """
+    index = index_path(data_dir)
+    if not index.exists():
+        return None
+    for raw in _reverse_lines(index):
+        try:
+            entry = json.loads(raw)
+        except ValueError:
+            continue
+        if not isinstance(entry, dict):
+            continue
+        file, content_hash = entry.get("file") or entry.get("same_as"), entry.get("hash")
+        return (file, content_hash) if file and content_hash else None
+    return None
+
+
+def read_fetched_at(path: Path) -> str:
+    """``_fetched_at`` of a snapshot, read from its first/last bytes when possible."""
+    compressed = str(path).endswith(".gz")
+    with snapshot_format.open_binary(path) as f:
+        head = f.read(_PEEK_BYTES)
+        match = _FETCHED_AT_RE.search(head)
+        # Gzip files cannot be read from the end (and always start with it)
+        if match is None and not compressed:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - _PEEK_BYTES))
+            match = _FETCHED_AT_RE.search(f.read())
+        if match is not None:
+            return match.group(1).decode("utf-8")
+        # Unusual layout: parse the whole file
+        f.seek(0)
+        payload = json.loads(f.readline() if compressed else f.read().decode("utf-8"))
+    value = payload.get("_fetched_at", "") if isinstance(payload, dict) else ""
+    return value if isinstance(value, str) else ""
+
+
+def scan(data_dir: Path) -> List[Tuple[str, Path]]:
+    """``(fetched_at, path)`` of every snapshot file in ``data_dir``, oldest first."""
+    meta = []
+    for path in Path(data_dir).glob(SNAPSHOT_GLOB):
+        if not snapshot_format.is_snapshot(path):
+            continue
+        try:
+            meta.append((read_fetched_at(path), path))
+        except (OSError, ValueError):
+            continue
+    meta.sort(key=lambda x: x[0])
+    return meta
+
+
+def rebuild(data_dir: Path) -> int:
+    """Rewrite the index from the snapshot files; returns the number of entries."""
+    entries = scan(data_dir)
+    tmp = index_path(data_dir).with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        for fetched_at, path in entries:
+            f.write(json.dumps({"fetched_at": fetched_at, "file": path.name}, ensure_ascii=False) + "\n")
+    os.replace(tmp, index_path(data_dir))
+    return len(entries)
+
+
+def _reverse_entries(index: Path) -> Iterator[Tuple[str, Path]]:
+    """``(fetched_at, path)`` of the indexed snapshots, newest first."""
+    for raw in _reverse_lines(index):
+        entry = _parse_entry(index, raw)
+        if entry is not None:
+            yield entry
+
+
+def _reverse_lines(index: Path) -> Iterator[bytes]:
+    """Lines of the index, newest first, read backwards in blocks."""
+    with open(index, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        rest = b""
+        while pos > 0:
+            step = min(_BLOCK_BYTES, pos)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + rest).split(b"\n")
+            # The first line may continue in the previous block
+            rest = lines.pop(0) if pos > 0 else b""
+            for raw in reversed(lines):
+                if raw.strip():
+                    yield raw
+
+
+def _parse_entry(index: Path, raw: bytes) -> Tuple[str, Path] | None:
+    """``(fetched_at, path)`` of a snapshot line; None for markers, unparsed snapshots and bad lines."""
+    try:
+        entry = json.loads(raw)
+        if "same_as" in entry or entry.get("unparsed"):
+            return None
+        return entry.get("fetched_at", ""), index.parent / entry["file"]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def latest(data_dir: Path, count: int = 2) -> List[Path]:
+    """The ``count`` most recent snapshots in ``data_dir``, oldest first.
+
+    Read from the tail of the index when it lists enough existing snapshots;
+    otherwise every snapshot file is scanned (see ``scan``).
+    """
+    if count <= 0:
+        return []
+    index = index_path(data_dir)
+    if index.exists():
+        found = list(itertools.islice((e for e in _reverse_entries(index) if e[1].exists()), count))
+        if len(found) == count:
+            return [p for _, p in reversed(found)]
+    return [p for _, p in scan(data_dir)[-count:]]
+
+
+def ordered(data_dir: Path) -> List[Tuple[str, Path]]:
+    """``(fetched_at, path)`` of every snapshot, oldest first (index order if indexed)."""
+    index = index_path(data_dir)
+    if not index.exists():
+        return scan(data_dir)
+    with open(index, "rb") as f:
+        entries = [_parse_entry(index, raw) for raw in f]
+    return [e for e in entries if e is not None and e[1].exists()]
+
+
+def since(data_dir: Path, fetched_at: str, file: str | None = None) -> List[Tuple[str, Path]]:
+    """``(fetched_at, path)`` of the snapshots fetched after snapshot ``file``, oldest first.
+
+    The index is read backwards until ``file`` is reached, so only the new
+    entries are read and their order is the fetch order (unlike the local
+    ``fetched_at`` strings, which do not sort across a DST change). If
+    ``file`` is not indexed (or not given), snapshots are selected by
+    ``fetched_at`` instead; without an index every snapshot file is scanned.
+    """
+    index = index_path(data_dir)
+    if not index.exists():
+        return [e for e in scan(data_dir) if e[0] > fetched_at]
+    newer = []
+    for entry in _reverse_entries(index):
+        if entry[1].name == file or (file is None and entry[0] <= fetched_at):
+            break
+        newer.append(entry)
+    else:
+        newer = [e for e in newer if e[0] > fetched_at]
+    return [e for e in reversed(newer) if e[1].exists()]
@@ -0,0 +1,156 @@
+"""Precomputed distances between every pair of bike stations.
+
+Rides only go between the stations listed in ``data/bike_stations_coords.csv``,
+so the ETL looks distances up in a station x station matrix instead of
+recomputing them per ride. The matrix is persisted as ``.npz`` and rebuilt
+automatically whenever the content of the coordinates file (or the distance
+method) changes. Pairs that are not in the table, or whose coordinates differ
+from the table, fall back to live computation.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from distance import DEFAULT_METHOD, distances_km
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIONS_CSV_PATH = os.path.join(REPO_ROOT, "data", "bike_stations_coords.csv")
+STATION_DISTANCES_PATH = os.path.join(REPO_ROOT, "data", "processed", "station_distances.npz")
+# Ride coordinates within this many degrees (~0.1 m) of the table's count as the station's
+COORD_TOLERANCE_DEG = 1e-6
+
+
+class StationDistances(NamedTuple):
+    names: np.ndarray
+    lat: np.ndarray
+    lon: np.ndarray
+    matrix: np.ndarray
+    fingerprint: str
+    method: str
+
+
+# In-process memo: (abs stations path, method) -> StationDistances
+_MEMO: Dict[Tuple[str, str], StationDistances] = {}
+
+
+def read_stations(path: str) -> pd.DataFrame:
+    """Read the stations coordinates CSV with numeric ``lat``/``lon``."""
+    stations = pd.read_csv(path)
+    # Some station coord dumps may accidentally contain a duplicated header row
+    # in the middle of the file ("station_name,lat,lon"), which forces lat/lon
+    # columns to become object dtype (strings) and breaks distance computation.
+    if "station_name" in stations.columns:
+        stations = stations[stations["station_name"].astype(str).str.lower() != "station_name"]
+    # Ensure coordinates are numeric
+    for c in ["lat", "lon"]:
+        if c in stations.columns:
+            stations[c] = pd.to_numeric(stations[c], errors="coerce")
+    return stations
+
+
+def file_fingerprint(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def build_station_distances(stations_csv: str, method: str = DEFAULT_METHOD) -> StationDistances:
+    stations = read_stations(stations_csv).drop_duplicates("station_name")
+    names = stations["station_name"].astype(str).to_numpy(dtype=str)
+    lat = stations["lat"].to_numpy(dtype=float)
+    lon = stations["lon"].to_numpy(dtype=float)
+    n = len(names)
+    i, j = np.triu_indices(n)
+    upper = distances_km(lat[i], lon[i], lat[j], lon[j], method=method)
+    matrix = np.full((n, n), np.nan)
+    matrix[i, j] = upper
+    matrix[j, i] = upper
+    return StationDistances(names, lat, lon, matrix, file_fingerprint(stations_csv), method)
+
+
+def _read_cache(cache_path: str) -> Optional[StationDistances]:
+    try:
+        with np.load(cache_path, allow_pickle=False) as npz:
+            return StationDistances(
+                npz["names"], npz["lat"], npz["lon"], npz["matrix"],
+                str(npz["fingerprint"]), str(npz["method"]),
+            )
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _write_cache(table: StationDistances, cache_path: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    tmp = f"{cache_path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp, **table._asdict())
+    os.replace(tmp, cache_path)
+
+
+def load_station_distances(
+    stations_csv: str = STATIONS_CSV_PATH,
+    cache_path: Optional[str] = None,
+    method: str = DEFAULT_METHOD,
+) -> StationDistances:
+    """Return the station distance table for ``stations_csv``.
+
+    With ``cache_path`` the table is read from (or written to) that ``.npz``
+    file; a stale cache is rebuilt. Results are memoized per process either way.
+    """
+    key = (os.path.abspath(stations_csv), method)
+    fingerprint = file_fingerprint(stations_csv)
+    table = _MEMO.get(key)
+    if table is not None and table.fingerprint == fingerprint:
+        return table
+
+    table = _read_cache(cache_path) if cache_path and os.path.exists(cache_path) else None
+    if table is None or table.fingerprint != fingerprint or table.method != method:
+        table = build_station_distances(stations_csv, method)
+        if cache_path:
+            _write_cache(table, cache_path)
+    _MEMO[key] = table
+    return table
+
+
+def _same_coord(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # Absolute only: a relative tolerance at ~51 degrees would accept tens of metres
+    return np.isclose(a, b, rtol=0, atol=COORD_TOLERANCE_DEG)
+
+
+def pair_distances(
+    table: StationDistances,
+    start_station,
+    end_station,
+    lat_start,
+    lon_start,
+    lat_end,
+    lon_end,
+) -> np.ndarray:
+    """Distances (km) for rides, looked up by station pair where possible.
+
+    A lookup is used only when both station names are in the table and the
+    ride's coordinates match the table's; every other ride is computed live
+    with the table's method.
+    """
+    index = pd.Index(table.names)
+    si = index.get_indexer(pd.Series(start_station, dtype=object).astype(str))
+    ei = index.get_indexer(pd.Series(end_station, dtype=object).astype(str))
+    coords = [np.asarray(pd.to_numeric(pd.Series(c), errors="coerce"), dtype=float)
+              for c in (lat_start, lon_start, lat_end, lon_end)]
+    lat1, lon1, lat2, lon2 = coords
+
+    out = np.full(len(si), np.nan)
+    hit = (si >= 0) & (ei >= 0)
+    s, e = si[hit], ei[hit]
+    hit[hit] = (
+        _same_coord(lat1[hit], table.lat[s]) & _same_coord(lon1[hit], table.lon[s])
+        & _same_coord(lat2[hit], table.lat[e]) & _same_coord(lon2[hit], table.lon[e])
+    )
+    out[hit] = table.matrix[si[hit], ei[hit]]
+    miss = ~hit
+    if miss.any():
+        out[miss] = distances_km(lat1[miss], lon1[miss], lat2[miss], lon2[miss], method=table.method)
+    return out
@@ -1,4 +1,5 @@
 import sys
+import shutil
 import sqlite3
 from pathlib import Path
 
@@ -37,3 +38,71 @@ def test_load_folder(tmp_path):
         assert cur.fetchone()[0] >= 0
     finally:
         conn.close()
+
+
+def _load_samples(tmp_root: Path, monkeypatch, *extra_args):
+    (tmp_root / "data").mkdir(parents=True)
+    shutil.copy2(REPO_ROOT / "data" / "bike_stations_coords.csv", tmp_root / "data")
+    monkeypatch.setattr(bike_rides_cli, "repo_root", lambda: str(tmp_root))
+    bike_rides_cli.main(["load-folder", str(REPO_ROOT / "data" / "sample"), *extra_args])
+    conn = sqlite3.connect(tmp_root / "data" / "processed" / "bike_data.db")
+    try:
+        return conn.execute("SELECT * FROM bike_rides ORDER BY uid").fetchall()
+    finally:
+        conn.close()
+
+
+def test_load_folder_with_workers_matches_serial(tmp_path, monkeypatch):
+    serial = _load_samples(tmp_path / "serial", monkeypatch)
+    pooled = _load_samples(tmp_path / "pooled", monkeypatch, "--workers", "3", "--chunk-size", "2000")
+    assert len(serial) > 50000
+    assert pooled == serial
+
+
+def test_load_folder_skips_files_in_manifest(tmp_path, monkeypatch):
+    folder = tmp_path / "raw"
+    folder.mkdir()
+    for name in ["Historia_przejazdow_2024-6-5_22_18_5.csv", "Historia_przejazdow_2024-6-6_22_19_6.csv"]:
+        shutil.copy2(REPO_ROOT / "data" / "sample" / name, folder)
+    root = tmp_path / "root"
+    (root / "data").mkdir(parents=True)
+    shutil.copy2(REPO_ROOT / "data" / "bike_stations_coords.csv", root / "data")
+    monkeypatch.setattr(bike_rides_cli, "repo_root", lambda: str(root))
+
+    ingested = []
+    real_ingest = bike_rides_cli.ingest_csv
+
+    def spy_ingest(raw_path, *a, **kw):
+        ingested.append(Path(raw_path).name)
+        return real_ingest(raw_path, *a, **kw)
+
+    monkeypatch.setattr(bike_rides_cli, "ingest_csv", spy_ingest)
+
+    bike_rides_cli.main(["load-folder", str(folder)])
+    assert len(ingested) == 2
+    db_path = root / "data" / "processed" / "bike_data.db"
+    conn = sqlite3.connect(db_path)
+    try:
+        manifest = conn.execute(
+            "SELECT filename, rows_read, rows_inserted, length(sha256) FROM ingested_files ORDER BY filename"
+        ).fetchall()
+        total = conn.execute("SELECT COUNT(*) FROM bike_rides").fetchone()[0]
+    finally:
+        conn.close()
+    assert [m[0] for m in manifest] == sorted(ingested)
+    assert all(m[1] > 0 and m[3] == 64 for m in manifest)
+    assert sum(m[2] for m in manifest) == total
+
+    # Unchanged files are skipped entirely
+    ingested.clear()
+    bike_rides_cli.main(["load-folder", str(folder)])
+    assert ingested == []
+
+    # A modified file is reprocessed; --force reprocesses everything
+    with open(folder / "Historia_przejazdow_2024-6-6_22_19_6.csv", "a", encoding="utf-8") as f:
+        f.write("999999999,1,2024-06-06 10:00:00,2024-06-06 10:10:00,Rynek,Rynek,10\n")
+    bike_rides_cli.main(["load-folder", str(folder)])
+    assert ingested == ["Historia_przejazdow_2024-6-6_22_19_6.csv"]
+    ingested.clear()
+    bike_rides_cli.main(["load-folder", str(folder), "--force"])
+    assert len(ingested) == 2
@@ -24,7 +24,7 @@ def test_diff_snapshots_detects_events_snapA_to_snapB():
     assert SAMPLE_SNAP_A.exists() and SAMPLE_SNAP_B.exists()
     ts1, snap1 = mod.load_snapshot(SAMPLE_SNAP_A)
     ts2, snap2 = mod.load_snapshot(SAMPLE_SNAP_B)
-    events = mod.diff_snapshots(snap1, snap2, ts2)
+    events = mod.diff_cities(snap1, snap2, ts2)
 
     by_bike = {}
     for e in events:
@@ -39,12 +39,13 @@ def test_diff_snapshots_detects_events_snapA_to_snapB():
     arr = next(e for e in evs if e["event_type"] == "arrived")
     assert dep["station_name"] == "freestanding"
     assert arr["station_name"] == "Wrocław Leśnica, stacja kolejowa"
+    assert dep["city"] == arr["city"] == "Wrocław"
 
 
 def test_save_events_to_db(tmp_path):
     ts1, snap1 = mod.load_snapshot(SAMPLE_SNAP_A)
     ts2, snap2 = mod.load_snapshot(SAMPLE_SNAP_B)
-    events = mod.diff_snapshots(snap1, snap2, ts2)
+    events = mod.diff_cities(snap1, snap2, ts2)
 
     db_path = tmp_path / "test.db"
     mod.save_events_to_db(events, db_path)
@@ -52,12 +53,13 @@ def test_save_events_to_db(tmp_path):
     conn = sqlite3.connect(db_path)
     try:
         cur = conn.execute(
-            "SELECT event_type, station_name FROM bike_status_changes WHERE bike_id=?",
+            "SELECT event_type, city FROM bike_status_changes WHERE bike_id=?",
             ("590066",),
         )
         rows = cur.fetchall()
         types = {r[0] for r in rows}
         assert types == {"departed", "arrived"}
+        assert {r[1] for r in rows} == {"Wrocław"}
     finally:
         conn.close()
 
@@ -102,6 +104,7 @@ def test_freestanding_electric_has_generic_station_name(tmp_path):
             {
                 "cities": [
                     {
+                        "name": "Wrocław",
                         "places": [
                             {
                                 "uid": "568267505",
@@ -124,7 +127,7 @@ def test_freestanding_electric_has_generic_station_name(tmp_path):
 
     ts, bikes = mod.load_snapshot(f)
     assert ts == "2025-01-01T00:00:00"
-    info = bikes.get("590066")
+    info = bikes["Wrocław"].get("590066")
     assert info is not None
     assert info["station_name"] == "freestanding"
     assert info["station_id"] == "freestanding"
@@ -133,7 +136,240 @@ def test_freestanding_electric_has_generic_station_name(tmp_path):
 def test_snapA_freestanding_electric_station_name():
     assert SAMPLE_SNAP_A.exists()
     _, bikes = mod.load_snapshot(SAMPLE_SNAP_A)
-    info = bikes.get("590066")
+    info = bikes["Wrocław"].get("590066")
     assert info is not None, "Bike 590066 should be present in snapA"
     assert info["station_name"] == "freestanding"
     assert info["station_id"] == "freestanding"
+
+
+def test_get_latest_files_reads_index_tail(tmp_path, monkeypatch):
+    import snapshot_index
+
+    names = [f"bike_rides_{i}.json" for i in range(5)]
+    for i, name in enumerate(names):
+        (tmp_path / name).write_text(json.dumps({"_fetched_at": f"2025-01-01T00:00:0{i}"}), encoding="utf-8")
+        snapshot_index.append(tmp_path, f"2025-01-01T00:00:0{i}", tmp_path / name)
+    # The newest indexed snapshot was deleted -> skipped
+    (tmp_path / names[4]).unlink()
+
+    def no_reads(path):
+        raise AssertionError(f"snapshot {path} should not be read")
+
+    monkeypatch.setattr(snapshot_index, "read_fetched_at", no_reads)
+    assert mod.get_latest_files(tmp_path, 2) == [tmp_path / names[2], tmp_path / names[3]]
+
+
+def test_get_latest_files_fallback_reads_only_file_ends(tmp_path):
+    # Bodies are not valid JSON: a snapshot that had to be fully parsed would be skipped
+    body = '"data": [' + "x" * 2000 + "]"
+    # Older snapshots carry _fetched_at as their last key, newer ones as their first
+    (tmp_path / "bike_rides_first.json").write_text('{"_fetched_at": "2025-01-01T00:00:01", ' + body + "}", encoding="utf-8")
+    for name, ts in [("bike_rides_old.json", "2025-01-01T00:00:02"), ("bike_rides_new.json", "2025-01-01T00:00:03")]:
+        (tmp_path / name).write_text("{" + body + f',\n  "_fetched_at": "{ts}"\n}}', encoding="utf-8")
+    latest = mod.get_latest_files(tmp_path, 3)
+    assert [p.name for p in latest] == ["bike_rides_first.json", "bike_rides_old.json", "bike_rides_new.json"]
+
+
+def test_main_parses_only_new_snapshots(tmp_path, monkeypatch):
+    import snapshot_index
+
+    data_dir = tmp_path / "api"
+    data_dir.mkdir()
+    db_path = tmp_path / "status.db"
+    sources = {"A": SAMPLE_SNAP_A, "B": SAMPLE_SNAP_B}
+
+    def add(name, source, fetched_at):
+        payload = json.loads(sources[source].read_text(encoding="utf-8"))
+        payload["_fetched_at"] = fetched_at
+        path = data_dir / f"bike_rides_{name}.json"
+        path.write_text(json.dumps(payload), encoding="utf-8")
+        snapshot_index.append(data_dir, fetched_at, path)
+
+    parsed = []
+    real_load = mod.load_snapshot
+    monkeypatch.setattr(mod, "load_snapshot", lambda path, cities=None: (parsed.append(path.name), real_load(path))[1])
+
+    def pair_events(a, b):
+        (_, prev), (ts, curr) = real_load(SAMPLE_SNAP_A if a == "A" else SAMPLE_SNAP_B), real_load(
+            SAMPLE_SNAP_A if b == "A" else SAMPLE_SNAP_B
+        )
+        return len(mod.diff_cities(prev, curr, ts))
+
+    add("1", "A", "2025-10-26T02:50:00+02:00")
+    add("2", "B", "2025-10-26T02:55:00+02:00")
+    assert mod.main(data_dir=data_dir, db_path=db_path)["events"] == pair_events("A", "B")
+    assert parsed == ["bike_rides_1.json", "bike_rides_2.json"]
+
+    # Nothing new -> nothing parsed or recorded
+    parsed.clear()
+    assert mod.main(data_dir=data_dir, db_path=db_path) == {"files": [], "events": 0}
+    assert parsed == []
+
+    # Two snapshots since the last run (one after the DST change) -> both pairs, in fetch order
+    add("3", "A", "2025-10-26T02:00:00+01:00")
+    add("4", "B", "2025-10-26T02:05:00+01:00")
+    result = mod.main(data_dir=data_dir, db_path=db_path)
+    assert parsed == ["bike_rides_3.json", "bike_rides_4.json"]
+    assert [p.name for p in result["files"]] == ["bike_rides_2.json", "bike_rides_3.json", "bike_rides_4.json"]
+    assert result["events"] == pair_events("B", "A") + pair_events("A", "B")
+
+    conn = sqlite3.connect(db_path)
+    try:
+        total = conn.execute("SELECT COUNT(*) FROM bike_status_changes").fetchone()[0]
+        assert total == 2 * pair_events("A", "B") + pair_events("B", "A")
+        state = mod.load_state(conn)
+    finally:
+        conn.close()
+    assert state[:2] == ("bike_rides_4.json", "2025-10-26T02:05:00+01:00")
+    assert state[2] == real_load(SAMPLE_SNAP_B)[1]
+
+
+def test_replay_matches_incremental_runs(tmp_path):
+    import snapshot_index
+
+    data_dir = tmp_path / "api"
+    data_dir.mkdir()
+    payloads = [json.loads(p.read_text(encoding="utf-8")) for p in (SAMPLE_SNAP_A, SAMPLE_SNAP_B)]
+
+    def add(i):
+        payload = dict(payloads[i % 2], _fetched_at=f"2025-08-21T15:{i:02d}:00+02:00")
+        path = data_dir / f"bike_rides_{i}.json"
+        path.write_text(json.dumps(payload), encoding="utf-8")
+        snapshot_index.append(data_dir, payload["_fetched_at"], path)
+
+    def events(db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute(
+                "SELECT timestamp, bike_id, event_type, station_id, battery FROM bike_status_changes ORDER BY 1, 2, 3"
+            ).fetchall()
+        finally:
+            conn.close()
+
+    # One run per fetch
+    incremental = tmp_path / "incremental.db"
+    for i in range(5):
+        add(i)
+        if i:
+            mod.main(data_dir=data_dir, db_path=incremental)
+
+    # Whole-directory replay, parsed in a pool, in transactions of two snapshots
+    replayed = tmp_path / "replayed.db"
+    mod.save_events_to_db([{**mod.diff_snapshots({}, {"x": {k: None for k in mod.BIKE_FIELDS}}, "junk")[0]}], replayed)
+    result = mod.replay(data_dir, replayed, reset=True, workers=2, batch_size=2)
+    assert result["snapshots"] == 5
+    assert events(replayed) == events(incremental)
+    assert result["events"] == len(events(incremental)) > 0
+
+    # Catch-up replay continues from the stored state
+    add(5)
+    add(6)
+    assert mod.replay(data_dir, replayed)["snapshots"] == 2
+    mod.main(data_dir=data_dir, db_path=incremental)
+    assert events(replayed) == events(incremental)
+    assert mod.replay(data_dir, replayed) == {"snapshots": 0, "events": 0}
+
+
+def test_unreadable_snapshot_is_skipped(tmp_path):
+    import snapshot_index
+
+    data_dir = tmp_path / "api"
+    data_dir.mkdir()
+    db_path = tmp_path / "status.db"
+    payloads = {name: json.loads(p.read_text(encoding="utf-8")) for name, p in [("A", SAMPLE_SNAP_A), ("B", SAMPLE_SNAP_B)]}
+    # A place with bikes but without coordinates: parsing it raises
+    broken = json.loads(SAMPLE_SNAP_B.read_text(encoding="utf-8"))
+    place = next(p for d in broken["data"] for c in d["cities"] for p in c["places"] if p.get("bikes") or p.get("bikeNumbers"))
+    del place["geoCoords"]
+    payloads["bad"] = broken
+
+    def add(i, name):
+        payload = dict(payloads[name], _fetched_at=f"2025-08-21T15:{i:02d}:00+02:00")
+        path = data_dir / f"bike_rides_{i}.json"
+        path.write_text(json.dumps(payload), encoding="utf-8")
+        snapshot_index.append(data_dir, payload["_fetched_at"], path)
+
+    def pair_events(a, b):
+        return len(mod.diff_cities(mod.bikes_from_payload(payloads[a]), mod.bikes_from_payload(payloads[b]), ""))
+
+    add(1, "A")
+    add(2, "B")
+    mod.main(data_dir=data_dir, db_path=db_path)
+    # A malformed snapshot between two good ones: the next is diffed against the one before it
+    add(3, "bad")
+    add(4, "A")
+    result = mod.main(data_dir=data_dir, db_path=db_path)
+    assert [p.name for p in result["files"]] == ["bike_rides_2.json", "bike_rides_4.json"]
+    assert result["events"] == pair_events("B", "A")
+
+    # A malformed latest snapshot moves the state past it, so it is not read again
+    add(5, "bad")
+    assert mod.main(data_dir=data_dir, db_path=db_path)["events"] == 0
+    assert mod.main(data_dir=data_dir, db_path=db_path) == {"files": [], "events": 0}
+    add(6, "B")
+    assert mod.main(data_dir=data_dir, db_path=db_path)["events"] == pair_events("A", "B")
+
+    conn = sqlite3.connect(db_path)
+    try:
+        total = conn.execute("SELECT COUNT(*) FROM bike_status_changes").fetchone()[0]
+    finally:
+        conn.close()
+    assert total == 2 * pair_events("A", "B") + pair_events("B", "A")
+    # Replay skips them the same way
+    result = mod.replay(data_dir, tmp_path / "replayed.db", reset=True)
+    assert result == {"snapshots": 4, "events": total}
+
+
+def test_connect_migrates_single_city_db(tmp_path):
+    db_path = tmp_path / "status.db"
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(
+            """
+            CREATE TABLE bike_status_changes (
+                uid INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, bike_id TEXT, event_type TEXT,
+                station_name TEXT, station_id TEXT, lat REAL, lon REAL, bike_type TEXT, battery REAL
+            );
+            CREATE TABLE bike_state (
+                bike_id TEXT PRIMARY KEY, station_name TEXT, station_id TEXT,
+                lat REAL, lon REAL, bike_type TEXT, battery REAL
+            ) WITHOUT ROWID;
+            CREATE TABLE bike_state_snapshot (id INTEGER PRIMARY KEY CHECK (id = 1), file TEXT, fetched_at TEXT);
+            INSERT INTO bike_status_changes (timestamp, bike_id, event_type) VALUES ('t', '1', 'arrived');
+            INSERT INTO bike_state VALUES ('1', 'S', '10', 51.1, 17.0, 'standard', NULL);
+            INSERT INTO bike_state_snapshot VALUES (1, 'bike_rides_a.json', 't');
+            """
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    conn = mod.connect(db_path)
+    try:
+        assert conn.execute("SELECT bike_id, city FROM bike_status_changes").fetchall() == [("1", mod.LEGACY_CITY)]
+        assert mod.load_state(conn) == (
+            "bike_rides_a.json",
+            "t",
+            {
+                mod.LEGACY_CITY: {
+                    "1": {"station_name": "S", "station_id": "10", "lat": 51.1, "lon": 17.0, "bike_type": "standard", "battery": None}
+                }
+            },
+        )
+    finally:
+        conn.close()
+
+
+def test_tracker_keeps_cities_missing_from_a_snapshot(tmp_path):
+    _, snap_a = mod.load_snapshot(SAMPLE_SNAP_A)
+    _, snap_b = mod.load_snapshot(SAMPLE_SNAP_B)
+    with mod.StatusTracker(tmp_path, tmp_path / "status.db", cities=["Wrocław", "Siechnice (WRM)"]) as tracker:
+        assert tracker.process(tmp_path / "a", "t1", snap_a) == 0
+        assert set(tracker.state[2]) == {"Wrocław", "Siechnice (WRM)"}
+        # Wrocław's endpoint failed: no events, and its state is kept
+        assert tracker.process(tmp_path / "b", "t2", {"Siechnice (WRM)": snap_b["Siechnice (WRM)"]}) == len(
+            mod.diff_snapshots(snap_a["Siechnice (WRM)"], snap_b["Siechnice (WRM)"], "")
+        )
+        assert tracker.process(tmp_path / "c", "t3", snap_b) == len(mod.diff_snapshots(snap_a["Wrocław"], snap_b["Wrocław"], ""))
+    with mod.StatusTracker(tmp_path, tmp_path / "status.db") as tracker:
+        assert tracker.state[2] == {c: snap_b[c] for c in ("Wrocław", "Siechnice (WRM)")}
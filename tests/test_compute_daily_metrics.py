@@ -3,6 +3,8 @@ import sqlite3
 import sys
 from pathlib import Path
 
+import pytest
+
 
 # Allow importing from src/
 REPO_ROOT = Path(__file__).resolve().parents[1]
@@ -161,3 +163,520 @@ def test_year_mode_rebuild(tmp_path):
     assert data["year"] == 2025
     # Should contain at least the two dates we inserted
     assert set(data["days"].keys()) >= {"2025-04-07", "2025-04-06"}
+
+
+def _setup_bike_rides_db(tmp_path: Path) -> Path:
+    """Same rows as ``_setup_sample_db`` loaded through the ETL schema (ride_date, indexes)."""
+    import pandas as pd
+    import data_load_sqlite
+
+    rows_path = tmp_path / "rows.db"
+    _setup_sample_db(rows_path)
+    conn = sqlite3.connect(rows_path)
+    try:
+        df = pd.read_sql("SELECT * FROM sample_data", conn)
+    finally:
+        conn.close()
+    db_path = tmp_path / "bike.db"
+    with data_load_sqlite.BulkLoader(str(db_path)) as loader:
+        loader.load(df)
+    return db_path
+
+
+def test_day_rides_query_uses_day_index(tmp_path):
+    db_path = _setup_bike_rides_db(tmp_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        sql = mod.day_rides_query(conn, "bike_rides")
+        plan = [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, ("2025-04-07",))]
+    finally:
+        conn.close()
+    assert len(plan) == 1 and plan[0].startswith("SEARCH bike_rides USING COVERING INDEX bike_rides_day_rides_idx"), plan
+
+
+def test_metrics_from_rows_matches_sql_semantics():
+    rows = [
+        (8, 1.0, 5, "B", "A"),
+        (8, None, 5, "A", "B"),
+        (9, 2.0, 5, "A", "B"),
+        (None, 3.0, 5, "C", "Poza stacją"),
+        (9, 4.0, 5, None, "C"),
+        (10, 5.0, 5, "Poza stacją", "Poza stacją"),
+    ]
+    m = mod.metrics_from_rows("2025-04-07", rows)
+    assert m["total_rides"] == 6
+    assert m["bike_rentals_histogram"] == {"8": 2, "9": 2, "10": 1}
+    # NULL distance is skipped by both SUM and AVG
+    assert m["total_distance_km"] == 15.0 and m["avg_distance_km"] == 3.0
+    # 'Poza stacją' both ends counts as a round trip, like the SQL did
+    assert m["round_trips"] == 1
+    assert m["left_outside_station"] == 2
+    assert [s["station"] for s in m["busiest_stations_top5"]] == ["A", "B", "C"]
+    assert m["busiest_stations_top5"][2] == {"station": "C", "arrivals": 1, "departures": 1, "total": 2}
+    assert m["top_routes_top5"] == [
+        {"start_station": "A", "end_station": "B", "rides": 2},
+        {"start_station": "B", "end_station": "A", "rides": 1},
+    ]
+    empty = mod.metrics_from_rows("2025-04-08", [])
+    assert empty["total_rides"] == 0 and empty["avg_distance_km"] == 0.0 and empty["busiest_stations_top5"] == []
+
+
+def test_compute_metrics_same_with_materialized_ride_date(tmp_path):
+    bike_path = _setup_bike_rides_db(tmp_path)
+    a = sqlite3.connect(tmp_path / "rows.db")
+    b = sqlite3.connect(bike_path)
+    try:
+        for day in ["2025-04-06", "2025-04-07"]:
+            assert mod.compute_metrics(a, "sample_data", day) == mod.compute_metrics(b, "bike_rides", day)
+        assert mod.list_dates_for_year(a, "sample_data", 2025) == mod.list_dates_for_year(b, "bike_rides", 2025)
+    finally:
+        a.close()
+        b.close()
+
+
+def test_compute_range_metrics_matches_per_day(tmp_path):
+    bike_path = _setup_bike_rides_db(tmp_path)
+    # A day whose only ride is filtered out by duration still gets an (empty) entry
+    conn = sqlite3.connect(tmp_path / "rows.db")
+    conn.execute(
+        "INSERT INTO sample_data VALUES (7, '106', '2025-04-08 09:00:00', '2025-04-08 09:01:00', 'A', 'B', 1, 0.3)"
+    )
+    conn.commit()
+    conn.close()
+
+    for path, table in [(tmp_path / "rows.db", "sample_data"), (bike_path, "bike_rides")]:
+        conn = sqlite3.connect(path)
+        try:
+            got = mod.compute_range_metrics(conn, table, "2025-01-01", "2025-12-31")
+            dates = mod.list_dates_for_year(conn, table, 2025)
+            assert list(got) == dates
+            assert got == {d: mod.compute_metrics(conn, table, d) for d in dates}
+            assert list(mod.compute_range_metrics(conn, table, "2025-04-07", "2025-04-07")) == ["2025-04-07"]
+        finally:
+            conn.close()
+    assert got["2025-04-06"]["total_rides"] == 1
+
+
+def test_year_mode_writes_once(tmp_path, monkeypatch):
+    db_path = tmp_path / "sample.db"
+    out_path = tmp_path / "out" / "metrics_2025.json"
+    _setup_sample_db(db_path)
+    writes = []
+    real_write = mod.write_year_file
+    monkeypatch.setattr(mod, "write_year_file", lambda *a: (writes.append(a[0]), real_write(*a)))
+
+    mod.main(["--year", "2025", "--db", str(db_path), "--table", "sample_data", "--out", str(out_path)])
+
+    assert writes == [str(out_path)]
+    data = json.loads(out_path.read_text(encoding="utf-8"))
+    assert list(data["days"]) == ["2025-04-06", "2025-04-07"]
+    # Atomic replace leaves no temp files behind
+    assert sorted(p.name for p in out_path.parent.iterdir()) == [
+        "metrics_2025.fingerprints.json",
+        out_path.name,
+    ]
+
+
+def test_year_mode_from_aggregates_matches_raw(tmp_path):
+    db_path = _setup_bike_rides_db(tmp_path)
+    raw_out = tmp_path / "raw.json"
+    agg_out = tmp_path / "agg.json"
+
+    mod.main(["--year", "2025", "--db", str(db_path), "--out", str(raw_out)])
+    mod.main(["--year", "2025", "--db", str(db_path), "--out", str(agg_out), "--from-aggregates"])
+    assert agg_out.read_bytes() == raw_out.read_bytes()
+
+    mod.main(["--date", "2025-04-07", "--db", str(db_path), "--out", str(agg_out), "--from-aggregates"])
+    assert agg_out.read_bytes() == raw_out.read_bytes()
+
+
+def test_year_mode_with_workers_is_byte_identical(tmp_path, monkeypatch):
+    # The sample has only a few days: let them make up several chunks
+    monkeypatch.setattr(mod, "MIN_CHUNK_DAYS", 1)
+    bike_path = _setup_bike_rides_db(tmp_path)
+    conn = sqlite3.connect(tmp_path / "rows.db")
+    conn.execute(
+        "INSERT INTO sample_data VALUES (7, '106', '2025-05-01 09:00:00', '2025-05-01 09:30:00', 'A', 'B', 30, 3.3)"
+    )
+    conn.commit()
+    conn.close()
+
+    for db_path, table in [(tmp_path / "rows.db", "sample_data"), (bike_path, "bike_rides")]:
+        serial = tmp_path / f"{table}_serial.json"
+        parallel = tmp_path / f"{table}_parallel.json"
+        common = ["--year", "2025", "--db", str(db_path), "--table", table]
+        mod.main(common + ["--out", str(serial)])
+        mod.main(common + ["--out", str(parallel), "--workers", "2"])
+        assert parallel.read_bytes() == serial.read_bytes()
+
+
+def test_rebuild_range_computes_every_stale_run_on_one_pool(tmp_path, monkeypatch):
+    db_path = tmp_path / "sample.db"
+    _setup_sample_db(db_path)
+    conn = sqlite3.connect(db_path)
+    for i, day in enumerate(["2025-04-01", "2025-04-02", "2025-04-04", "2025-04-05", "2025-04-07"]):
+        conn.execute(
+            "INSERT INTO sample_data VALUES (?, '106', ?, ?, 'A', 'B', 10, 1.0)",
+            (100 + i, f"{day} 08:00:00", f"{day} 08:10:00"),
+        )
+    conn.commit()
+    out = tmp_path / "metrics.json"
+
+    def serial(start, end):
+        return mod.compute_range_metrics(conn, "sample_data", start, end)
+
+    mod.rebuild_range(conn, "sample_data", "2025-04-01", "2025-04-30", serial, out_path=str(out))
+    expected = out.read_bytes()
+    # Make every other day stale, so the stale days form several runs
+    stored = json.loads(open(mod.fingerprints_path(str(out))).read())
+    for day in list(stored)[::2]:
+        stored[day] = [0]
+    mod.write_fingerprints(mod.fingerprints_path(str(out)), stored)
+
+    pools = []
+
+    class CountingPool(mod.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(kwargs.get("max_workers"))
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(mod, "ProcessPoolExecutor", CountingPool)
+    monkeypatch.setattr(mod, "MIN_CHUNK_DAYS", 1)
+    mod.rebuild_range(
+        conn, "sample_data", "2025-04-01", "2025-04-30", serial,
+        out_path=str(out), db_path=str(db_path), workers=2,
+    )
+    assert pools == [2]
+    assert out.read_bytes() == expected
+
+    # Too few stale days for two chunks: no pool at all
+    monkeypatch.setattr(mod, "MIN_CHUNK_DAYS", 7)
+    mod.rebuild_range(
+        conn, "sample_data", "2025-04-01", "2025-04-30", serial,
+        out_path=str(out), db_path=str(db_path), workers=2, force=True,
+    )
+    assert pools == [2]
+    assert out.read_bytes() == expected
+    conn.close()
+
+
+def test_rebuild_follows_station_edits_and_deleted_days(tmp_path):
+    db_path = _setup_bike_rides_db(tmp_path)
+    out_path = tmp_path / "metrics_2025.json"
+    shards = tmp_path / "web"
+    args = ["--year", "2025", "--db", str(db_path), "--out", str(out_path), "--shards-dir", str(shards)]
+    mod.main(args)
+
+    def day(d):
+        return json.loads(out_path.read_text(encoding="utf-8"))["days"].get(d)
+
+    # Only a station changes: same count, rowids, durations and distances
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE bike_rides SET end_station = 'Z' WHERE ride_date = '2025-04-06'")
+    conn.commit()
+    mod.main(args)
+    assert {r["end_station"] for r in day("2025-04-06")["top_routes_top5"]} == {"Z"}
+
+    # All of a day's rows deleted: the day goes from the file, its fingerprint and the shards
+    conn.execute("DELETE FROM bike_rides WHERE ride_date = '2025-04-06'")
+    conn.commit()
+    conn.close()
+    mod.main(args)
+    data = json.loads(out_path.read_text(encoding="utf-8"))
+    assert list(data["days"]) == ["2025-04-07"]
+    assert list(json.loads(open(mod.fingerprints_path(str(out_path))).read())) == ["2025-04-07"]
+    assert "2025-03-31" not in data["weeks"]
+    manifest = json.loads((shards / "manifest.json").read_text(encoding="utf-8"))
+    assert manifest["months"]["2025-04"]["dates"] == [["2025-04-07", "2025-04-07"]]
+
+
+def test_connect_readonly_rejects_writes(tmp_path):
+    db_path = tmp_path / "sample.db"
+    _setup_sample_db(db_path)
+    conn = mod.connect_readonly(str(db_path))
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM sample_data").fetchone()[0] == 6
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            conn.execute("DELETE FROM sample_data")
+    finally:
+        conn.close()
+
+
+def test_year_mode_recomputes_only_changed_days(tmp_path, monkeypatch):
+    db_path = tmp_path / "sample.db"
+    out_path = tmp_path / "out" / "metrics_2025.json"
+    _setup_sample_db(db_path)
+    args = ["--year", "2025", "--db", str(db_path), "--table", "sample_data", "--out", str(out_path)]
+    mod.main(args)
+
+    calls = []
+    real_range = mod.compute_range_metrics
+
+    def spy(conn, table, start, end):
+        calls.append((start, end))
+        return real_range(conn, table, start, end)
+
+    monkeypatch.setattr(mod, "compute_range_metrics", spy)
+
+    # Nothing changed -> nothing recomputed
+    mod.main(args)
+    assert calls == []
+
+    # A new ride on 2025-04-06 -> only that day is recomputed
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "INSERT INTO sample_data VALUES (9, '109', '2025-04-06 12:00:00', '2025-04-06 12:30:00', 'D', 'C', 30, 4.0)"
+    )
+    conn.commit()
+    conn.close()
+    mod.main(args)
+    assert calls == [("2025-04-06", "2025-04-06")]
+    incremental = out_path.read_bytes()
+
+    calls.clear()
+    mod.main(args + ["--force"])
+    assert calls == [("2025-01-01", "2025-12-31")]
+    assert out_path.read_bytes() == incremental
+    assert json.loads(incremental)["days"]["2025-04-06"]["total_rides"] == 2
+
+
+def test_from_to_range_writes_per_year_files(tmp_path, monkeypatch):
+    db_path = _setup_bike_rides_db(tmp_path)
+    import pandas as pd
+    import data_load_sqlite
+
+    with data_load_sqlite.BulkLoader(str(db_path)) as loader:
+        loader.load(pd.DataFrame({
+            "uid": [20, 21],
+            "start_time": ["2024-12-31 23:00:00", "2026-01-02 08:00:00"],
+            "start_station": ["A", "B"],
+            "end_station": ["B", "A"],
+            "duration": [12, 14],
+            "distance": [1.0, 1.5],
+        }))
+    monkeypatch.setattr(mod, "repo_root", lambda: str(tmp_path))
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert mod.latest_date(conn, "bike_rides") == "2026-01-02"
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT MAX(ride_date) FROM bike_rides").fetchall()
+        assert "USING COVERING INDEX bike_rides_day_rides_idx" in plan[0][3]
+        expected = {
+            d: mod.compute_metrics(conn, "bike_rides", d)
+            for d in ["2024-12-31", "2025-04-06", "2025-04-07", "2026-01-02"]
+        }
+    finally:
+        conn.close()
+
+    # --to defaults to the latest date in the DB
+    mod.main(["--from", "2024-12-01", "--db", str(db_path)])
+
+    metrics_dir = tmp_path / "data" / "processed" / "metrics"
+    for year, dates in [(2024, ["2024-12-31"]), (2025, ["2025-04-06", "2025-04-07"]), (2026, ["2026-01-02"])]:
+        data = json.loads((metrics_dir / f"{year}.json").read_text(encoding="utf-8"))
+        assert data["year"] == year
+        assert data["days"] == {d: {k: v for k, v in expected[d].items() if k != "date"} for d in dates}
+        assert list(json.loads((metrics_dir / f"{year}.fingerprints.json").read_text(encoding="utf-8"))) == dates
+
+    with pytest.raises(SystemExit):
+        mod.main(["--from", "2024-12-01", "--to", "2025-01-31", "--db", str(db_path), "--out", str(tmp_path / "x.json")])
+
+
+def test_year_file_has_weekly_and_monthly_rollups(tmp_path):
+    db_path = _setup_bike_rides_db(tmp_path)
+    import pandas as pd
+    import data_load_sqlite
+
+    def load(uid, start_time):
+        with data_load_sqlite.BulkLoader(str(db_path)) as loader:
+            loader.load(pd.DataFrame({
+                "uid": [uid], "start_time": [start_time], "start_station": ["A"],
+                "end_station": ["B"], "duration": [12], "distance": [1.0],
+            }))
+
+    # 2024-12-31 and 2025-01-01 share a week that is split between the year files
+    load(20, "2024-12-31 23:00:00")
+    load(21, "2025-01-01 08:00:00")
+    out_path = tmp_path / "metrics_2025.json"
+    mod.main(["--year", "2025", "--db", str(db_path), "--out", str(out_path)])
+
+    data = json.loads(out_path.read_text(encoding="utf-8"))
+    assert list(data["weeks"]) == ["2024-12-30", "2025-03-31", "2025-04-07"]
+    assert list(data["months"]) == ["2025-01", "2025-04"]
+    assert data["weeks"]["2024-12-30"]["start"] == data["weeks"]["2024-12-30"]["end"] == "2025-01-01"
+
+    april = data["months"]["2025-04"]
+    days = [data["days"]["2025-04-06"], data["days"]["2025-04-07"]]
+    assert (april["start"], april["end"], april["days"]) == ("2025-04-06", "2025-04-07", 2)
+    for key in ["total_rides", "round_trips", "left_outside_station", "total_duration_min"]:
+        assert april[key] == sum(d[key] for d in days)
+    assert april["avg_distance_km"] == round((2.0 + 1.2 + 2.5 + 3.0 + 2.0) / 5, 3)
+    assert april["bike_rentals_histogram_avg"] == {"0": 0.5, "10": 0.5, "13": 1.0, "14": 0.5}
+    assert april["busiest_stations_top5"][0] == {"station": "A", "arrivals": 2, "departures": 2, "total": 4}
+    assert april["top_routes_top5"][0] == {"start_station": "A", "end_station": "B", "rides": 1}
+
+    # A single-day update refreshes that day's week and month only
+    load(22, "2025-04-08 09:00:00")
+    mod.main(["--date", "2025-04-08", "--db", str(db_path), "--out", str(out_path)])
+    updated = json.loads(out_path.read_text(encoding="utf-8"))
+    assert updated["weeks"]["2025-04-07"]["total_rides"] == data["weeks"]["2025-04-07"]["total_rides"] + 1
+    assert updated["months"]["2025-04"]["days"] == 3
+    assert updated["weeks"]["2025-03-31"] == data["weeks"]["2025-03-31"]
+
+
+def test_shards_dir_writes_month_shards_and_manifest(tmp_path, monkeypatch):
+    db_path = _setup_bike_rides_db(tmp_path)
+    import pandas as pd
+    import data_load_sqlite
+
+    with data_load_sqlite.BulkLoader(str(db_path)) as loader:
+        loader.load(pd.DataFrame({
+            "uid": [20], "start_time": ["2025-05-02 08:00:00"], "start_station": ["A"],
+            "end_station": ["B"], "duration": [12], "distance": [1.0],
+        }))
+    out_path = tmp_path / "metrics_2025.json"
+    shards = tmp_path / "web"
+    mod.main(["--year", "2025", "--db", str(db_path), "--out", str(out_path), "--shards-dir", str(shards)])
+
+    year = json.loads(out_path.read_text(encoding="utf-8"))
+    manifest = json.loads((shards / "manifest.json").read_text(encoding="utf-8"))
+    assert manifest == {
+        "months": {
+            "2025-04": {"file": "days-2025-04.json", "dates": [["2025-04-06", "2025-04-07"]]},
+            "2025-05": {"file": "days-2025-05.json", "dates": [["2025-05-02", "2025-05-02"]]},
+        },
+        "rollups": {"2025": "rollups-2025.json"},
+        "prefix": {"2025-04": "prefix-2025-04.json", "2025-05": "prefix-2025-05.json"},
+    }
+    april = json.loads((shards / "days-2025-04.json").read_text(encoding="utf-8"))
+    assert april == {"month": "2025-04", "days": {d: year["days"][d] for d in ["2025-04-06", "2025-04-07"]}}
+    rollups = json.loads((shards / "rollups-2025.json").read_text(encoding="utf-8"))
+    assert rollups == {"year": 2025, "weeks": year["weeks"], "months": year["months"]}
+
+    # A day update rewrites its month's shard only; other years stay in the manifest
+    mod.write_shards(str(shards), 2024, {"days": {"2024-12-31": {"total_rides": 1}}})
+    written = []
+    real_write = mod._write_json_atomic
+    monkeypatch.setattr(mod, "_write_json_atomic", lambda path, *a, **kw: (written.append(Path(path).name), real_write(path, *a, **kw)))
+    mod.main(["--date", "2025-05-02", "--db", str(db_path), "--out", str(out_path), "--shards-dir", str(shards)])
+    assert written == [
+        out_path.name,
+        "metrics_2025.prefix.json",
+        "days-2025-05.json",
+        "rollups-2025.json",
+        "prefix-2025-05.json",
+        "manifest.json",
+    ]
+    manifest = json.loads((shards / "manifest.json").read_text(encoding="utf-8"))
+    assert list(manifest["months"]) == ["2024-12", "2025-04", "2025-05"]
+    assert manifest["rollups"] == {"2025": "rollups-2025.json"}
+
+
+def test_shard_and_manifest_sizes_stay_small(tmp_path):
+    import gzip
+    import random
+    from datetime import date, timedelta
+
+    # Full-size day payloads (24-hour histogram, five long station names) for three years
+    rng = random.Random(0)
+    names = [f"Plac Grunwaldzki / Politechnika {i}" for i in range(60)]
+
+    def day_payload():
+        return {
+            "total_rides": 5123,
+            "bike_rentals_histogram": {str(h): rng.randint(0, 600) for h in range(24)},
+            "avg_distance_km": 1.873,
+            "avg_duration_min": 14.27,
+            "total_distance_km": 9594.379,
+            "total_duration_min": 73105,
+            "round_trips": 51,
+            "left_outside_station": 203,
+            "busiest_stations_top5": [
+                {"station": rng.choice(names), "arrivals": 130, "departures": 128, "total": 258} for _ in range(5)
+            ],
+            "top_routes_top5": [
+                {"start_station": rng.choice(names), "end_station": rng.choice(names), "rides": 21} for _ in range(5)
+            ],
+        }
+
+    shards = tmp_path / "web"
+    for year in (2023, 2024, 2025):
+        d, days = date(year, 1, 1), {}
+        while d.year == year:
+            days[d.isoformat()] = day_payload()
+            d += timedelta(days=1)
+        # Range index over 270 stations, most of them active on a given day
+        stations = [f"Station {i:03d} / {names[i % len(names)]}" for i in range(270)]
+        index = {"dates": list(days), "stations": stations, "totals": {}, "hours": [[0] * 24]}
+        index["arrivals"], index["departures"] = [[0] * len(stations)], [[0] * len(stations)]
+        for _ in days:
+            index["hours"].append([v + rng.randint(0, 600) for v in index["hours"][-1]])
+            for col in ("arrivals", "departures"):
+                index[col].append([v + (rng.randint(1, 40) if rng.random() < 0.8 else 0) for v in index[col][-1]])
+        mod.write_shards(str(shards), year, {"days": days, "months": {f"{year}-01": {"days": 31}}}, None, index)
+
+    # The manifest grows by a few lines per month, and month shards stay small
+    # however much history is published (sizes as served gzipped)
+    assert (shards / "manifest.json").stat().st_size < 4096
+    for shard in shards.glob("days-*.json"):
+        assert len(gzip.compress(shard.read_bytes())) < 8192, shard.name
+    # Each range index shard is a fraction of the year's index
+    year_index = len(json.dumps(index, separators=(",", ":")))
+    for shard in shards.glob("prefix-*.json"):
+        assert shard.stat().st_size < year_index / 6, shard.name
+
+
+def test_range_totals_from_prefix_index_match_rollups(tmp_path):
+    db_path = _setup_bike_rides_db(tmp_path)
+    out_path = tmp_path / "metrics_2025.json"
+    mod.main(["--year", "2025", "--db", str(db_path), "--out", str(out_path)])
+    index = mod.read_prefix_index(mod.prefix_path(str(out_path)))
+    assert index["dates"] == ["2025-04-06", "2025-04-07"]
+    assert index["totals"]["rides"] == [0, 1, 5]
+    assert index["stations"] == ["A", "B", "C", "D"]
+
+    april = dict(json.loads(out_path.read_text(encoding="utf-8"))["months"]["2025-04"])
+    april.pop("top_routes_top5")
+    assert mod.range_totals(index, "2025-04-01", "2025-04-30") == april
+
+    day = mod.range_totals(index, "2025-04-07", "2025-04-07")
+    conn = sqlite3.connect(db_path)
+    try:
+        expected = mod.compute_metrics(conn, "bike_rides", "2025-04-07")
+    finally:
+        conn.close()
+    assert (day["start"], day["end"], day["days"]) == ("2025-04-07", "2025-04-07", 1)
+    for key in ["total_rides", "avg_distance_km", "avg_duration_min", "busiest_stations_top5"]:
+        assert day[key] == expected[key]
+    assert mod.range_totals(index, "2025-05-01", "2025-05-31")["days"] == 0
+
+
+def test_prefix_month_shards_rebuild_the_running_totals():
+    index = {
+        "dates": ["2025-04-29", "2025-04-30", "2025-05-01"],
+        "stations": ["A", "B", "C"],
+        "totals": {"rides": [0, 1, 3, 4]},
+        "hours": [[0] * 24, [1] + [0] * 23, [1, 2] + [0] * 22, [1, 2, 1] + [0] * 21],
+        "arrivals": [[0, 0, 0], [1, 0, 0], [1, 2, 0], [1, 2, 1]],
+        "departures": [[0, 0, 0], [0, 1, 0], [1, 2, 0], [1, 2, 1]],
+    }
+    shards = mod.prefix_month_shards(index)
+    assert list(shards) == ["2025-04", "2025-05"]
+    may = shards["2025-05"]
+    # Sparse: only stations with counts, numbered per shard
+    assert may["stations"] == ["A", "B", "C"]
+    assert may["base"]["stations"] == [[0, 1, 1], [1, 2, 2]]
+    assert may["days"] == {"2025-05-01": {"hours": [0, 0, 1] + [0] * 21, "stations": [[2, 1, 1]]}}
+    assert shards["2025-04"]["base"] == {"hours": [0] * 24, "stations": []}
+
+    # base + the month's days up to a date == the index entry after it
+    for month, shard in shards.items():
+        arrivals = {shard["stations"][k]: a for k, a, _ in shard["base"]["stations"]}
+        hours = list(shard["base"]["hours"])
+        for d, entry in shard["days"].items():
+            hours = [h + v for h, v in zip(hours, entry["hours"])]
+            for k, a, _ in entry["stations"]:
+                arrivals[shard["stations"][k]] = arrivals.get(shard["stations"][k], 0) + a
+            i = index["dates"].index(d) + 1
+            assert hours == index["hours"][i]
+            assert [arrivals.get(name, 0) for name in index["stations"]] == index["arrivals"][i]
@@ -0,0 +1,96 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+SRC_DIR = REPO_ROOT / "src"
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+import compute_daily_metrics  # noqa: E402
+import daily_aggregates as mod  # noqa: E402
+import data_load_sqlite  # noqa: E402
+
+
+def _rides(rows):
+    return pd.DataFrame(
+        rows,
+        columns=["uid", "start_time", "start_station", "end_station", "duration", "distance"],
+    )
+
+
+DAY1 = [
+    (1, "2025-04-07 00:10:00", "A", "A", 10, 1.2),
+    (2, "2025-04-07 13:00:00", "A", "B", 20, 2.5),
+    (3, "2025-04-07 13:15:00", "B", "A", 30, None),
+    (4, "2025-04-07 14:05:00", "B", "Poza stacją", 17, 2.0),
+    (5, "2025-04-07 14:30:00", "C", "D", 2, 0.5),
+]
+DAY2 = [
+    (6, "2025-04-08 10:00:00", "C", "D", 25, 2.0),
+    (7, "2025-04-08 11:00:00", "C", "D", 1, 0.2),
+]
+
+
+def _assert_matches_raw(conn):
+    dates = compute_daily_metrics.list_dates_between(conn, "bike_rides", "2025-01-01", "2025-12-31")
+    expected = {d: compute_daily_metrics.compute_metrics(conn, "bike_rides", d) for d in dates}
+    assert compute_daily_metrics.compute_range_metrics_from_aggregates(conn, "2025-01-01", "2025-12-31") == expected
+
+
+def test_bulk_loader_refreshes_only_touched_days(tmp_path):
+    db_path = str(tmp_path / "bike.db")
+    with data_load_sqlite.BulkLoader(db_path) as loader:
+        loader.load(_rides(DAY1))
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("SELECT ride_date, rides, round_trips, left_outside_station FROM daily_totals").fetchall() == [
+            ("2025-04-07", 4, 1, 1)
+        ]
+        _assert_matches_raw(conn)
+        # Mark day 1 so a refresh of it would be visible
+        conn.execute("UPDATE daily_totals SET rides = -1")
+        conn.commit()
+    finally:
+        conn.close()
+
+    # Second run only touches 2025-04-08 (plus an already-loaded row)
+    with data_load_sqlite.BulkLoader(db_path) as loader:
+        loader.load(_rides(DAY2))
+
+    conn = sqlite3.connect(db_path)
+    try:
+        totals = dict(conn.execute("SELECT ride_date, rides FROM daily_totals"))
+        assert totals == {"2025-04-07": -1, "2025-04-08": 1}
+        mod.refresh_days(conn, ["2025-04-07"])
+        _assert_matches_raw(conn)
+    finally:
+        conn.close()
+
+
+def test_create_tables_backfills_existing_rides(tmp_path):
+    db_path = str(tmp_path / "bike.db")
+    with data_load_sqlite.BulkLoader(db_path) as loader:
+        loader.load(_rides(DAY1 + DAY2))
+    conn = sqlite3.connect(db_path)
+    try:
+        for table in mod.AGGREGATE_TABLES:
+            conn.execute(f"DROP TABLE {table}")
+        conn.commit()
+    finally:
+        conn.close()
+
+    data_load_sqlite.create_database(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert [r[0] for r in conn.execute("SELECT ride_date FROM daily_totals ORDER BY ride_date")] == [
+            "2025-04-07",
+            "2025-04-08",
+        ]
+        _assert_matches_raw(conn)
+    finally:
+        conn.close()
@@ -1,6 +1,8 @@
 import os
 import sys
 import shutil
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from types import SimpleNamespace
 
@@ -168,18 +170,18 @@ def test_main_uses_spec_paths_and_writes_outputs(monkeypatch, tmp_path):
         return real_to_csv(self, path, *a, **kw)
 
     # keep original to call through
-    orig_load_to_sqlite = mod.load_to_sqlite
+    orig_enter = mod.BulkLoader.__enter__
 
-    def spy_load_to_sqlite(df, db_path):
-        used.db_path = db_path
+    def spy_enter(self):
+        used.db_path = self.db_path
         # actually create the DB and load (to validate it works)
-        return orig_load_to_sqlite(df, db_path)
+        return orig_enter(self)
 
     # Monkeypatch
     monkeypatch.setattr(mod, "get_all_csv_urls", fake_get_all_csv_urls)
     monkeypatch.setattr(mod, "download_file", fake_download_file)
     monkeypatch.setattr(pd.DataFrame, "to_csv", spy_to_csv)
-    monkeypatch.setattr(mod, "load_to_sqlite", spy_load_to_sqlite)
+    monkeypatch.setattr(mod.BulkLoader, "__enter__", spy_enter)
 
     # Run
     mod.main()
@@ -197,3 +199,185 @@ def test_main_uses_spec_paths_and_writes_outputs(monkeypatch, tmp_path):
         assert count >= 0
     finally:
         conn.close()
+
+
+def test_ingest_csv_chunked_matches_whole_file(tmp_path, monkeypatch):
+    raw = REPO_ROOT / "data" / "sample" / "Historia_przejazdow_2024-6-5_22_18_5.csv"
+    stations = REPO_ROOT / "data" / "bike_stations_coords.csv"
+    sessions = []
+    real_enter = mod.BulkLoader.__enter__
+    monkeypatch.setattr(mod.BulkLoader, "__enter__", lambda self: sessions.append(self) or real_enter(self))
+
+    results = {}
+    for label, chunk_size in [("whole", None), ("chunked", 1000)]:
+        cleaned_path = tmp_path / f"{label}_clean.csv"
+        db_path = tmp_path / f"{label}.db"
+        rows = mod.ingest_csv(str(raw), str(stations), str(cleaned_path), str(db_path), chunk_size=chunk_size)
+        conn = sqlite3.connect(db_path)
+        try:
+            db_rows = conn.execute("SELECT * FROM bike_rides ORDER BY uid").fetchall()
+        finally:
+            conn.close()
+        results[label] = (rows, cleaned_path.read_text(encoding="utf-8"), db_rows)
+
+    assert results["whole"][0] == results["chunked"][0] > 1000
+    assert results["whole"][1] == results["chunked"][1]
+    assert results["whole"][2] == results["chunked"][2]
+    # One bulk session (and transaction) per file, however many chunks
+    assert len(sessions) == 2
+
+
+def test_ingest_csv_skips_already_loaded_rides_before_transform(tmp_path, monkeypatch):
+    stations = REPO_ROOT / "data" / "bike_stations_coords.csv"
+    db_path = tmp_path / "bike.db"
+    raw = tmp_path / "raw.csv"
+    base = {
+        "Numer roweru": ["100", "101", "102"],
+        "Data wynajmu": ["2025-04-07 13:52:45"] * 3,
+        "Data zwrotu": ["2025-04-07 14:00:00"] * 3,
+        "Stacja wynajmu": ["Rynek"] * 3,
+        "Stacja zwrotu": ["Rynek"] * 3,
+        "Czas trwania": [10, 11, 12],
+    }
+    pd.DataFrame({"UID wynajmu": [1, 2, 3], **base}).to_csv(raw, index=False)
+    assert mod.ingest_csv(str(raw), str(stations), str(tmp_path / "a.csv"), str(db_path)) == 3
+
+    # Next file overlaps on uids 2 and 3; only uid 4 should be transformed
+    pd.DataFrame({"UID wynajmu": [2, 3, 4], **base}).to_csv(raw, index=False)
+    seen = []
+    real_transform = mod.transform_data
+
+    def spy_transform(df, *a, **kw):
+        seen.append(len(df))
+        return real_transform(df, *a, **kw)
+
+    monkeypatch.setattr(mod, "transform_data", spy_transform)
+    assert mod.ingest_csv(str(raw), str(stations), str(tmp_path / "b.csv"), str(db_path)) == 1
+    assert seen == [1]
+
+    conn = sqlite3.connect(db_path)
+    try:
+        uids = [r[0] for r in conn.execute("SELECT uid FROM bike_rides ORDER BY uid")]
+    finally:
+        conn.close()
+    assert uids == [1, 2, 3, 4]
+
+
+def test_bulk_loader_deferred_index_dedupes_and_builds_index(tmp_path):
+    db_path = tmp_path / "bike.db"
+    frames = [
+        pd.DataFrame({"uid": [1, 2], "bike_number": ["a", "b"], "start_time": pd.to_datetime(["2025-04-07 10:00:00"] * 2), "duration": [5, 6]}),
+        pd.DataFrame({"uid": [2, 3], "bike_number": ["x", "c"], "start_time": pd.to_datetime(["2025-04-07 11:00:00"] * 2), "duration": [7, 8]}),
+    ]
+    with mod.BulkLoader(str(db_path), defer_index=True) as loader:
+        for df in frames:
+            loader.load(df)
+    assert loader.rows_inserted == 3
+    assert "rows/s" in loader.summary()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT uid, bike_number, start_time FROM bike_rides ORDER BY uid").fetchall()
+        indexes = {r[1] for r in conn.execute("PRAGMA index_list('bike_rides')")}
+    finally:
+        conn.close()
+    # First loaded row wins, as with INSERT OR IGNORE
+    assert rows == [(1, "a", "2025-04-07 10:00:00"), (2, "b", "2025-04-07 10:00:00"), (3, "c", "2025-04-07 11:00:00")]
+    assert "bike_rides_uid_idx" in indexes
+
+    # Later loads keep the index and ignore known uids
+    with mod.BulkLoader(str(db_path), defer_index=True) as loader:
+        assert not loader.defer_index
+        assert loader.load(frames[1]) == 0
+
+
+SAMPLE_DIR = REPO_ROOT / "data" / "sample"
+
+
+def _serve_samples(support_range=True):
+    """Local stand-in for the open-data portal serving data/sample files."""
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = SAMPLE_DIR / self.path.lstrip("/")
+            if not path.is_file():
+                self.send_error(404)
+                return
+            body = path.read_bytes()
+            rng = self.headers.get("Range")
+            requests_seen.append((self.path, rng))
+            if rng and support_range:
+                start = int(rng.split("=")[1].rstrip("-"))
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+                body = body[start:]
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}", requests_seen
+
+
+def test_download_files_parallel(tmp_path):
+    names = sorted(p.name for p in SAMPLE_DIR.glob("Historia_przejazdow_*.csv"))
+    server, base, _ = _serve_samples()
+    try:
+        jobs = [(f"{base}/{n}", str(tmp_path)) for n in names]
+        paths = mod.download_files(jobs, mod.make_session(), workers=4)
+    finally:
+        server.shutdown()
+    assert [os.path.basename(p) for p in paths] == names
+    for p in paths:
+        assert Path(p).read_bytes() == (SAMPLE_DIR / os.path.basename(p)).read_bytes()
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_download_file_resumes_partial_transfer(tmp_path):
+    name = "Historia_przejazdow_2024-6-5_22_18_5.csv"
+    original = (SAMPLE_DIR / name).read_bytes()
+    for support_range in (True, False):
+        out_dir = tmp_path / str(support_range)
+        out_dir.mkdir()
+        # Simulate a crash mid-download: only the .part file exists
+        (out_dir / (name + ".part")).write_bytes(original[:1000])
+        server, base, seen = _serve_samples(support_range)
+        try:
+            path = mod.download_file(f"{base}/{name}", str(out_dir), mod.make_session())
+        finally:
+            server.shutdown()
+        assert seen == [(f"/{name}", "bytes=1000-")]
+        assert Path(path).read_bytes() == original
+        assert not (out_dir / (name + ".part")).exists()
+
+
+def test_create_database_migrates_old_schema(tmp_path):
+    db_path = tmp_path / "old.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE bike_rides (uid INTEGER, bike_number TEXT, start_time TIMESTAMP, end_time TIMESTAMP, "
+        "start_station TEXT, end_station TEXT, duration INTEGER, lat_start REAL, lon_start REAL, "
+        "lat_end REAL, lon_end REAL, distance REAL)"
+    )
+    conn.execute("INSERT INTO bike_rides (uid, start_time, duration) VALUES (1, '2025-04-07 13:52:45', 10)")
+    conn.execute("CREATE INDEX bike_rides_day_idx ON bike_rides(start_time)")
+    conn.commit()
+    conn.close()
+
+    mod.create_database(str(db_path))
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("SELECT ride_date, start_hour FROM bike_rides").fetchall() == [("2025-04-07", 13)]
+        indexes = {r[1] for r in conn.execute("PRAGMA index_list('bike_rides')")}
+    finally:
+        conn.close()
+    assert set(mod.RIDE_INDEXES) <= indexes
+    assert not indexes & set(mod.OBSOLETE_RIDE_INDEXES)
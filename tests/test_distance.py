@@ -0,0 +1,50 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from geopy.distance import geodesic
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+SRC_DIR = REPO_ROOT / "src"
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+import distance as mod  # noqa: E402
+
+
+def test_vincenty_agrees_with_geopy_within_a_metre():
+    rng = np.random.default_rng(42)
+    n = 500
+    # Mostly Wrocław-scale rides plus a handful of long-haul pairs
+    lat1 = np.concatenate([rng.uniform(51.0, 51.2, n), rng.uniform(-80, 80, 20)])
+    lon1 = np.concatenate([rng.uniform(16.8, 17.2, n), rng.uniform(-170, 170, 20)])
+    lat2 = np.concatenate([rng.uniform(51.0, 51.2, n), rng.uniform(-80, 80, 20)])
+    lon2 = np.concatenate([rng.uniform(16.8, 17.2, n), rng.uniform(-170, 170, 20)])
+
+    got = mod.distances_km(lat1, lon1, lat2, lon2)
+    expected = np.array([geodesic((a, b), (c, d)).km for a, b, c, d in zip(lat1, lon1, lat2, lon2)])
+    assert np.max(np.abs(got - expected)) < 0.001
+
+
+def test_nan_and_invalid_inputs_yield_nan():
+    got = mod.distances_km(
+        [51.1, np.nan, None, 51.1, 95.0, 51.1],
+        [17.0, 17.0, 17.0, "x", 17.0, 17.0],
+        [51.2, 51.2, 51.2, 51.2, 51.2, 51.1],
+        [17.1, 17.1, 17.1, 17.1, 17.1, 17.0],
+    )
+    assert not np.isnan(got[0])
+    assert np.isnan(got[1:5]).all()
+    # Identical points are zero, not NaN
+    assert got[5] == 0.0
+
+
+def test_haversine_method_is_selectable():
+    args = ([51.109782], [17.030175], [51.113871], [17.034484])
+    vincenty = mod.distances_km(*args)[0]
+    haversine = mod.distances_km(*args, method="haversine")[0]
+    assert haversine != vincenty
+    assert abs(haversine - vincenty) / vincenty < 0.005
+    with pytest.raises(ValueError):
+        mod.distances_km(*args, method="manhattan")
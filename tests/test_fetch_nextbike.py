@@ -0,0 +1,134 @@
+import gzip
+import json
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+SRC_DIR = REPO_ROOT / "src"
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+import bike_status_changes  # noqa: E402
+import fetch_nextbike as mod  # noqa: E402
+import snapshot_format  # noqa: E402
+import snapshot_index  # noqa: E402
+
+SAMPLE_SNAP_A = REPO_ROOT / "data" / "sample" / "snapA.json"
+
+
+def test_main_indexes_snapshots(tmp_path, monkeypatch):
+    # A snapshot saved before the index existed
+    old = tmp_path / "bike_rides_2025-01-01_00_00_00.json"
+    old.write_text(json.dumps({"data": [], "_fetched_at": "2025-01-01T00:00:00+01:00"}), encoding="utf-8")
+    monkeypatch.setattr(mod, "DATA_DIR", tmp_path)
+    responses = iter([{"data": [], "_fetched_at": "stale"}, {"data": [{}]}])
+    monkeypatch.setattr(mod, "fetch_json", lambda url: next(responses))
+    stamps = iter(["2025-01-01T00:01:00+01:00", "2025-01-01T00:02:00+01:00"])
+    monkeypatch.setattr(mod, "now_local_iso", lambda: next(stamps))
+    names = iter(["2025-01-01_00_01_00", "2025-01-01_00_02_00"])
+    monkeypatch.setattr(mod, "now_local_for_filename", lambda: next(names))
+
+    first = mod.main()
+    second = mod.main()
+
+    lines = snapshot_index.index_path(tmp_path).read_text(encoding="utf-8").splitlines()
+    assert [{k: v for k, v in json.loads(line).items() if k != "hash"} for line in lines] == [
+        {"fetched_at": "2025-01-01T00:00:00+01:00", "file": old.name},
+        {"fetched_at": "2025-01-01T00:01:00+01:00", "file": first.name},
+        {"fetched_at": "2025-01-01T00:02:00+01:00", "file": second.name},
+    ]
+    # _fetched_at is the first key, so it can be read from the file header
+    with gzip.open(second, "rt", encoding="utf-8") as f:
+        assert f.read(64).startswith('{"_fetched_at":"2025-01-01T00:02:00+01:00"')
+    assert bike_status_changes.get_latest_files(tmp_path, 2) == [first, second]
+
+
+def test_snapshot_formats_load_the_same_bikes(tmp_path, monkeypatch):
+    payload = json.loads(SAMPLE_SNAP_A.read_text(encoding="utf-8"))
+    payload.pop("_fetched_at", None)
+    monkeypatch.setattr(mod, "fetch_json", lambda url: payload)
+    monkeypatch.setattr(mod, "now_local_iso", lambda: "2025-01-01T00:00:00+01:00")
+    monkeypatch.setattr(mod, "now_local_for_filename", lambda: "2025-01-01_00_00_00")
+
+    paths = {}
+    for fmt in snapshot_format.FORMATS:
+        # Separate directories, or the repeated response would be deduplicated
+        monkeypatch.setattr(mod, "DATA_DIR", tmp_path / fmt)
+        paths[fmt] = mod.main(fmt)
+
+    assert paths["json"].suffix == ".json" and paths["compact"].name.endswith(".json.gz")
+    expected = bike_status_changes.load_snapshot(paths["json"])
+    assert expected[1]
+    for fmt, path in paths.items():
+        assert bike_status_changes.load_snapshot(path) == expected, fmt
+        assert snapshot_format.read_payload(path) == {"_fetched_at": "2025-01-01T00:00:00+01:00", **payload}
+        assert snapshot_index.read_fetched_at(path) == "2025-01-01T00:00:00+01:00"
+    assert paths["compact"].stat().st_size * 10 < paths["json"].stat().st_size
+    for fmt, path in paths.items():
+        assert [p for _, p in snapshot_index.scan(tmp_path / fmt)] == [path]
+
+
+def test_unchanged_response_records_marker_only(tmp_path, monkeypatch):
+    payload = json.loads(SAMPLE_SNAP_A.read_text(encoding="utf-8"))
+    changed = json.loads(json.dumps(payload))
+    places = changed["data"][0]["cities"][0]["places"]
+    places[0]["bikes"], places[1]["bikes"] = places[1]["bikes"], places[0]["bikes"]
+    # Overnight: the same response three times (only _fetched_at differs), then a change
+    responses = iter([payload, {**payload, "_fetched_at": "x"}, payload, changed])
+    monkeypatch.setattr(mod, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(mod, "fetch_json", lambda url: next(responses))
+    stamps = iter([f"2025-01-01T00:0{i}:00+01:00" for i in range(4)])
+    monkeypatch.setattr(mod, "now_local_iso", lambda: next(stamps))
+    names = iter([f"2025-01-01_00_0{i}_00" for i in range(4)])
+    monkeypatch.setattr(mod, "now_local_for_filename", lambda: next(names))
+    db_path = tmp_path / "status.db"
+
+    first = mod.main()
+    assert mod.main() == first and mod.main() == first
+    assert sorted(p.name for p in tmp_path.glob("bike_rides_*")) == [first.name]
+    lines = [json.loads(line) for line in snapshot_index.index_path(tmp_path).read_text(encoding="utf-8").splitlines()]
+    assert [line.get("same_as") for line in lines] == [None, first.name, first.name]
+    assert len({line["hash"] for line in lines}) == 1
+
+    parsed = []
+    load = bike_status_changes.load_snapshot
+    monkeypatch.setattr(bike_status_changes, "load_snapshot", lambda p, cities=None: parsed.append(p.name) or load(p))
+    # Nothing to compare yet: markers are not snapshots
+    assert bike_status_changes.main(tmp_path, db_path) == {"files": [], "events": 0}
+
+    second = mod.main()
+    assert second != first
+    assert bike_status_changes.main(tmp_path, db_path)["events"] > 0
+    assert parsed == [first.name, second.name]
+    # Unchanged again: no snapshot to parse
+    monkeypatch.setattr(mod, "fetch_json", lambda url: changed)
+    monkeypatch.setattr(mod, "now_local_iso", lambda: "2025-01-01T00:05:00+01:00")
+    assert mod.main() == second
+    assert bike_status_changes.main(tmp_path, db_path) == {"files": [], "events": 0}
+    assert parsed == [first.name, second.name]
+
+
+def test_unparsed_response_is_kept_but_skipped_by_readers(tmp_path, monkeypatch):
+    good = json.loads(SAMPLE_SNAP_A.read_text(encoding="utf-8"))
+    broken = json.loads(json.dumps(good))
+    place = next(p for p in broken["data"][0]["cities"][0]["places"] if p.get("bikes") or p.get("bikeNumbers"))
+    del place["geoCoords"]
+    responses = iter([good, broken])
+    monkeypatch.setattr(mod, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(mod, "fetch_json", lambda url: next(responses))
+    stamps = iter([f"2025-01-01T00:0{i}:00+01:00" for i in range(2)])
+    monkeypatch.setattr(mod, "now_local_iso", lambda: next(stamps))
+    names = iter([f"2025-01-01_00_0{i}_00" for i in range(2)])
+    monkeypatch.setattr(mod, "now_local_for_filename", lambda: next(names))
+
+    first = mod.fetch_snapshot()
+    second = mod.fetch_snapshot()
+    # Kept as plain gzip, with the parser's failure recorded in the index
+    assert second.bikes is None and second.path.exists()
+    assert snapshot_format.read_payload(second.path)["data"] == broken["data"]
+    lines = [json.loads(line) for line in snapshot_index.index_path(tmp_path).read_text(encoding="utf-8").splitlines()]
+    assert [line.get("unparsed") for line in lines] == [None, True]
+
+    assert snapshot_index.latest(tmp_path, 1) == [first.path]
+    assert snapshot_index.since(tmp_path, "2025-01-01T00:00:00+01:00", first.path.name) == []
+    assert [p for _, p in snapshot_index.ordered(tmp_path)] == [first.path]
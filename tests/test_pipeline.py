@@ -0,0 +1,167 @@
+import json
+import sqlite3
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+SRC_DIR = REPO_ROOT / "src"
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+import bike_status_changes  # noqa: E402
+import fetch_nextbike  # noqa: E402
+import pipeline as mod  # noqa: E402
+
+SAMPLE_SNAP_A = REPO_ROOT / "data" / "sample" / "snapA.json"
+SAMPLE_SNAP_B = REPO_ROOT / "data" / "sample" / "snapB.json"
+
+
+def _serve(bodies, delay=0.0):
+    """Local keep-alive API serving ``bodies`` in turn; counts TCP connections.
+
+    ``bodies`` is an iterator, or a mapping of URL path to iterator.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        connections = 0
+
+        def setup(self):
+            type(self).connections += 1
+            super().setup()
+
+        def do_GET(self):
+            time.sleep(delay)
+            body = next(bodies[self.path] if isinstance(bodies, dict) else bodies)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, Handler
+
+
+def test_daemon_polls_over_one_connection(tmp_path, monkeypatch):
+    a, b = (p.read_bytes() for p in (SAMPLE_SNAP_A, SAMPLE_SNAP_B))
+    server, handler = _serve(iter([a, b, b, a]))
+    monkeypatch.setattr(fetch_nextbike, "URLS", [f"http://127.0.0.1:{server.server_address[1]}/locations"])
+    monkeypatch.setattr(fetch_nextbike, "DATA_DIR", tmp_path / "api")
+    names = iter(f"2025-01-01_00_00_0{i}" for i in range(4))
+    monkeypatch.setattr(fetch_nextbike, "now_local_for_filename", lambda: next(names))
+    db_path = tmp_path / "status.db"
+    parsed = []
+    monkeypatch.setattr(bike_status_changes, "load_snapshot", lambda p, cities=None: parsed.append(p))
+
+    try:
+        cycles = mod.run_daemon(interval=0.01, max_cycles=4, db_path=db_path)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert cycles == 4
+    assert handler.connections == 1
+    # State comes from the fetched response: no snapshot is read back from disk
+    assert parsed == []
+    snap_a, snap_b = (bike_status_changes.bikes_from_payload(json.loads(body)) for body in (a, b))
+    expected = len(bike_status_changes.diff_cities(snap_a, snap_b, "")) + len(
+        bike_status_changes.diff_cities(snap_b, snap_a, "")
+    )
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM bike_status_changes").fetchone()[0] == expected > 0
+        state = bike_status_changes.load_state(conn)
+    finally:
+        conn.close()
+    assert state[0] == "bike_rides_2025-01-01_00_00_02.json.gz"
+    assert state[2] == snap_a
+
+
+def test_daemon_stops_when_signalled(tmp_path, monkeypatch):
+    monkeypatch.setattr(fetch_nextbike, "DATA_DIR", tmp_path / "api")
+    monkeypatch.setattr(fetch_nextbike, "fetch_snapshot", lambda fmt, sessions, urls: None)
+    stop = threading.Event()
+    stop.set()
+    assert mod.run_daemon(interval=3600, stop=stop, db_path=tmp_path / "status.db") == 0
+    # A stop during the wait ends the daemon after the current cycle
+    stop.clear()
+    timer = threading.Timer(0.2, stop.set)
+    timer.start()
+    assert mod.run_daemon(interval=3600, stop=stop, db_path=tmp_path / "status.db") == 1
+
+
+def test_daemon_retries_a_failed_startup_catch_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(fetch_nextbike, "DATA_DIR", tmp_path / "api")
+    monkeypatch.setattr(fetch_nextbike, "fetch_snapshot", lambda fmt, sessions, urls: None)
+    calls = []
+    real_catch_up = bike_status_changes.StatusTracker.catch_up
+
+    def flaky_catch_up(self):
+        calls.append(len(calls))
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return real_catch_up(self)
+
+    monkeypatch.setattr(bike_status_changes.StatusTracker, "catch_up", flaky_catch_up)
+    assert mod.run_daemon(interval=0.01, max_cycles=3, db_path=tmp_path / "status.db") == 3
+    # Failed on the first cycle, succeeded on the second, then stayed in sync
+    assert calls == [0, 1]
+
+
+def _other_system(body):
+    """The sample response as another Nextbike system, with its own city names."""
+    payload = json.loads(body)
+    for domain in payload["data"]:
+        domain["domain"] = "xx"
+        for city in domain["cities"]:
+            city["name"] = f"Other {city['name']}"
+    return json.dumps(payload).encode("utf-8")
+
+
+def test_daemon_tracks_cities_across_endpoints(tmp_path, monkeypatch):
+    a, b = (p.read_bytes() for p in (SAMPLE_SNAP_A, SAMPLE_SNAP_B))
+    bodies = {"/pl": iter([a, b]), "/xx": iter([_other_system(a), _other_system(b)])}
+    server, handler = _serve(bodies, delay=0.3)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setattr(fetch_nextbike, "DATA_DIR", tmp_path / "api")
+    names = iter(f"2025-01-01_00_00_0{i}" for i in range(2))
+    monkeypatch.setattr(fetch_nextbike, "now_local_for_filename", lambda: next(names))
+    db_path = tmp_path / "status.db"
+    fetched = []
+    fetch = fetch_nextbike.fetch_snapshot
+
+    def timed_fetch(*args):
+        started = time.monotonic()
+        snapshot = fetch(*args)
+        fetched.append(time.monotonic() - started)
+        return snapshot
+
+    monkeypatch.setattr(fetch_nextbike, "fetch_snapshot", timed_fetch)
+    cities = ["Wrocław", "Other Wrocław"]
+    try:
+        mod.run_daemon(interval=0.01, max_cycles=2, db_path=db_path, urls=[f"{base}/pl", f"{base}/xx"], cities=cities)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # Both endpoints are requested at once, over one connection each
+    assert max(fetched) < 0.55
+    assert handler.connections == 2
+    snap_a, snap_b = (bike_status_changes.bikes_from_payload(json.loads(body)) for body in (a, b))
+    per_city = len(bike_status_changes.diff_snapshots(snap_a["Wrocław"], snap_b["Wrocław"], ""))
+    conn = sqlite3.connect(db_path)
+    try:
+        counts = dict(conn.execute("SELECT city, COUNT(*) FROM bike_status_changes GROUP BY city"))
+        state = bike_status_changes.load_state(conn)
+    finally:
+        conn.close()
+    assert counts == {"Wrocław": per_city, "Other Wrocław": per_city}
+    assert state[2] == {"Wrocław": snap_b["Wrocław"], "Other Wrocław": snap_b["Wrocław"]}
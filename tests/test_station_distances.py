@@ -0,0 +1,65 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+SRC_DIR = REPO_ROOT / "src"
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+import distance  # noqa: E402
+import station_distances as mod  # noqa: E402
+
+
+def _write_stations(path: Path, extra: str = "") -> None:
+    path.write_text(
+        "station_name,lat,lon\nA,51.100000,17.000000\nB,51.105000,17.010000\n# Magazyn,,\n" + extra,
+        encoding="utf-8",
+    )
+
+
+def test_cache_is_persisted_and_rebuilt_when_coords_change(tmp_path):
+    stations = tmp_path / "stations.csv"
+    cache = tmp_path / "pairs.npz"
+    _write_stations(stations)
+
+    table = mod.load_station_distances(str(stations), str(cache))
+    assert cache.exists()
+    assert list(table.names) == ["A", "B", "# Magazyn"]
+    expected = distance.distances_km([51.1], [17.0], [51.105], [17.01])[0]
+    assert table.matrix[0, 1] == table.matrix[1, 0] == expected
+    assert table.matrix[0, 0] == 0.0
+
+    # Same content -> cache reused; new station -> rebuilt
+    assert mod._read_cache(str(cache)).fingerprint == table.fingerprint
+    _write_stations(stations, "C,51.110000,17.020000\n")
+    rebuilt = mod.load_station_distances(str(stations), str(cache))
+    assert "C" in list(rebuilt.names)
+    assert mod._read_cache(str(cache)).fingerprint == rebuilt.fingerprint != table.fingerprint
+
+
+def test_pair_distances_falls_back_to_live_computation(tmp_path):
+    stations = tmp_path / "stations.csv"
+    _write_stations(stations)
+    table = mod.load_station_distances(str(stations))
+
+    got = mod.pair_distances(
+        table,
+        ["A", "Unknown", "A", "# Magazyn", "A"],
+        ["B", "B", "B", "A", "B"],
+        [51.1, 51.2, 51.3, np.nan, 51.1003],
+        [17.0, 17.0, 17.0, np.nan, 17.0],
+        [51.105, 51.105, 51.105, 51.1, 51.105],
+        [17.01, 17.01, 17.01, 17.0, 17.01],
+    )
+    live = distance.distances_km(
+        [51.1, 51.2, 51.3], [17.0, 17.0, 17.0], [51.105] * 3, [17.01] * 3
+    )
+    # Table hit, unknown station, and coordinates that disagree with the table
+    assert np.allclose(got[:3], live)
+    assert np.isnan(got[3])
+    # A start ~33 m off the station's coordinates is computed live, not looked up
+    off = distance.distances_km([51.1003], [17.0], [51.105], [17.01])[0]
+    assert np.isclose(got[4], off, rtol=0, atol=1e-9)
+    assert not np.isclose(got[4], got[0], rtol=0, atol=1e-3)
@@ -1,25 +1,93 @@
 /*
   Static web app for Wrocław Bike Stats
-  - Loads data from /data/processed/metrics/bikes-2025.json
+  - Loads /data/manifest.json, then only the per-month shards (and yearly
+    rollups) a view needs; falls back to a single /data/rides.json
   - Single day view: summary, histogram, top stations/routes
   - Date range view: line charts, averaged histogram, aggregated lists
+    (long ranges use the weekly/monthly rollups of the same file)
 */
 
-const DATA_URL = '/data/rides.json';
+const DATA_DIR = '/data';
+const MANIFEST_URL = `${DATA_DIR}/manifest.json`;
+const LEGACY_DATA_URL = `${DATA_DIR}/rides.json`;
 
 const state = {
-  raw: null, // full JSON
+  raw: { days: {}, weeks: {}, months: {} }, // metrics loaded so far, merged from shards
   dates: [], // sorted list of available dates (strings YYYY-MM-DD)
+  manifest: null, // null when serving the single rides.json
+  shards: new Map(), // shard file -> Promise (loaded or in flight)
+  prefix: {}, // month -> range index shard
+  renders: { single: 0, range: 0 }, // latest render per view; stale async renders bail out
 };
 
 function byId(id){ return document.getElementById(id); }
 
-async function loadData(){
-  const res = await fetch(DATA_URL, { cache: 'no-cache' });
+async function fetchJson(url){
+  const res = await fetch(url, { cache: 'no-cache' });
   if(!res.ok) throw new Error('Failed to load data: '+res.status);
-  const json = await res.json();
-  state.raw = json;
-  state.dates = Object.keys(json.days || {}).sort();
+  return res.json();
+}
+
+function mergeMetrics(json){
+  if (json.base){
+    state.prefix[json.month] = json; // range index shard
+    return;
+  }
+  ['days', 'weeks', 'months'].forEach(k => Object.assign(state.raw[k], json[k] || {}));
+}
+
+function isoDate(d){
+  return `${d.getFullYear()}-${String(d.getMonth()+1).padStart(2,'0')}-${String(d.getDate()).padStart(2,'0')}`;
+}
+
+// [[first, last], ...] runs of consecutive dates -> every date
+function expandRuns(runs){
+  const out = [];
+  (runs||[]).forEach(([first, last]) => {
+    for (const d = toDate(first); isoDate(d) <= last; d.setDate(d.getDate()+1)) out.push(isoDate(d));
+  });
+  return out;
+}
+
+async function loadData(){
+  let manifest = null;
+  try { manifest = await fetchJson(MANIFEST_URL); } catch (e) { manifest = null; }
+  if (manifest){
+    state.manifest = manifest;
+    const months = manifest.months || {};
+    state.dates = Object.keys(months).sort().flatMap(m => expandRuns(months[m].dates));
+    return;
+  }
+  mergeMetrics(await fetchJson(LEGACY_DATA_URL));
+  state.dates = Object.keys(state.raw.days).sort();
+}
+
+function loadShard(file){
+  if (!state.shards.has(file)){
+    const p = fetchJson(`${DATA_DIR}/${file}`).then(mergeMetrics);
+    p.catch(() => state.shards.delete(file)); // retry on the next request
+    state.shards.set(file, p);
+  }
+  return state.shards.get(file);
+}
+
+// Load the month shards holding `dates` (no-op for rides.json)
+async function ensureDays(dates){
+  if (!state.manifest) return;
+  const files = new Set();
+  dates.forEach(ds => {
+    const m = state.manifest.months[ds.slice(0,7)];
+    if (!state.raw.days[ds] && m) files.add(m.file);
+  });
+  await Promise.all([...files].map(loadShard));
+}
+
+// Load the weekly/monthly rollups of the years spanned by `dates`
+async function ensureRollups(dates){
+  if (!state.manifest) return;
+  const rollups = state.manifest.rollups || {};
+  const files = new Set(dates.map(ds => rollups[ds.slice(0,4)]).filter(Boolean));
+  await Promise.all([...files].map(loadShard));
 }
 
 function setActiveView(id){
@@ -30,7 +98,7 @@ function setActiveView(id){
   if (id === 'range-view'){
     const start = byId('range-start')?.value;
     const end = byId('range-end')?.value;
-    if (start && end) updateRange(start, end);
+    if (start && end) render(updateRange, start, end);
   }
 }
 
@@ -110,7 +178,10 @@ function nearestOnOrAfter(target){
 }
 
 // SINGLE DAY VIEW
-function updateSingle(dateStr){
+async function updateSingle(dateStr){
+  const token = ++state.renders.single;
+  await ensureDays([dateStr]);
+  if (token !== state.renders.single) return;
   const d = state.raw.days[dateStr];
   if(!d){
     byId('single-summary').innerHTML = '<div class="card">No data for selected date.</div>';
@@ -152,20 +223,134 @@ function filterDatesInRange(start, end){
   return state.dates.filter(d => d >= start && d <= end);
 }
 
-function aggregateHistogramAvg(dates){
-  const sums = Array(24).fill(0);
+// Ranges longer than this use the pre-computed weekly/monthly rollups
+const ROLLUP_MIN_DAYS = 62;
+
+function mondayOf(ds){
+  const d = toDate(ds);
+  d.setDate(d.getDate() - ((d.getDay() + 6) % 7));
+  return isoDate(d);
+}
+
+// [first, last] of the sorted `dates` per year (the range index restarts every year)
+function yearSegments(dates){
+  const segments = new Map();
   dates.forEach(ds => {
-    const h = state.raw.days[ds].bike_rentals_histogram || {};
-    for(let hour=0; hour<24; hour++) sums[hour] += (h[String(hour)]||0);
+    const seg = segments.get(ds.slice(0,4));
+    if (seg) seg[1] = ds; else segments.set(ds.slice(0,4), [ds, ds]);
+  });
+  return [...segments.values()];
+}
+
+// Load the range index shards of the first and last month of each year in
+// `dates`; resolves to false if one is not published
+async function ensurePrefix(dates){
+  if (!state.manifest) return false;
+  const files = state.manifest.prefix || {};
+  const months = [...new Set(yearSegments(dates).flat().map(ds => ds.slice(0,7)))];
+  if (!months.every(m => files[m])) return false;
+  await Promise.all(months.map(m => loadShard(files[m])));
+  return months.every(m => state.prefix[m]);
+}
+
+// The year's running hour and station totals up to `ds` (through it if
+// `inclusive`): the month shard's base plus its days before that point
+function runningTotals(ds, inclusive){
+  const ix = state.prefix[ds.slice(0,7)];
+  const hours = Array(24).fill(0);
+  const stations = new Map();
+  const add = (entry) => {
+    entry.hours.forEach((v, h) => { hours[h] += v; });
+    entry.stations.forEach(([k, arrivals, departures]) => {
+      const cur = stations.get(ix.stations[k]) || [0, 0];
+      stations.set(ix.stations[k], [cur[0] + arrivals, cur[1] + departures]);
+    });
+  };
+  add(ix.base);
+  Object.entries(ix.days).forEach(([d, entry]) => { if (d < ds || (inclusive && d === ds)) add(entry); });
+  return { hours, stations };
+}
+
+// Hourly rides and station counts over `dates`: per year, the difference of
+// the running totals at its first and last date (at most two shards each)
+function prefixRange(dates){
+  const hours = Array(24).fill(0);
+  const stations = new Map();
+  yearSegments(dates).forEach(([first, last]) => {
+    const from = runningTotals(first, false);
+    const to = runningTotals(last, true);
+    for (let h = 0; h < 24; h++) hours[h] += to.hours[h] - from.hours[h];
+    to.stations.forEach(([arr, dep], name) => {
+      const [arr0, dep0] = from.stations.get(name) || [0, 0];
+      if (arr === arr0 && dep === dep0) return;
+      const cur = stations.get(name) || { arrivals:0, departures:0 };
+      stations.set(name, { arrivals: cur.arrivals + arr - arr0, departures: cur.departures + dep - dep0 });
+    });
   });
-  const n = Math.max(1, dates.length);
+  return { days: dates.length, hours, stations };
+}
+
+function prefixHistogramAvg(range){
+  const n = Math.max(1, range.days);
+  return range.hours.map((v,i)=>({ x:String(i), y: Math.round(v/n) }));
+}
+
+// Exact top stations (not a sum of per-day top 5s); ties by name like the Python side
+function prefixBusiestStations(range, topN=5){
+  return [...range.stations.entries()]
+    .map(([station, v])=>({ station, ...v, total: v.arrivals + v.departures }))
+    .sort((a,b)=> b.total - a.total || (a.station < b.station ? -1 : a.station > b.station ? 1 : 0))
+    .slice(0,topN);
+}
+
+// Cover the available dates in [start, end] with pieces: the coarsest rollup
+// (from `kinds`, e.g. ['months', 'weeks']) whose dates all lie in the range,
+// else a single day. Each piece: { x, days, data, histogram }. Only the
+// rollups and the month shards of the uncovered days are loaded.
+async function rangePieces(dates, start, end, kinds){
+  if (kinds.length) await ensureRollups(dates);
+  const pieces = [];
+  const keyOf = { months: ds => ds.slice(0,7), weeks: mondayOf };
+  for (let i = 0; i < dates.length; ){
+    const ds = dates[i];
+    let piece = null;
+    for (const kind of kinds){
+      const r = (state.raw[kind] || {})[keyOf[kind](ds)];
+      if (r && r.start === ds && r.start >= start && r.end <= end){
+        piece = { x: ds, days: r.days, data: r, histogram: r.bike_rentals_histogram_avg || {} };
+        while (i < dates.length && dates[i] <= r.end) i++;
+        break;
+      }
+    }
+    if (!piece){
+      piece = { x: ds, days: 1, day: ds };
+      i++;
+    }
+    pieces.push(piece);
+  }
+  await ensureDays(pieces.filter(p => p.day).map(p => p.day));
+  pieces.filter(p => p.day).forEach(p => {
+    p.data = state.raw.days[p.day] || {};
+    p.histogram = p.data.bike_rentals_histogram || {};
+  });
+  return pieces;
+}
+
+function aggregateHistogramAvg(pieces){
+  const sums = Array(24).fill(0);
+  let n = 0;
+  pieces.forEach(p => {
+    for(let hour=0; hour<24; hour++) sums[hour] += (p.histogram[String(hour)]||0) * p.days;
+    n += p.days;
+  });
+  n = Math.max(1, n);
   return sums.map((v,i)=>({ x:String(i), y: Math.round(v/n) }));
 }
 
-function aggregateBusiestStations(dates, topN=5){
+function aggregateBusiestStations(pieces, topN=5){
   const map = new Map();
-  dates.forEach(ds => {
-    (state.raw.days[ds].busiest_stations_top5||[]).forEach(s=>{
+  pieces.forEach(p => {
+    (p.data.busiest_stations_top5||[]).forEach(s=>{
       const cur = map.get(s.station) || { arrivals:0, departures:0, total:0 };
       map.set(s.station, {
         arrivals: cur.arrivals + (s.arrivals||0),
@@ -180,11 +365,11 @@ function aggregateBusiestStations(dates, topN=5){
     .slice(0,topN);
 }
 
-function aggregateTopRoutes(dates, topN=5){
+function aggregateTopRoutes(pieces, topN=5){
   const map = new Map();
   const keyOf = (r)=> `${r.start_station} → ${r.end_station}`;
-  dates.forEach(ds => {
-    (state.raw.days[ds].top_routes_top5||[]).forEach(r=>{
+  pieces.forEach(p => {
+    (p.data.top_routes_top5||[]).forEach(r=>{
       const k = keyOf(r);
       const cur = map.get(k) || 0;
       map.set(k, cur + (r.rides||0));
@@ -193,9 +378,19 @@ function aggregateTopRoutes(dates, topN=5){
   return [...map.entries()].sort((a,b)=>b[1]-a[1]).slice(0,topN).map(([route,rides])=>({route,rides}));
 }
 
-function updateRange(start, end){
+async function updateRange(start, end){
   if (!start || !end) return;
+  const token = ++state.renders.range;
   const dates = filterDatesInRange(start, end);
+  const long = dates.length > ROLLUP_MIN_DAYS;
+  // Long ranges chart one point per week (totals as per-day averages) and
+  // aggregate over whole months/weeks; short ranges stay per day
+  const points = await rangePieces(dates, start, end, long ? ['weeks'] : []);
+  const pieces = long ? await rangePieces(dates, start, end, ['months', 'weeks']) : points;
+  // For long ranges the histogram and stations come from the range index when
+  // published; short ones sum the day shards they already loaded
+  const range = long && (await ensurePrefix(dates)) ? prefixRange(dates) : null;
+  if (token !== state.renders.range) return;
   const host = byId('range-metrics');
   host.innerHTML = '';
   METRICS.forEach(m => {
@@ -208,19 +403,35 @@ function updateRange(start, end){
     chartEl.className = 'chart';
     card.appendChild(title); card.appendChild(chartEl);
     host.appendChild(card);
-    const series = dates.map((ds)=>({ x: ds, y: state.raw.days[ds][m.key] || 0 }));
-    SimpleCharts.lineChart(chartEl, series, { yLabel: m.label, xLabel: 'Date' });
+    const perDay = !m.key.startsWith('avg_');
+    const series = points.map((p)=>({ x: p.x, y: ((p.data[m.key] || 0) / (perDay ? p.days : 1)) }));
+    SimpleCharts.lineChart(chartEl, series, { yLabel: long && perDay ? `${m.label} per day` : m.label, xLabel: 'Date' });
   });
 
-  SimpleCharts.barChart(byId('range-histogram'), aggregateHistogramAvg(dates), { xLabel: 'Hour', yLabel: 'Number of rentals' });
+  const histogram = range ? prefixHistogramAvg(range) : aggregateHistogramAvg(pieces);
+  SimpleCharts.barChart(byId('range-histogram'), histogram, { xLabel: 'Hour', yLabel: 'Number of rentals' });
 
-  const stations = aggregateBusiestStations(dates);
+  const stations = range ? prefixBusiestStations(range) : aggregateBusiestStations(pieces);
   renderStationsTable(byId('range-busiest'), stations);
 
-  const routes = aggregateTopRoutes(dates);
+  const routes = aggregateTopRoutes(pieces);
   renderRoutesTable(byId('range-routes'), routes);
 }
 
+function showError(e){
+  console.error(e);
+  document.querySelector('.container').innerHTML = `<div class="panel">${String(e)}</div>`;
+}
+
+// Run an async view update from an event handler; failures are shown like in main
+async function render(update, ...args){
+  try {
+    await update(...args);
+  } catch (e){
+    showError(e);
+  }
+}
+
 function initDates(){
   const min = state.dates[0];
   const max = state.dates[state.dates.length-1];
@@ -230,9 +441,9 @@ function initDates(){
     let v = clampDate(single.value, min, max);
     if (!isAvailableDate(v)) v = nearestAvailableAny(v);
     single.value = v;
-    updateSingle(v);
+    render(updateSingle, v);
   });
-  updateSingle(single.value);
+  render(updateSingle, single.value);
   byId('single-date-label').textContent = formatDateWithWeekday(single.value);
   single.addEventListener('change', ()=>{
     byId('single-date-label').textContent = formatDateWithWeekday(single.value);
@@ -257,7 +468,7 @@ function initDates(){
     // reflect back to inputs and tighten bounds
     start.value = s; end.value = e;
     start.max = e; end.min = s;
-    if (s && e && s <= e) updateRange(s, e);
+    if (s && e && s <= e) render(updateRange, s, e);
     byId('range-date-label').textContent = `${formatLongDate(s)} - ${formatLongDate(e)}`;
   };
   start.addEventListener('change', onChange);
@@ -281,8 +492,7 @@ async function main(){
     const desired = viewFromHash();
     if (desired) setActiveView(desired);
   } catch (e){
-    console.error(e);
-    document.querySelector('.container').innerHTML = `<div class="panel">${String(e)}</div>`;
+    showError(e);
   }
 }
 